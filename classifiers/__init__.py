@@ -1,6 +1,6 @@
 import numpy as np
 import pandas as pd
-from itertools import combinations
+from typing import Tuple
 import logging
 
 def jaccard_distance(a: pd.Series, b: pd.Series) -> float:
@@ -33,54 +33,206 @@ def compute_anomaly_indicators(charts: dict, charts_stats: dict, z_thresh: float
         indicators[itemid] = (z.abs() > z_thresh).astype(int)
     return indicators
 
+def compute_anomaly_indicator_matrix(charts: dict, charts_stats: dict, 
+                                     z_thresh: float = 2.0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (indicators, present), both N x T float32 0/1 matrices with rows
+    in the order of charts. Series are aligned on their index, present marks
+    the points in the index of each series, NaN valued or not, and missing
+    points are not anomalous.
+    """
+    itemids = list(charts.keys())
+    if len(itemids) == 0:
+        return np.zeros((0, 0), dtype=np.float32), np.zeros((0, 0), dtype=np.float32)
+    # T x N, missing points are NaN
+    values = pd.concat([charts[itemid] for itemid in itemids], axis=1, keys=range(len(itemids)))
+    present = pd.concat([pd.Series(1.0, index=charts[itemid].index) for itemid in itemids],
+                        axis=1, keys=range(len(itemids))).notna().to_numpy()
+    values = values.to_numpy(dtype=np.float64)
+    z_mean = np.array([charts_stats[itemid]['mean'] for itemid in itemids], dtype=np.float64)
+    z_std = np.array([charts_stats[itemid]['std'] for itemid in itemids], dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (values - z_mean) / np.where(z_std == 0, np.nan, z_std)
+    # NaN (missing point or zero std) compares as False.
+    # float32 keeps the counts of the matrix products exact up to 2^24 points
+    indicators = (np.abs(z) > z_thresh).T.astype(np.float32)
+    return indicators, present.T.astype(np.float32)
+
+def _block_rows(rows: slice, block_size: int):
+    """ slices of blocks of block_size rows of rows, all rows at once if block_size is 0 """
+    if block_size <= 0:
+        block_size = max(rows.stop - rows.start, 1)
+    for start in range(rows.start, rows.stop, block_size):
+        yield slice(start, min(start + block_size, rows.stop))
+
+def _range(part: slice, N: int) -> slice:
+    """ part of range(N) as a slice with start and stop, all of it if part is None """
+    if part is None:
+        return slice(0, N)
+    start, stop, _ = part.indices(N)
+    return slice(start, stop)
+
+def _zero_diagonal(dist: np.ndarray, rows: slice, columns: slice):
+    i = np.arange(rows.start, rows.stop)[:, None]
+    j = np.arange(columns.start, columns.stop)[None, :]
+    dist[i == j] = 0.0
+
+def iter_jaccard_distance_blocks(charts: dict, charts_stats: dict, 
+                                 sigma: float = 2.0, block_size: int = 0,
+                                 rows: slice = None, columns: slice = None):
+    """
+    Yields (rows, distances) for blocks of block_size rows of the Jaccard
+    distance matrix of charts, so that a large matrix is never held at once.
+    rows and columns restrict it to a part of the matrix, all of it by default.
+    """
+    # Anomaly indicators as an N x T matrix
+    indicators, present = compute_anomaly_indicator_matrix(charts, charts_stats, z_thresh=sigma)
+    N = len(indicators)
+    counts = indicators.sum(axis=1)
+    aligned = present.all()
+    rows = _range(rows, N)
+    columns = _range(columns, N)
+    col_indicators = indicators[columns]
+    col_counts = counts[columns]
+
+    # intersections from one matrix product, unions from the row sums.
+    # jaccard_distance(a_i, a_j) with i < j only counts the points of the union
+    # that a_i has (pandas' | on misaligned Series), hence anomalies of j at the
+    # points of i. It is counts[j] when all series have the same points.
+    for block in _block_rows(rows, block_size):
+        intersection = indicators[block] @ col_indicators.T
+        if aligned:
+            union = counts[block, None] + col_counts[None, :] - intersection
+        else:
+            i = np.arange(block.start, block.stop)[:, None]
+            j = np.arange(columns.start, columns.stop)[None, :]
+            union = np.where(i < j,
+                             counts[block, None] + present[block] @ col_indicators.T,
+                             col_counts[None, :] + indicators[block] @ present[columns].T) - intersection
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dist = np.where(union == 0, 1.0, 1.0 - intersection.astype(np.float64) / union)
+        _zero_diagonal(dist, block, columns)
+        yield block, dist
+
 def compute_jaccard_distance_matrix(charts: dict, charts_stats: dict, 
                                     sigma: float = 2.0) -> pd.DataFrame:
     itemids = list(charts.keys())
     N = len(itemids)
 
-    # Step 1: Precompute anomaly indicators
-    indicators = compute_anomaly_indicators(charts, charts_stats, z_thresh=sigma)
-
-    # Step 2: Initialize distance matrix
     dist_matrix = np.zeros((N, N))
-
-    for i, j in combinations(range(N), 2):
-        id_i, id_j = itemids[i], itemids[j]
-        a_i, a_j = indicators[id_i], indicators[id_j]
-
-        d_shape = jaccard_distance(a_i, a_j)
-        dist_matrix[i, j] = dist_matrix[j, i] = d_shape
-        #logging.info(f"jaccard_distance {id_i} {id_j} : {d_shape}")
+    for rows, dist in iter_jaccard_distance_blocks(charts, charts_stats, sigma=sigma):
+        dist_matrix[rows] = dist
 
     return pd.DataFrame(dist_matrix, index=itemids, columns=itemids)
 
-def compute_correlation_distance_matrix(charts: dict, diff_contribute_rate=0.5) -> pd.DataFrame:
+def _standardize(series: list) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (Z, present): the series aligned on the index into N x T rows
+    standardized over their own points, 0 at missing points, and the 0/1
+    presence matrix (None if every series has every point).
+    """
+    N = len(series)
+    if N == 0:
+        return np.zeros((0, 0)), None
+    # N x T aligned on the index, missing points are NaN
+    X = pd.concat(series, axis=1, keys=range(N)).to_numpy(dtype=np.float64).T
+    present = ~np.isnan(X)
+    n_points = present.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.nansum(X, axis=1) / n_points
+        std = np.sqrt(np.nansum(np.square(X - mean[:, None]), axis=1) / n_points)
+        Z = np.where(present, (X - mean[:, None]) / np.where(std > 0, std, 1.0)[:, None], 0.0)
+    if present.all():
+        return Z, None
+    return Z, present.astype(np.float64)
+
+def _correlation_rows(Z: np.ndarray, P: np.ndarray, rows: slice, columns: slice) -> np.ndarray:
+    """ rows x columns part of the correlation matrix of the standardized series Z """
+    N, T = Z.shape
+    sxy = Z[rows] @ Z[columns].T
+    if P is None:
+        # same points everywhere: the standardized rows have zero mean
+        n = np.full(sxy.shape, float(T))
+        sx = sy = np.zeros(sxy.shape)
+        sqr = np.square(Z).sum(axis=1)
+        sxx = np.broadcast_to(sqr[rows, None], sxy.shape)
+        syy = np.broadcast_to(sqr[None, columns], sxy.shape)
+    else:
+        # restrict the sums of each pair to the points both have
+        n = P[rows] @ P[columns].T
+        sx = Z[rows] @ P[columns].T
+        sy = P[rows] @ Z[columns].T
+        sxx = np.square(Z[rows]) @ P[columns].T
+        syy = P[rows] @ np.square(Z[columns]).T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sxy - sx * sy / n
+        var_x = sxx - np.square(sx) / n
+        var_y = syy - np.square(sy) / n
+        corr = cov / np.sqrt(var_x * var_y)
+    # constant on the common points, up to the rounding of the standardized values
+    tol = 1e-10 * n
+    corr[(n < 2) | (var_x <= tol) | (var_y <= tol)] = np.nan
+    return np.clip(corr, -1.0, 1.0)
+
+def compute_correlation_matrix(series: list) -> np.ndarray:
+    """
+    Pearson correlation of every pair of series, as Series.corr() computes it:
+    on the points both series have, NaN with less than 2 of them or when one
+    of the series is constant on them. Each row is standardized once over its
+    own points, so the pair sums come from a few N x T matrix products.
+    """
+    Z, P = _standardize(series)
+    return _correlation_rows(Z, P, slice(0, len(Z)), slice(0, len(Z)))
+
+def iter_correlation_distance_blocks(charts: dict, diff_contribute_rate=0.5, block_size: int = 0,
+                                     rows: slice = None, columns: slice = None):
+    """
+    Yields (rows, distances) for blocks of block_size rows of the correlation
+    distance matrix of charts, so that a large matrix is never held at once.
+    rows and columns restrict it to a part of the matrix, all of it by default.
+    """
     itemids = list(charts.keys())
     N = len(itemids)
-
-    diff_charts = {}
+    rows = _range(rows, N)
+    columns = _range(columns, N)
+
+    def prepare(series: list):
+        # correlation_distance() is 1.0 for a series with std() == 0
+        constant = np.array([s.std() == 0 for s in series], dtype=bool)
+        return _standardize(series) + (constant,)
+
+    def distances(prepared, block: slice) -> np.ndarray:
+        Z, P, constant = prepared
+        dist = 1 - np.abs(_correlation_rows(Z, P, block, columns))
+        dist[constant[block], :] = 1.0
+        dist[:, constant[columns]] = 1.0
+        return dist
+
+    shape = None
+    diff_shape = None
+    if diff_contribute_rate < 1.0:
+        shape = prepare([charts[itemid] for itemid in itemids])
     if diff_contribute_rate > 0:
         # Preprocess: difference the series to reduce level effects
-        for itemid in itemids:
-            diff_charts[itemid] = charts[itemid].diff().dropna()
-
-    # Step 1: Initialize distance matrix
-    dist_matrix = np.zeros((N, N))
-
-    for i, j in combinations(range(N), 2):
-        id_i, id_j = itemids[i], itemids[j]
-        s_i, s_j = charts[id_i], charts[id_j]
+        diff_shape = prepare([charts[itemid].diff().dropna() for itemid in itemids])
 
+    for block in _block_rows(rows, block_size):
         d_shape = 0
         d_shape_diff = 0
-        if diff_contribute_rate < 1.0:
-            d_shape = correlation_distance(s_i, s_j)
-        if diff_contribute_rate > 0:
-            s_i_diff, s_j_diff = diff_charts[id_i], diff_charts[id_j]
-            d_shape_diff = correlation_distance(s_i_diff, s_j_diff)
-        #dist_matrix[i, j] = dist_matrix[j, i] = d_shape
-        dist_matrix[i, j] = dist_matrix[j, i] = d_shape_diff* diff_contribute_rate + d_shape * (1 - diff_contribute_rate) 
-
-        #logging.info(f"correlation_distance {id_i} {id_j} : {d_shape}")
+        if shape is not None:
+            d_shape = distances(shape, block)
+        if diff_shape is not None:
+            d_shape_diff = distances(diff_shape, block)
+        dist = d_shape_diff * diff_contribute_rate + d_shape * (1 - diff_contribute_rate)
+        _zero_diagonal(dist, block, columns)
+        yield block, dist
+
+def compute_correlation_distance_matrix(charts: dict, diff_contribute_rate=0.5) -> pd.DataFrame:
+    itemids = list(charts.keys())
+    N = len(itemids)
+
+    dist_matrix = np.zeros((N, N))
+    for rows, dist in iter_correlation_distance_blocks(charts, diff_contribute_rate=diff_contribute_rate):
+        dist_matrix[rows] = dist
 
     return pd.DataFrame(dist_matrix, index=itemids, columns=itemids)
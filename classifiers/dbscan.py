@@ -1,29 +1,65 @@
 from typing import Dict, Tuple, List
 import numpy as np
 import pandas as pd
+from scipy import sparse
 from sklearn.cluster import DBSCAN
+from sklearn.neighbors import sort_graph_by_row_values
 from models.models_set import ModelsSet
 import data_getter 
+import utils.normalizer as normalizer
 
 from classifiers import *
 
 def df2charts(df: pd.DataFrame) -> Dict[int, pd.Series]:
-    charts = {}
-    for _, row in df.iterrows():
-        itemId = row.itemid
-        if itemId not in charts:
-            charts[itemId] = []
-        charts[itemId].append(row["value"])
-    
-    # convert to series
-    for itemId in charts:
-        charts[itemId] = pd.Series(charts[itemId])
-    
-    return charts
+    return normalizer.long2charts(df)
+
+def _sparse_distance_graph(blocks, N: int, eps: float) -> sparse.csr_matrix:
+    """
+    Collects the distances within eps from blocks of rows of a distance matrix
+    into a sparse N x N graph, float32, for DBSCAN on large sets of charts.
+    The distances are in [0, 1], so the dense path never rescales them.
+    NaN distances are the max distance there, which is only a neighbor if
+    every pair is.
+    """
+    rows, cols, data = [], [], []
+    nan_rows, nan_cols = [], []
+    max_dist = np.nan
+    for block_rows, dist in blocks:
+        nan = np.isnan(dist)
+        if not nan.all():
+            max_dist = np.nanmax([max_dist, np.nanmax(dist)])
+        r, c = np.nonzero(dist <= eps)
+        rows.append(r + block_rows.start)
+        cols.append(c)
+        data.append(dist[r, c].astype(np.float32))
+        r, c = np.nonzero(nan)
+        nan_rows.append(r + block_rows.start)
+        nan_cols.append(c)
+    if np.isnan(max_dist):
+        max_dist = 1.0
+    if max_dist <= eps:
+        rows += nan_rows
+        cols += nan_cols
+        data += [np.full(len(r), max_dist, dtype=np.float32) for r in nan_rows]
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+    data = np.concatenate(data) if data else np.zeros(0, dtype=np.float32)
+    # zero distances are kept as explicit entries, they are neighbors too
+    graph = sparse.csr_matrix((data, (rows, cols)), shape=(N, N))
+    return sort_graph_by_row_values(graph, copy=False, warn_when_not_sorted=False)
+
+def _use_sparse(charts: Dict[int, pd.Series], sparse_min_charts: int) -> bool:
+    return sparse_min_charts > 0 and len(charts) >= sparse_min_charts
 
 def _run_jaccard_dbscan(sigma: float, jaccard_eps: float, min_samples: int,
                         charts: Dict[int, pd.Series], 
-                        chart_stats: Dict):
+                        chart_stats: Dict,
+                        sparse_min_charts: int = 0, sparse_block_size: int = 1000):
+    if _use_sparse(charts, sparse_min_charts):
+        blocks = iter_jaccard_distance_blocks(charts, chart_stats, sigma=sigma, block_size=sparse_block_size)
+        graph = _sparse_distance_graph(blocks, len(charts), jaccard_eps)
+        return DBSCAN(eps=jaccard_eps, min_samples=min_samples, metric='precomputed').fit(graph)
+
     # compute jaccard distance matrix
     distance_matrix = compute_jaccard_distance_matrix(charts, chart_stats, sigma=sigma)
     matrix_size = (distance_matrix.max().max() - distance_matrix.min().min())
@@ -46,7 +82,13 @@ def _run_jaccard_dbscan(sigma: float, jaccard_eps: float, min_samples: int,
 
 
 def _run_correlation_dbscan(eps: float, min_samples: int,
-                        charts: Dict[int, pd.Series]):
+                        charts: Dict[int, pd.Series],
+                        sparse_min_charts: int = 0, sparse_block_size: int = 1000):
+    if _use_sparse(charts, sparse_min_charts):
+        blocks = iter_correlation_distance_blocks(charts, diff_contribute_rate=0.5, block_size=sparse_block_size)
+        graph = _sparse_distance_graph(blocks, len(charts), eps)
+        return DBSCAN(eps=eps, min_samples=min_samples, metric='precomputed').fit(graph)
+
     distance_matrix = compute_correlation_distance_matrix(charts, diff_contribute_rate=0.5)
     matrix_size = (distance_matrix.max().max() - distance_matrix.min().min())
     # Ensure the distance matrix values are normalized between 0 and 1
@@ -66,17 +108,15 @@ def _run_correlation_dbscan(eps: float, min_samples: int,
 
 
 
-def classify_charts(conf: Dict, data_source_name, 
-        itemIds: List[int], endep: int,
-        ) -> Tuple[Dict[int, int], Dict[int, pd.Series], Dict[int, pd.Series]]:
-
-    dbscan_conf = conf.get('dbscan', {})
-    jaccard_eps = dbscan_conf.get('jaccard_eps', 0.1)
-    min_samples = dbscan_conf.get('min_samples', 2)
-    sigma = dbscan_conf.get('sigma', 2.0)
-    corr_eps = dbscan_conf.get('corr_eps', 0.4)
-    
-    
+def load_charts(conf: Dict, data_source_name, itemIds: List[int], endep: int,
+        ) -> Tuple[Dict, Dict[int, pd.Series], Dict[int, pd.Series]]:
+    """
+    Returns (chart_stats, hist_charts, charts) of the itemIds that have trends stats:
+    the local history of the classify period and the same with the trends before it,
+    charts in itemid order. Empty if there is no history.
+    The history charts come from HistoryModel.get_charts(), which reads the
+    rows of the mmap history store without building a long frame.
+    """
     data_sources = conf['data_sources']
     data_source = data_sources[data_source_name]
     classify_period = data_source.get('anomaly_keep_secs', 3600 * 24)
@@ -91,10 +131,36 @@ def classify_charts(conf: Dict, data_source_name,
     if len(itemIds) == 0:
         return {}, {}, {}
 
-    
-    hist_df = ms.history.get_charts_df(itemIds, startep, endep)
-    hist_charts = df2charts(hist_df)
+    hist_charts = ms.history.get_charts(itemIds, startep, endep)
+    if len(hist_charts) == 0:
+        return {}, {}, {}
 
+    dg = data_getter.get_data_getter(data_source)
+    trends_df = dg.get_trends_data(trends_startep, startep-1, itemIds)
+    trends_charts = {}
+    if len(trends_df) > 0:
+        trends_charts = df2charts(trends_df.sort_values(by=['itemid', 'clock'], kind='stable'))
+    # the trends end before the history starts, so each chart is its trends then its history
+    charts = {}
+    for itemId in sorted(trends_charts.keys() | hist_charts.keys()):
+        parts = [c[itemId].to_numpy() for c in (trends_charts, hist_charts) if itemId in c]
+        charts[itemId] = pd.Series(parts[0] if len(parts) == 1 else np.concatenate(parts), copy=False)
+    return chart_stats, hist_charts, charts
+
+
+def classify_charts(conf: Dict, data_source_name, 
+        itemIds: List[int], endep: int,
+        ) -> Tuple[Dict[int, int], Dict[int, pd.Series], Dict[int, pd.Series]]:
+
+    dbscan_conf = conf.get('dbscan', {})
+    jaccard_eps = dbscan_conf.get('jaccard_eps', 0.1)
+    min_samples = dbscan_conf.get('min_samples', 2)
+    sigma = dbscan_conf.get('sigma', 2.0)
+    corr_eps = dbscan_conf.get('corr_eps', 0.4)
+    sparse_min_charts = dbscan_conf.get('sparse_min_charts', 2000)
+    sparse_block_size = dbscan_conf.get('sparse_block_size', 1000)
+    
+    chart_stats, hist_charts, charts = load_charts(conf, data_source_name, itemIds, endep)
     if len(hist_charts) == 0:
         return {}, {}, {}
 
@@ -103,7 +169,9 @@ def classify_charts(conf: Dict, data_source_name,
         jaccard_eps=jaccard_eps,
         min_samples=min_samples,
         charts=hist_charts,
-        chart_stats=chart_stats
+        chart_stats=chart_stats,
+        sparse_min_charts=sparse_min_charts,
+        sparse_block_size=sparse_block_size,
     )
     # chart_ids per labels
     db_groups = {}
@@ -116,13 +184,8 @@ def classify_charts(conf: Dict, data_source_name,
     clusters = {chart_id: jaccard_db.labels_[i] for i, chart_id in enumerate(hist_charts.keys())}
     max_cluster_id = max(db_groups.keys())
 
-    dg = data_getter.get_data_getter(data_source)
-    trends_df = dg.get_trends_data(trends_startep, startep-1, itemIds)
-    df = pd.concat([trends_df, hist_df], ignore_index=True)
-    df = df.sort_values(by=['itemid', 'clock'])
-
-
-    charts = df2charts(df)
+    # the same chart data as a NumPy array, each row is a chart
+    _, data = normalizer.charts2matrix(charts)
 
     # calculate diff between current and previous values per chart
     #for itemId, series in charts.items():
@@ -143,6 +206,8 @@ def classify_charts(conf: Dict, data_source_name,
             eps=corr_eps,
             min_samples=min_samples,
             charts={chart_id: charts[chart_id] for chart_id in group},
+            sparse_min_charts=sparse_min_charts,
+            sparse_block_size=sparse_block_size,
         )
 
         # Update labels for the group
@@ -155,10 +220,6 @@ def classify_charts(conf: Dict, data_source_name,
         max_cluster_id = max(clusters.values())
     
     
-    # Convert chart data to a NumPy array
-    aligned_charts = pd.DataFrame(charts).T  # Each row is a chart
-    data = aligned_charts.values
-
     # Extract centroids (mean of points in each cluster)
     centroids = {}
     for cluster_id in range(max_cluster_id+1):
@@ -0,0 +1,156 @@
+"""
+Incremental cluster assignment across runs.
+
+dbscan.classify_charts() clusters every chart from scratch. classify_charts_incremental()
+keeps the cluster of each classified item in ms.clusters, with up to
+max_representatives members per cluster, and only places the items that are new
+since the last run. A new item joins the cluster of its nearest representative
+(correlation distance) among those within jaccard_eps and corr_eps of it, the
+neighbor conditions of the two DBSCAN stages, and is noise otherwise.
+
+A full classify_charts() replaces the stored clusters when there are none, when
+they are older than reclassify_secs, or when the new items that fit no cluster
+exceed reclassify_drift of the classified items.
+"""
+from typing import Dict, List
+import logging
+
+import numpy as np
+import pandas as pd
+
+from models.models_set import ModelsSet
+from classifiers import iter_jaccard_distance_blocks, iter_correlation_distance_blocks, _standardize
+import classifiers.dbscan as dbscan
+
+
+def log(msg, level=logging.INFO):
+    msg = f"[classifiers/incremental.py] {msg}"
+    logging.log(level, msg)
+
+
+def select_representatives(clusters: Dict[int, int], charts: Dict[int, pd.Series],
+                           max_representatives: int) -> List[int]:
+    """
+    Up to max_representatives members of each cluster, those whose charts
+    correlate best with the mean standardized chart of the cluster.
+    """
+    by_cluster = {}
+    for itemId, clusterId in clusters.items():
+        if clusterId >= 0 and itemId in charts:
+            by_cluster.setdefault(clusterId, []).append(itemId)
+
+    representatives = []
+    for members in by_cluster.values():
+        if len(members) <= max_representatives:
+            representatives.extend(members)
+            continue
+        Z, _ = _standardize([charts[itemId] for itemId in members])
+        score = Z @ Z.mean(axis=0)
+        order = np.argsort(-score, kind='stable')[:max_representatives]
+        representatives.extend([members[k] for k in order])
+    return representatives
+
+
+def _reclassify(conf: Dict, data_source_name, itemIds: List[int], endep: int,
+                ms: ModelsSet, max_representatives: int) -> Dict[int, int]:
+    clusters, _, charts = dbscan.classify_charts(conf, data_source_name, itemIds, endep=endep)
+    clusters = {int(itemId): int(clusterId) for itemId, clusterId in clusters.items()}
+    representatives = set(select_representatives(clusters, charts, max_representatives))
+    df = pd.DataFrame({
+        'itemid': list(clusters.keys()),
+        'clusterid': list(clusters.values()),
+        'representative': [int(itemId in representatives) for itemId in clusters],
+        'created': int(endep),
+    })
+    ms.clusters.replace_members_df(df)
+    log(f"classified {len(clusters)} items, {len(set(clusters.values()) - {-1})} clusters")
+    return clusters
+
+
+def classify_charts_incremental(conf: Dict, data_source_name,
+        itemIds: List[int], endep: int) -> Dict[int, int]:
+    """
+    Returns {itemid: clusterid} of itemIds, -1 for noise, like the clusters of
+    dbscan.classify_charts(), and stores them for the next run.
+    """
+    dbscan_conf = conf.get('dbscan', {})
+    jaccard_eps = dbscan_conf.get('jaccard_eps', 0.1)
+    min_samples = dbscan_conf.get('min_samples', 2)
+    sigma = dbscan_conf.get('sigma', 2.0)
+    corr_eps = dbscan_conf.get('corr_eps', 0.4)
+    block_size = dbscan_conf.get('sparse_block_size', 1000)
+    reclassify_drift = dbscan_conf.get('reclassify_drift', 0.1)
+    reclassify_secs = dbscan_conf.get('reclassify_secs', 86400)
+    max_representatives = dbscan_conf.get('max_representatives', 5)
+
+    ms = ModelsSet(data_source_name)
+    itemIds = list(dict.fromkeys([int(itemId) for itemId in itemIds]))
+    members = ms.clusters.read_members()
+    if reclassify_drift <= 0 or len(members) == 0:
+        return _reclassify(conf, data_source_name, itemIds, endep, ms, max_representatives)
+    classified = int(members['created'].min())
+    if classified < endep - reclassify_secs:
+        log(f"clusters classified at {classified} are older than {reclassify_secs} secs, reclassifying")
+        return _reclassify(conf, data_source_name, itemIds, endep, ms, max_representatives)
+
+    # items no longer in itemIds leave their clusters, too small clusters become noise
+    members = members[members['itemid'].isin(itemIds)].copy()
+    sizes = members.groupby('clusterid')['itemid'].transform('count')
+    members.loc[(members['clusterid'] >= 0) & (sizes < min_samples), 'clusterid'] = -1
+    members.loc[members['clusterid'] < 0, 'representative'] = 0
+    # clusters whose representatives all left are represented by remaining members
+    represented = members.loc[members['representative'] == 1, 'clusterid'].unique()
+    orphans = members[(members['clusterid'] >= 0) & ~members['clusterid'].isin(represented)]
+    members.loc[orphans.groupby('clusterid').head(max_representatives).index, 'representative'] = 1
+
+    clusters = dict(zip(members['itemid'].tolist(), members['clusterid'].tolist()))
+    new_itemIds = [itemId for itemId in itemIds if itemId not in clusters]
+    rep_itemIds = members.loc[members['representative'] == 1, 'itemid'].tolist()
+
+    frames = [members]
+    if len(new_itemIds) > 0:
+        chart_stats, hist_charts, charts = dbscan.load_charts(conf, data_source_name,
+                                                              rep_itemIds + new_itemIds, endep)
+        # like classify_charts(), items without local history are not classified
+        rep_itemIds = [itemId for itemId in rep_itemIds if itemId in hist_charts]
+        new_itemIds = [itemId for itemId in new_itemIds if itemId in hist_charts]
+        R = len(rep_itemIds)
+        assigned = np.full(len(new_itemIds), -1, dtype=np.int64)
+        if R > 0 and len(new_itemIds) > 0:
+            # representatives first, then the new items: rows of new items x columns of representatives
+            ordered = rep_itemIds + new_itemIds
+            jaccard_blocks = iter_jaccard_distance_blocks({itemId: hist_charts[itemId] for itemId in ordered},
+                                                          chart_stats, sigma=sigma, block_size=block_size,
+                                                          rows=slice(R, None), columns=slice(0, R))
+            corr_blocks = iter_correlation_distance_blocks({itemId: charts[itemId] for itemId in ordered},
+                                                           diff_contribute_rate=0.5, block_size=block_size,
+                                                           rows=slice(R, None), columns=slice(0, R))
+            rep_clusters = np.array([clusters[itemId] for itemId in rep_itemIds], dtype=np.int64)
+            for (rows, jaccard), (_, corr) in zip(jaccard_blocks, corr_blocks):
+                # neighbors of both the Jaccard and the correlation DBSCAN, NaN never is
+                dist = np.where((jaccard <= jaccard_eps) & (corr <= corr_eps), corr, np.inf)
+                nearest = np.argmin(dist, axis=1)
+                found = np.isfinite(dist[np.arange(len(dist)), nearest])
+                assigned[rows.start - R:rows.stop - R] = np.where(found, rep_clusters[nearest], -1)
+
+        unassigned = int((assigned == -1).sum())
+        drift = unassigned / max(len(clusters) + len(new_itemIds), 1)
+        log(f"{len(new_itemIds) - unassigned} of {len(new_itemIds)} new items joined clusters of "
+            f"{R} representatives, drift {drift:.3f}")
+        if drift > reclassify_drift:
+            log(f"drift {drift:.3f} exceeds {reclassify_drift}, reclassifying")
+            return _reclassify(conf, data_source_name, itemIds, endep, ms, max_representatives)
+
+        clusters.update(dict(zip(new_itemIds, assigned.tolist())))
+        frames.append(pd.DataFrame({
+            'itemid': new_itemIds,
+            'clusterid': assigned,
+            'representative': 0,
+            'created': classified,
+        }))
+
+    ms.clusters.remove_itemIds_not_in(itemIds)
+    frames = [df for df in frames if len(df) > 0]
+    if len(frames) > 0:
+        ms.clusters.upsert_members_df(pd.concat(frames, ignore_index=True))
+    return clusters
@@ -0,0 +1,163 @@
+"""
+Concurrent fetch of the split Zabbix tables (history/history_uint, trends/trends_uint).
+
+Each table is queried on its own connection with ORDER BY itemid, clock and
+the ordered results are merged, instead of sending one UNION statement and
+sorting the whole result again in pandas. An item stores its values in exactly
+one of the tables, so no deduplication is needed.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
+from typing import Any, Callable, Dict, List
+import threading
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def log(msg, level=logging.INFO):
+    msg = f"[data_getter/concurrent_fetch.py] {msg}"
+    logging.log(level, msg)
+
+
+def read_concurrently(read: Callable[[str], pd.DataFrame], sqls: List[str]) -> List[pd.DataFrame]:
+    """
+    Runs read(sql) for each of sqls on its own thread, results in the order of sqls.
+    read must be safe to call from several threads (a pooled or per thread connection).
+    """
+    if len(sqls) == 1:
+        return [read(sqls[0])]
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=len(sqls)) as executor:
+        frames = list(executor.map(read, sqls))
+    log(f"read {sum(len(df) for df in frames)} rows from {len(sqls)} queries in {time.time() - start:.3f} secs",
+        level=logging.DEBUG)
+    return frames
+
+
+class FetchWorkers:
+    """
+    Long-lived threads and connections for the per-table reads of a data getter,
+    reused across batches and released with close().
+    With open_conn, up to n_workers connections are opened on first use and each
+    read checks one out, for connections that are not thread-safe (MySqlDB).
+    """
+    def __init__(self, name: str, n_workers: int,
+                 open_conn: Callable[[], Any] = None, close_conn: Callable[[Any], None] = None):
+        self.name = name
+        self.n_workers = n_workers
+        self.open_conn = open_conn
+        self.close_conn = close_conn
+        self._executor = None
+        self._conns = Queue()
+        self._opened = []
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.n_workers, thread_name_prefix=self.name)
+            return self._executor
+
+    def _checkout(self):
+        try:
+            return self._conns.get_nowait()
+        except Empty:
+            pass
+        with self._lock:
+            if len(self._opened) < self.n_workers:
+                conn = self.open_conn()
+                self._opened.append(conn)
+                return conn
+        return self._conns.get()
+
+    def _read(self, read: Callable[[str, Any], pd.DataFrame], sql: str) -> pd.DataFrame:
+        if self.open_conn is None:
+            return read(sql, None)
+        conn = self._checkout()
+        try:
+            return read(sql, conn)
+        finally:
+            self._conns.put(conn)
+
+    def map(self, read: Callable[[str, Any], pd.DataFrame], sqls: List[str]) -> List[pd.DataFrame]:
+        """ read(sql, conn) for each of sqls on the worker threads, results in the order of sqls """
+        if len(sqls) == 1:
+            return [self._read(read, sqls[0])]
+        start = time.time()
+        frames = list(self._get_executor().map(lambda sql: self._read(read, sql), sqls))
+        log(f"read {sum(len(df) for df in frames)} rows from {len(sqls)} queries in {time.time() - start:.3f} secs",
+            level=logging.DEBUG)
+        return frames
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            opened, self._opened = self._opened, []
+            self._conns = Queue()
+        if self.close_conn is not None:
+            for conn in opened:
+                self.close_conn(conn)
+
+
+def merge_sorted(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    k-way merge of frames each sorted by itemid and clock.
+    The rows are placed with binary searches on one int64 key that orders like
+    (itemid, clock), so the sorted runs are never sorted again.
+    Rows with equal keys keep the order of frames.
+    """
+    frames = [df for df in frames if len(df) > 0]
+    if len(frames) == 0:
+        return None
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+
+    itemids = np.unique(np.concatenate([df['itemid'].to_numpy(dtype=np.int64) for df in frames]))
+    min_clock = min(int(df['clock'].min()) for df in frames)
+    span = max(int(df['clock'].max()) for df in frames) - min_clock + 1
+
+    def sort_key(df: pd.DataFrame) -> np.ndarray:
+        ranks = np.searchsorted(itemids, df['itemid'].to_numpy(dtype=np.int64))
+        return ranks * span + (df['clock'].to_numpy(dtype=np.int64) - min_clock)
+
+    merged = frames[0].reset_index(drop=True)
+    merged_key = sort_key(merged)
+    for df in frames[1:]:
+        key = sort_key(df)
+        # final position = own position + rows of the other side placed before it
+        pos_a = np.arange(len(merged_key)) + np.searchsorted(key, merged_key, side='left')
+        pos_b = np.arange(len(key)) + np.searchsorted(merged_key, key, side='right')
+        order = np.empty(len(merged_key) + len(key), dtype=np.int64)
+        order[pos_a] = np.arange(len(merged_key))
+        order[pos_b] = len(merged_key) + np.arange(len(key))
+        merged = pd.concat([merged, df], ignore_index=True).take(order).reset_index(drop=True)
+        merged_key = np.concatenate([merged_key, key])[order]
+    return merged
+
+
+def read_merged(read: Callable, sqls: List[str],
+                fields: List[str], dtypes: Dict[str, str], workers: FetchWorkers = None) -> pd.DataFrame:
+    """
+    Reads the ordered sqls concurrently and merges them into one frame with
+    columns fields, sorted by itemid and clock. Empty frame if there are no rows.
+    read(sql) runs on new threads, or read(sql, conn) on workers if given.
+    """
+    if workers is not None:
+        frames = workers.map(read, sqls)
+    else:
+        frames = read_concurrently(read, sqls)
+    typed = []
+    for df in frames:
+        if len(df) == 0:
+            continue
+        df.columns = fields
+        typed.append(df.astype(dtypes))
+    df = merge_sorted(typed)
+    if df is None:
+        return pd.DataFrame(columns=fields, dtype=object)
+    return df
@@ -0,0 +1,154 @@
+"""
+Columnar on-disk cache of a CSV data file for CsvGetter.
+
+The CSV file is parsed once, sorted by (itemid, clock) and written as one .npy
+file per column plus an itemid -> row offset index and an (item, clock) search
+key. Later reads memory-map the columns and only touch the rows of the requested
+items and time range. The cache is rebuilt when the size or mtime of the CSV
+file changes. Builds are serialized across processes with a lock file.
+"""
+import os
+import fcntl
+import json
+import hashlib
+import shutil
+import logging
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+
+# bump when the files of the cache change
+CACHE_FORMAT = 2
+
+
+def log(msg, level=logging.INFO):
+    msg = f"[data_getter/csv_cache.py] {msg}"
+    logging.log(level, msg)
+
+
+class ColumnarCache:
+    def __init__(self, src_path: str, cache_dir: str, columns: List[str], parse: Callable[[], pd.DataFrame]):
+        """
+        parse() returns the cleaned contents of src_path with `columns`,
+        itemid and clock as integers.
+        """
+        self.src_path = src_path
+        self.columns = columns
+        self.parse = parse
+        abs_path = os.path.abspath(src_path)
+        name = f"{os.path.basename(abs_path)}.{hashlib.md5(abs_path.encode()).hexdigest()[:8]}"
+        self.path = os.path.join(cache_dir, name)
+
+        self._source = None
+        self._arrays: Dict[str, np.ndarray] = {}
+
+    def _source_stat(self) -> Dict:
+        st = os.stat(self.src_path)
+        return {"src_path": os.path.abspath(self.src_path), "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                "format": CACHE_FORMAT}
+
+    def _read_meta(self) -> Dict:
+        meta_path = os.path.join(self.path, "meta.json")
+        if not os.path.exists(meta_path):
+            return {}
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def _build(self, source: Dict):
+        df = self.parse()
+        df = df.sort_values(['itemid', 'clock'], kind='stable')
+        itemids = df['itemid'].to_numpy(dtype=np.int64)
+        items, starts = np.unique(itemids, return_index=True)
+        offsets = np.append(starts, len(itemids)).astype(np.int64)
+        # rank * span + clock - min_clock orders like (itemid, clock), one searchsorted finds
+        # the time range of every item
+        clocks = df['clock'].to_numpy(dtype=np.int64)
+        min_clock = int(clocks.min()) if len(clocks) > 0 else 0
+        span = int(clocks.max()) - min_clock + 1 if len(clocks) > 0 else 1
+        ranks = np.repeat(np.arange(len(items), dtype=np.int64), np.diff(offsets))
+        keys = ranks * span + (clocks - min_clock)
+        meta = dict(source, min_clock=min_clock, span=span)
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for col in self.columns:
+            dtype = np.int64 if col in ['itemid', 'clock'] else np.float64
+            np.save(os.path.join(tmp_path, f"{col}.npy"), df[col].to_numpy(dtype=dtype))
+        np.save(os.path.join(tmp_path, "_items.npy"), items)
+        np.save(os.path.join(tmp_path, "_offsets.npy"), offsets)
+        np.save(os.path.join(tmp_path, "_keys.npy"), keys)
+        # meta is written last, a directory without it is never used
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        try:
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # another builder put its cache there first (e.g. where flock is not honored)
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not self._is_current(source):
+                raise
+            return
+        log(f"built {self.path}: {len(df)} rows, {len(items)} items")
+
+    def _is_current(self, source: Dict) -> bool:
+        meta = self._read_meta()
+        return all(meta.get(k) == v for k, v in source.items())
+
+    def _load(self):
+        source = self._source_stat()
+        if self._source == source:
+            return
+        if not self._is_current(source):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # pool workers forked before the first read all build at once,
+            # the first one to get the lock builds and the others use its cache
+            with open(f"{self.path}.lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    if not self._is_current(source):
+                        self._build(source)
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        meta = self._read_meta()
+        arrays = {}
+        for col in self.columns + ["_items", "_offsets", "_keys"]:
+            arrays[col] = np.load(os.path.join(self.path, f"{col}.npy"), mmap_mode='r')
+        self._arrays = arrays
+        self._min_clock = int(meta["min_clock"])
+        self._span = int(meta["span"])
+        self._source = source
+
+    def read(self, startep: int, endep: int, itemIds: List[int] = []) -> pd.DataFrame:
+        """
+        Rows with startep <= clock <= endep of itemIds (all items if empty),
+        sorted by itemid and clock.
+        """
+        self._load()
+        items = self._arrays["_items"]
+        keys = self._arrays["_keys"]
+        span = self._span
+
+        if len(itemIds) > 0:
+            wanted = np.unique(np.asarray(itemIds, dtype=np.int64))
+            wanted = wanted[np.isin(wanted, items)]
+            pos = np.searchsorted(items, wanted).astype(np.int64)
+        else:
+            pos = np.arange(len(items), dtype=np.int64)
+
+        # bounds of [startep, endep] of every item, clipped into the item's key range
+        lo_key = pos * span + min(max(int(startep) - self._min_clock, 0), span)
+        hi_key = pos * span + min(max(int(endep) - self._min_clock, -1), span - 1)
+        lo = np.searchsorted(keys, lo_key, side='left')
+        hi = np.searchsorted(keys, hi_key, side='right')
+        counts = np.maximum(hi - lo, 0)
+        # one index array: lo of each range repeated plus the position within the range
+        total = int(counts.sum())
+        ends = np.cumsum(counts)
+        rows = np.repeat(lo - (ends - counts), counts) + np.arange(total, dtype=np.int64)
+
+        return pd.DataFrame({col: np.asarray(self._arrays[col][rows]) for col in self.columns})
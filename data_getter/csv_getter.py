@@ -1,9 +1,10 @@
 """
 class to get data from CSV files
 """
-import os, json, csv, gzip
+import os, json, csv, gzip, tempfile
 
 from data_getter.data_getter import DataGetter
+from data_getter.csv_cache import ColumnarCache
 from typing import Dict, List
 import pandas as pd # type: ignore
 
@@ -16,49 +17,56 @@ class CsvGetter(DataGetter):
     
     def init_data_source(self, data_source_config):
         self.data_dir = data_source_config['data_dir']
+
+        # history and trends are parsed once into a columnar cache, see data_getter/csv_cache.py
+        self.history_cache = None
+        self.trends_cache = None
+        if data_source_config.get('csv_cache', True):
+            cache_dir = data_source_config.get('csv_cache_dir', "")
+            if cache_dir == "":
+                cache_dir = os.path.join(tempfile.gettempdir(), "anomdec_csv_cache")
+            self.history_cache = ColumnarCache(os.path.join(self.data_dir, self.history_filename), 
+                                               cache_dir, self.fields, self._read_history_csv)
+            self.trends_cache = ColumnarCache(os.path.join(self.data_dir, self.trends_filename), 
+                                              cache_dir, self.fields_full, self._read_trends_csv)
         
 
     def check_conn(self) -> bool:
         # check if the data_dir exists
         return os.path.exists(self.data_dir)
-    
-    def get_history_data(self, startep: int, endep: int, itemIds: List[int] = [], use_cache=False) -> pd.DataFrame:
-        df = pd.read_csv(os.path.join(self.data_dir, self.history_filename), header=0)
+
+    def _read_csv(self, filename: str, fields: List[str], fillna=False) -> pd.DataFrame:
+        df = pd.read_csv(os.path.join(self.data_dir, filename), header=0)
         if len(df) == 0:
-            return pd.DataFrame(columns=self.fields)
-        df.columns = self.fields
+            return pd.DataFrame(columns=fields)
+        df.columns = fields
 
-        # remove rows with str values
+        # remove header rows of concatenated files
         df = df[df['clock'] != 'clock']
+        if fillna:
+            df = df.fillna(0)
 
-        # convert itemid to int
+        # convert to numbers and drop rows without a valid itemid or clock
+        for col in fields:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+        df = df.dropna(subset=['itemid', 'clock'])
         df['itemid'] = df['itemid'].astype(int)
-        # convert clock to int
-        df['clock'] = df['clock'].astype(int)
-        # convert value to float
-        df['value'] = df['value'].astype(float)
-
-        # filter by time
-        # Ensure 'clock' column is numeric and drop invalid rows
-        df['clock'] = pd.to_numeric(df['clock'], errors='coerce')
-        df = df.dropna(subset=['clock'])
         df['clock'] = df['clock'].astype(int)
+        for col in fields[2:]:
+            df[col] = df[col].astype(float)
+        return df
 
-        # Filter by time
-        # Ensure 'clock' column is numeric and drop invalid rows
-        df['clock'] = pd.to_numeric(df['clock'], errors='coerce')
-        df = df.dropna(subset=['clock'])
-        df['clock'] = df['clock'].astype(int)
+    def _read_history_csv(self) -> pd.DataFrame:
+        return self._read_csv(self.history_filename, self.fields)
 
-        # Filter by time
-        # Ensure 'clock' column is numeric and drop invalid rows
-        df['clock'] = pd.to_numeric(df['clock'], errors='coerce')
-        df = df.dropna(subset=['clock'])
-        df['clock'] = df['clock'].astype(int)
+    def _read_trends_csv(self) -> pd.DataFrame:
+        return self._read_csv(self.trends_filename, self.fields_full, fillna=True)
 
-        # Filter by time
-        df = df[(df['clock'] >= startep)]
-        df = df[(df['clock'] <= endep)]
+    def _filter(self, df: pd.DataFrame, startep: int, endep: int, itemIds: List[int] = []) -> pd.DataFrame:
+        if len(df) == 0:
+            return df
+        # filter by time
+        df = df[(df['clock'] >= startep) & (df['clock'] <= endep)]
 
         # filter by itemIds
         if len(itemIds) > 0:
@@ -68,6 +76,11 @@ class CsvGetter(DataGetter):
         df = df.sort_values(['itemid', 'clock'])
         return df
     
+    def get_history_data(self, startep: int, endep: int, itemIds: List[int] = [], use_cache=False) -> pd.DataFrame:
+        if self.history_cache is not None:
+            return self.history_cache.read(startep, endep, itemIds)
+        return self._filter(self._read_history_csv(), startep, endep, itemIds)
+    
     def get_trends_data(self, startep: int, endep: int, itemIds: List[int] = [], use_cache=False) -> pd.DataFrame:
         df = self.get_trends_full_data(startep, endep, itemIds)
         # convert value_avg to value
@@ -78,38 +91,9 @@ class CsvGetter(DataGetter):
     
     
     def get_trends_full_data(self, startep: int, endep: int, itemIds: List[int] = [], use_cache=False) -> pd.DataFrame:
-        df = pd.read_csv(os.path.join(self.data_dir, self.trends_filename))
-        if len(df) == 0:
-            return pd.DataFrame(columns=self.fields_full)
-        df.columns = self.fields_full
-        # remove rows including string 'clock' at clock
-        df = df[df['clock'] != 'clock']
-        df.fillna(0, inplace=True)
-        # convert itemid to int
-        df['itemid'] = df['itemid'].astype(int)
-        # convert clock to int
-        df['clock'] = df['clock'].astype(int)
-        # convert value_avg to float
-        df['value_avg'] = df['value_avg'].astype(float)
-        # convert value_min to float
-        df['value_min'] = df['value_min'].astype(float)
-        # convert value_max to float
-        df['value_max'] = df['value_max'].astype(float)
-
-        df['clock'] = pd.to_numeric(df['clock'], errors='coerce')
-        df = df.dropna(subset=['clock'])
-        df['clock'] = df['clock'].astype(int)
-        
-        # filter by time
-        df = df[(df['clock'] >= startep) & (df['clock'] <= endep)]
-
-        # filter by itemIds
-        if len(itemIds) > 0:
-            df = df[df['itemid'].isin(itemIds)]
-
-        # sort by itemid, clock
-        df = df.sort_values(['itemid', 'clock'])
-        return df
+        if self.trends_cache is not None:
+            return self.trends_cache.read(startep, endep, itemIds)
+        return self._filter(self._read_trends_csv(), startep, endep, itemIds)
     
     def get_itemIds(self, item_names: List[str] = [], 
                     host_names: List[str] = [], 
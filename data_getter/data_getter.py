@@ -1,11 +1,15 @@
 """
 Super class to get data from different sources
 """
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Iterator
 from abc import abstractmethod
+import numpy as np
 import pandas as pd # type: ignore
 
 class DataGetter:
+    sums_fields = ['itemid', 'sum', 'sqr_sum', 'cnt', 'mean', 'm2']
+    bucket_sums_fields = ['itemid', 'bucket', 'sum', 'sqr_sum', 'cnt', 'mean', 'm2']
+
     def __init__(self, data_source_config):
         self.data_source_config = data_source_config
         self.init_data_source(data_source_config)
@@ -19,6 +23,10 @@ class DataGetter:
     def check_conn(self):
         return True
 
+    # release connections and threads held by the data getter
+    def close(self):
+        pass
+
     # function to get itemIds from the data source. 
     @abstractmethod
     def get_itemIds(self, item_names: List[str] = [], 
@@ -49,6 +57,65 @@ class DataGetter:
     def get_trends_full_data(self, startep: int, endep: int, itemIds: List[int] = []) -> pd.DataFrame:
         pass
     
+    # per item sum, square sum and count of values between startep and endep,
+    # plus mean and m2 (sum of squared differences from the mean) for a stable variance.
+    # Returns pandas dataframe with columns: itemid, sum, sqr_sum, cnt, mean, m2
+    # Database sources push this down into SQL, others aggregate the raw data here.
+    def get_history_sums(self, startep: int, endep: int, itemIds: List[int] = []) -> pd.DataFrame:
+        return self._sums(self.get_history_data(startep=startep, endep=endep, itemIds=itemIds))
+
+    def get_trends_sums(self, startep: int, endep: int, itemIds: List[int] = []) -> pd.DataFrame:
+        return self._sums(self.get_trends_data(startep=startep, endep=endep, itemIds=itemIds))
+
+    # the same sums per itemid and bucket of interval secs, bucket being the start clock.
+    # Returns pandas dataframe with columns: itemid, bucket, sum, sqr_sum, cnt, mean, m2
+    def get_history_bucket_sums(self, startep: int, endep: int, interval: int, itemIds: List[int] = []) -> pd.DataFrame:
+        df = self.get_history_data(startep=startep, endep=endep, itemIds=itemIds)
+        if len(df) == 0:
+            return pd.DataFrame(columns=self.bucket_sums_fields)
+        df = df.assign(bucket=df['clock'].astype('int64') // interval * interval)
+        return self._sums(df, ['itemid', 'bucket'])
+
+    def _sums(self, df: pd.DataFrame, keys: List[str] = ['itemid']) -> pd.DataFrame:
+        if len(df) == 0:
+            return pd.DataFrame(columns=keys + self.sums_fields[1:])
+        values = df['value'].astype(float)
+        df = df[keys].astype('int64').assign(value=values, sqr_value=values * values)
+        # two passes: the mean first, then the squared differences from it
+        df['dev'] = np.square(df['value'] - df.groupby(keys)['value'].transform('mean'))
+        return df.groupby(keys).agg(
+            sum=('value', 'sum'),
+            sqr_sum=('sqr_value', 'sum'),
+            cnt=('value', 'count'),
+            mean=('value', 'mean'),
+            m2=('dev', 'sum'),
+        ).reset_index()
+
+    def _typed_sums(self, df: pd.DataFrame, fields: List[str] = None) -> pd.DataFrame:
+        if fields is None:
+            fields = self.sums_fields
+        if len(df) == 0:
+            return pd.DataFrame(columns=fields)
+        df.columns = fields
+        df = df.astype({col: 'int64' if col in ['itemid', 'bucket', 'cnt'] else 'float64' for col in fields})
+        df['m2'] = df['m2'].fillna(0)
+        return df
+
+    def _typed_bucket_sums(self, df: pd.DataFrame) -> pd.DataFrame:
+        return self._typed_sums(df, self.bucket_sums_fields)
+
+    # generator variants of get_history_data / get_trends_full_data.
+    # Sources that can stream override these, others return the whole result as one chunk.
+    def iter_history_data(self, startep: int, endep: int, itemIds: List[int] = [], itersize: int = 0) -> Iterator[pd.DataFrame]:
+        df = self.get_history_data(startep, endep, itemIds)
+        if len(df) > 0:
+            yield df
+
+    def iter_trends_full_data(self, startep: int, endep: int, itemIds: List[int] = [], itersize: int = 0) -> Iterator[pd.DataFrame]:
+        df = self.get_trends_full_data(startep, endep, itemIds)
+        if len(df) > 0:
+            yield df
+    
     # funtion to classify items by host groups
     def classify_by_groups(self, itemIds: List[int], group_names: List[str]) -> dict:
         return {}
@@ -80,5 +147,14 @@ class DataGetter:
     def check_itemId_cond(self, itemIds: List[int], item_cond: str) -> List[int]:
         pass
 
+    # returns the itemIds matching each of item_conds, in the same order as item_conds.
+    # getters backed by a database override this to evaluate all filters in one query.
+    def check_itemId_conds(self, itemIds: List[int], item_conds: List[str]) -> List[List[int]]:
+        results = []
+        for item_cond in item_conds:
+            matched = self.check_itemId_cond(itemIds, item_cond) if len(itemIds) > 0 else []
+            results.append(matched if matched is not None else [])
+        return results
+
     def get_group_map(self, itemIds: List[int], group_names: List[str]) -> Dict:
         return {}
\ No newline at end of file
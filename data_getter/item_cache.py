@@ -0,0 +1,260 @@
+"""
+In-process cache of Zabbix item metadata (items joined with hosts and host groups).
+
+The Zabbix getters serve get_itemIds, get_items_details, get_item_details,
+get_item_host_dict, classify_by_groups, get_group_map and get_item_relations
+from this cache instead of querying the join every time.
+
+The cache is loaded on first use. After item_cache_ttl seconds a cheap
+signature of the tables (row counts and highest ids of items, hosts_groups and
+the host groups) is read: if only items were added, the items with an itemid
+above the highest cached itemid are fetched, if anything was deleted or hosts
+moved between groups, everything is reloaded. Renames change no signature, so
+renamed items, hosts and groups are picked up by the full reload after
+item_cache_full_ttl seconds. When item_cache_dir is set, the cache is also kept
+on disk and reused by other processes (views, workers) while it is fresh.
+"""
+import os
+import re
+import time
+import logging
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def log(msg, level=logging.INFO):
+    msg = f"[data_getter/item_cache.py] {msg}"
+    logging.log(level, msg)
+
+
+class ItemCache:
+    # one row per item and host group, group_name is None for hosts without a group
+    fields = ['itemid', 'hostid', 'host', 'host_name', 'key_', 'item_name', 'group_name']
+
+    def __init__(self, name: str, load: Callable[[int], pd.DataFrame],
+                 ttl: int = 600, full_ttl: int = 3600,
+                 cache_dir: str = "", case_sensitive: bool = True,
+                 signature: Callable[[], Tuple] = None):
+        """
+        load(min_itemid) returns the rows of items with itemid > min_itemid in `fields` order.
+        signature() returns (items count, max itemid, *others): a full reload
+        follows any change but new items, after which the cache must hold
+        items count distinct itemids.
+        """
+        self.name = name
+        self.load = load
+        self.signature = signature
+        self.ttl = ttl
+        self.full_ttl = full_ttl
+        self.case_sensitive = case_sensitive
+        self.path = ""
+        if cache_dir != "":
+            os.makedirs(cache_dir, exist_ok=True)
+            self.path = os.path.join(cache_dir, f"item_cache_{name}.pkl")
+
+        self.df = None
+        self.refreshed_at = 0.0
+        self.full_refreshed_at = 0.0
+        self.watermark = 0
+        self.last_signature = None
+        self._itemid_index: Dict[int, np.ndarray] = {}
+        self._group_index: Dict[str, np.ndarray] = {}
+
+    def _set_df(self, df: pd.DataFrame):
+        df = df.reset_index(drop=True)
+        self.df = df
+        self.watermark = int(df['itemid'].max()) if len(df) > 0 else 0
+        # no getter method looks items up by hostid: hostid is only read from the
+        # rows of itemids, and host_names filters match host names by pattern
+        self._itemid_index = df.groupby('itemid').indices
+        self._group_index = df.dropna(subset=['group_name']).groupby('group_name').indices
+
+    def _read_disk(self) -> bool:
+        if self.path == "" or not os.path.exists(self.path):
+            return False
+        try:
+            saved = pd.read_pickle(self.path)
+        except Exception as e:
+            log(f"{self.name}: failed to read {self.path}: {e}", level=logging.WARNING)
+            return False
+        if time.time() - saved['full_refreshed_at'] > self.full_ttl:
+            return False
+        self._set_df(saved['df'])
+        self.refreshed_at = saved['refreshed_at']
+        self.full_refreshed_at = saved['full_refreshed_at']
+        self.last_signature = saved.get('signature')
+        return True
+
+    def _write_disk(self):
+        if self.path == "":
+            return
+        tmp_path = f"{self.path}.{os.getpid()}"
+        pd.to_pickle({'df': self.df,
+                      'refreshed_at': self.refreshed_at,
+                      'full_refreshed_at': self.full_refreshed_at,
+                      'signature': self.last_signature}, tmp_path)
+        os.replace(tmp_path, self.path)
+
+    def _load(self, min_itemid: int) -> pd.DataFrame:
+        df = self.load(min_itemid)
+        if len(df) == 0:
+            return pd.DataFrame(columns=self.fields)
+        df.columns = self.fields
+        return df
+
+    def _maybe_added(self, signature: Tuple) -> bool:
+        # at most items were inserted: the other tables are unchanged
+        last = self.last_signature
+        if last is None:
+            return False
+        return signature[2:] == last[2:] and signature[0] >= last[0] and signature[1] >= last[1]
+
+    def refresh(self, full: bool = False):
+        now = time.time()
+        signature = None
+        if self.signature is not None:
+            # read before the rows, so that changes made while loading show up next time
+            signature = tuple(int(value) for value in self.signature())
+            if not full and self.df is not None and not self._maybe_added(signature):
+                log(f"{self.name}: items, hosts or groups changed, reloading")
+                full = True
+        if not (full or self.df is None):
+            df = self._load(self.watermark)
+            if len(df) > 0:
+                self._set_df(pd.concat([self.df, df], ignore_index=True))
+                log(f"{self.name}: added {len(df)} rows above itemid {self.watermark}")
+            if signature is not None and len(self._itemid_index) != signature[0]:
+                # items were deleted as well as added
+                log(f"{self.name}: {len(self._itemid_index)} cached items of {signature[0]}, reloading")
+                full = True
+        if full or self.df is None:
+            df = self._load(0)
+            self._set_df(df)
+            self.full_refreshed_at = now
+            log(f"{self.name}: loaded {len(df)} rows")
+        self.last_signature = signature
+        self.refreshed_at = now
+        self._write_disk()
+
+    def get_df(self) -> pd.DataFrame:
+        now = time.time()
+        if self.df is None and self._read_disk():
+            now = time.time()
+        if self.df is None or now - self.full_refreshed_at > self.full_ttl:
+            self.refresh(full=True)
+        elif now - self.refreshed_at > self.ttl:
+            self.refresh()
+        return self.df
+
+    def _rows(self, itemIds: List[int]) -> pd.DataFrame:
+        df = self.get_df()
+        positions = [self._itemid_index[itemId] for itemId in itemIds if itemId in self._itemid_index]
+        if len(positions) == 0:
+            return df.iloc[0:0]
+        return df.iloc[np.sort(np.concatenate(positions))]
+
+    def _group_rows(self, group_names: List[str]) -> pd.DataFrame:
+        # rows of the groups named (or under) group_names, like
+        # "name = '<group_name>' OR name LIKE '<group_name>/%'"
+        df = self.get_df()
+        positions = []
+        for group_name, index in self._group_index.items():
+            for name in group_names:
+                if self._name_equals(group_name, name) or self._name_startswith(group_name, f"{name}/"):
+                    positions.append(index)
+                    break
+        if len(positions) == 0:
+            return df.iloc[0:0]
+        return df.iloc[np.sort(np.concatenate(positions))]
+
+    def _name_equals(self, value: str, name: str) -> bool:
+        if self.case_sensitive:
+            return value == name
+        return value.lower() == name.lower()
+
+    def _name_startswith(self, value: str, prefix: str) -> bool:
+        if self.case_sensitive:
+            return value.startswith(prefix)
+        return value.lower().startswith(prefix.lower())
+
+    def _match_names(self, values: pd.Series, names: List[str]) -> pd.Series:
+        # same matching as the getters' SQL: LIKE for names with '*' or '%',
+        # otherwise the name itself or anything under "<name>/"
+        flags = 0 if self.case_sensitive else re.IGNORECASE
+        mask = pd.Series(False, index=values.index)
+        values = values.fillna("")
+        for name in names:
+            if '*' in name or '%' in name:
+                pattern = "".join(".*" if c in "*%" else "." if c == "_" else re.escape(c) for c in name)
+                mask |= values.str.fullmatch(pattern, flags=flags)
+            else:
+                pattern = re.escape(name) + "(/.*)?"
+                mask |= values.str.fullmatch(pattern, flags=flags)
+        return mask
+
+    def get_itemIds(self, item_names: List[str] = [],
+                    host_names: List[str] = [],
+                    group_names: List[str] = [],
+                    itemIds: List[int] = [],
+                    max_itemIds = 0) -> List[int]:
+        df = self._rows(itemIds) if len(itemIds) > 0 else self.get_df()
+        df = df.dropna(subset=['group_name'])
+        for column, names in [('item_name', item_names), ('host_name', host_names), ('group_name', group_names)]:
+            if len(names) > 0:
+                df = df[self._match_names(df[column], names)]
+        results = df['itemid'].drop_duplicates().tolist()
+        if max_itemIds > 0:
+            results = results[:max_itemIds]
+        return results
+
+    def get_items_details(self, itemIds: List[int]) -> pd.DataFrame:
+        df = self._rows(itemIds).dropna(subset=['group_name'])
+        df = df[['group_name', 'hostid', 'host', 'itemid', 'key_']]
+        df.columns = ['group_name', 'hostid', 'host_name', 'itemid', 'item_name']
+        return df.reset_index(drop=True)
+
+    def get_item_details(self, itemIds: List[int]) -> Dict:
+        df = self._rows(itemIds).drop_duplicates('itemid')
+        return {row.itemid: {"hostid": row.hostid, "host_name": row.host_name, "item_name": row.item_name}
+                for row in df.itertuples()}
+
+    def get_item_host_dict(self, itemIds: List[int] = []) -> Dict[int, int]:
+        df = self._rows(itemIds) if len(itemIds) > 0 else self.get_df()
+        df = df.drop_duplicates('itemid')
+        return dict(zip(df['itemid'].tolist(), df['hostid'].tolist()))
+
+    def classify_by_groups(self, itemIds: List[int], group_names: List[str]) -> Dict[str, List[int]]:
+        if len(group_names) == 0:
+            return {"all": itemIds}
+        if len(itemIds) == 0:
+            return {"all": []}
+        groups = {}
+        for group_name in group_names:
+            df = self._group_rows([group_name])
+            group_info = df[df['itemid'].isin(itemIds)]['itemid'].drop_duplicates().tolist()
+            if len(group_info) > 0:
+                groups[group_name] = group_info
+        return groups
+
+    def get_group_map(self, itemIds: List[int], group_names: List[str]) -> Dict[int, str]:
+        if len(itemIds) == 0 or len(group_names) == 0:
+            return {}
+        group_map = {}
+        for group_name in group_names:
+            df = self._group_rows([group_name])
+            for itemId in df[df['itemid'].isin(itemIds)]['itemid'].tolist():
+                group_map[itemId] = group_name
+        return group_map
+
+    def get_item_relations(self, itemIds: List[int], group_names: List[str]) -> pd.DataFrame:
+        df = self._rows(itemIds) if len(itemIds) > 0 else self.get_df()
+        df = df.dropna(subset=['group_name'])
+        frames = []
+        for name in group_names:
+            matched = df[self._match_names(df['group_name'], [name])][['hostid', 'itemid']]
+            frames.append(matched.assign(group_name=name)[['group_name', 'hostid', 'itemid']])
+        if len(frames) == 0:
+            return pd.DataFrame(columns=['group_name', 'hostid', 'itemid'])
+        return pd.concat(frames, ignore_index=True)
@@ -2,7 +2,10 @@
 class to get data from zabbix postgreSQL database
 """
 from data_getter.data_getter import DataGetter
-from typing import Dict, List
+from data_getter.item_cache import ItemCache
+from data_getter.concurrent_fetch import read_merged, FetchWorkers
+from typing import Dict, List, Tuple
+import weakref
 import pandas as pd # type: ignore
 
 from db.mysql import MySqlDB
@@ -21,6 +24,25 @@ class ZabbixMySqlGetter(DataGetter):
         if str(version)[0] == "3":
             self.hstgrp_table = 'groups'
         self.api_url = data_source['api_url']
+        # query history/history_uint and trends/trends_uint on separate connections
+        self.concurrent_fetch = bool(data_source.get("concurrent_fetch", False))
+        self.fetch_workers = None
+        if self.concurrent_fetch:
+            # a MySqlDB holds one connection, so each fetch thread checks out one of a fixed set
+            self.fetch_workers = FetchWorkers("zabbix-mysql-fetch", len(self.history_tables),
+                                              open_conn=self._open_fetch_db, close_conn=MySqlDB.close)
+            weakref.finalize(self, self.fetch_workers.close)
+
+        self.item_cache = None
+        item_cache_ttl = int(data_source.get("item_cache_ttl", 0))
+        if item_cache_ttl > 0:
+            self.item_cache = ItemCache(f"{data_source['host']}_{data_source['dbname']}",
+                                        self._load_item_metadata,
+                                        ttl=item_cache_ttl,
+                                        full_ttl=int(data_source.get("item_cache_full_ttl", 3600)),
+                                        signature=self._item_metadata_signature,
+                                        cache_dir=data_source.get("item_cache_dir", ""),
+                                        case_sensitive=False)
 
     def check_conn(self) -> bool:
         cur = self.db.exec_sql("SET SESSION TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;")
@@ -30,7 +52,41 @@ class ZabbixMySqlGetter(DataGetter):
             cnt += 1
         return cnt > 0
 
+    def _open_fetch_db(self) -> MySqlDB:
+        db = MySqlDB(self.data_source_config)
+        db.exec_sql("SET SESSION TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;")
+        return db
+
+    def close(self):
+        if self.fetch_workers is not None:
+            self.fetch_workers.close()
+        if self.db is not None:
+            self.db.close()
+
+    def _ordered_sqls(self, tables: List[str], columns: str, startep: int, endep: int, itemIds: List[int] = []) -> List[str]:
+        # one query per table, ordered so that the results can be merged without sorting
+        if len(itemIds) > 0:
+            where_itemIds = " AND itemid IN (" + ",".join([str(itemid) for itemid in itemIds]) + ")"
+        else:
+            where_itemIds = ""
+        return [f"""
+            SELECT {columns}
+            FROM {table}
+            WHERE clock BETWEEN {int(startep)} AND {int(endep)}
+            {where_itemIds}
+            ORDER BY itemid, clock
+        """ for table in tables]
+
+    def _read_concurrently(self, tables: List[str], columns: str, fields: List[str], 
+                           startep: int, endep: int, itemIds: List[int] = []) -> pd.DataFrame:
+        sqls = self._ordered_sqls(tables, columns, startep, endep, itemIds)
+        dtypes = {field: 'int64' if field in ['itemid', 'clock'] else 'float64' for field in fields}
+        return read_merged(lambda sql, db: db.read_sql(sql), sqls, fields, dtypes, workers=self.fetch_workers)
+
     def get_history_data(self, startep: int, endep: int, itemIds: List[int] = [], use_cache=False) -> pd.DataFrame:
+        if self.concurrent_fetch:
+            return self._read_concurrently(self.history_tables, "itemid, clock, value", self.fields, 
+                                           startep, endep, itemIds)
         if len(itemIds) > 0:
             where_itemIds = " AND itemid IN (" + ",".join([str(itemid) for itemid in itemIds]) + ")"
         else:
@@ -61,6 +117,9 @@ class ZabbixMySqlGetter(DataGetter):
         return df
 
     def get_trends_data(self, startep: int, endep: int, itemIds: List[int] = [], use_cache=False) -> pd.DataFrame:
+        if self.concurrent_fetch:
+            return self._read_concurrently(self.trends_tables, "itemid, clock, value_avg", self.fields, 
+                                           startep, endep, itemIds)
         if len(itemIds) > 0:
             where_itemIds = " AND itemid IN (" + ",".join([str(itemid) for itemid in itemIds]) + ")"
         else:
@@ -88,6 +147,9 @@ class ZabbixMySqlGetter(DataGetter):
         return df
 
     def get_trends_full_data(self, startep: int, endep: int, itemIds: List[int] = [], use_cache=False) -> pd.DataFrame:
+        if self.concurrent_fetch:
+            return self._read_concurrently(self.trends_tables, "itemid, clock, value_min, value_avg, value_max", 
+                                           self.fields_full, startep, endep, itemIds)
         if len(itemIds) > 0:
             where_itemIds = " AND itemid IN (" + ",".join([str(itemid) for itemid in itemIds]) + ")"
         else:
@@ -114,11 +176,79 @@ class ZabbixMySqlGetter(DataGetter):
         df = df.sort_values(['itemid', 'clock'])
         return df
 
+    def _sums_sql(self, tables: List[str], value_field: str, startep: int, endep: int, itemIds: List[int] = [], interval: int = 0) -> str:
+        if len(itemIds) > 0:
+            where_itemIds = " AND itemid IN (" + ",".join([str(itemid) for itemid in itemIds]) + ")"
+        else:
+            where_itemIds = ""
+        
+        startep = int(startep)
+        endep = int(endep)
+        # per bucket of interval secs when interval > 0
+        bucket = ""
+        group_by = "itemid"
+        if interval > 0:
+            bucket = f"clock DIV {int(interval)} * {int(interval)} AS bucket, "
+            group_by = "itemid, bucket"
+        # "* 1.0" turns BIGINT UNSIGNED into DECIMAL so that value * value does not overflow
+        selects = [f"""
+                SELECT itemid, {bucket}{value_field} * 1.0 AS value
+                FROM {table}
+                WHERE clock BETWEEN {startep} AND {endep}
+                {where_itemIds}""" for table in tables]
+        return f"""
+            SELECT {group_by}, SUM(value), SUM(value * value), COUNT(value), AVG(value), VAR_POP(value) * COUNT(value)
+            FROM ({" UNION ALL ".join(selects)}
+            ) t
+            GROUP BY {group_by}
+        """
+
+    def get_history_sums(self, startep: int, endep: int, itemIds: List[int] = []) -> pd.DataFrame:
+        sql = self._sums_sql(self.history_tables, "value", startep, endep, itemIds)
+        self.db.exec_sql("SET SESSION TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;")
+        return self._typed_sums(self.db.read_sql(sql))
+
+    def get_history_bucket_sums(self, startep: int, endep: int, interval: int, itemIds: List[int] = []) -> pd.DataFrame:
+        sql = self._sums_sql(self.history_tables, "value", startep, endep, itemIds, interval=interval)
+        self.db.exec_sql("SET SESSION TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;")
+        return self._typed_bucket_sums(self.db.read_sql(sql))
+
+    def get_trends_sums(self, startep: int, endep: int, itemIds: List[int] = []) -> pd.DataFrame:
+        sql = self._sums_sql(self.trends_tables, "value_avg", startep, endep, itemIds)
+        self.db.exec_sql("SET SESSION TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;")
+        return self._typed_sums(self.db.read_sql(sql))
+
+    def _load_item_metadata(self, min_itemid: int = 0) -> pd.DataFrame:
+        # rows for the item cache: one per item and host group
+        sql = f"""
+            SELECT items.itemid, hosts.hostid, hosts.host, hosts.name, items.key_, items.name, {self.hstgrp_table}.name
+            FROM items
+            INNER JOIN hosts ON hosts.hostid = items.hostid
+            LEFT JOIN hosts_groups ON hosts_groups.hostid = hosts.hostid
+            LEFT JOIN {self.hstgrp_table} ON {self.hstgrp_table}.groupid = hosts_groups.groupid
+            WHERE items.itemid > {int(min_itemid)}
+        """
+        self.db.exec_sql("SET SESSION TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;")
+        return self.db.read_sql(sql)
+
+    def _item_metadata_signature(self) -> List[int]:
+        # changes but new items make the item cache reload everything
+        sql = f"""
+            SELECT (SELECT COUNT(*) FROM items), (SELECT COALESCE(MAX(itemid), 0) FROM items),
+                (SELECT COUNT(*) FROM hosts_groups), (SELECT COALESCE(MAX(hostgroupid), 0) FROM hosts_groups),
+                (SELECT COUNT(*) FROM {self.hstgrp_table}), (SELECT COALESCE(MAX(groupid), 0) FROM {self.hstgrp_table})
+        """
+        self.db.exec_sql("SET SESSION TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;")
+        return self.db.read_sql(sql).iloc[0].tolist()
+
+
     def get_itemIds(self, item_names: List[str] = [], 
                     host_names: List[str] = [], 
                     group_names: List[str] = [],
                     itemIds: List[int] = [],
                     max_itemIds = 0) -> List[int]:
+        if self.item_cache is not None:
+            return self.item_cache.get_itemIds(item_names, host_names, group_names, itemIds, max_itemIds)
         where_conds = []
         names_list = [("items", item_names), ("hosts", host_names), (self.hstgrp_table, group_names)]
         for (table_name, names) in names_list:
@@ -163,6 +293,8 @@ class ZabbixMySqlGetter(DataGetter):
         return [row[0] for row in rows]
 
     def get_item_host_dict(self, itemIds: List[int] = []) -> Dict[int, int]:
+        if self.item_cache is not None:
+            return self.item_cache.get_item_host_dict(itemIds)
         if len(itemIds) > 0:
             where_itemIds = "WHERE itemid IN (" + ",".join([str(itemid) for itemid in itemIds]) + ")"
         else:
@@ -183,36 +315,50 @@ class ZabbixMySqlGetter(DataGetter):
             return {}
         return {row[0]: row[1] for row in rows}
 
+    def _match_groups(self, itemIds: List[int], group_names: List[str]) -> List[Tuple[int, int]]:
+        """
+        (itemid, index in group_names) of every item in a group named group_names[index]
+        or in one of its sub groups (ex: app/sim/rp is a sub group of app/sim),
+        for all group names in one query.
+        """
+        names = [name.replace("'", "''") for name in group_names]
+        values = " UNION ALL ".join([f"SELECT {i} AS idx, '{name}' AS name" for i, name in enumerate(names)])
+        sql = f"""
+            SELECT DISTINCT items.itemid, g.idx
+            FROM ({values}) AS g
+            INNER JOIN {self.hstgrp_table} ON ({self.hstgrp_table}.name = g.name OR {self.hstgrp_table}.name LIKE CONCAT(g.name, '/%'))
+            INNER JOIN hosts_groups ON hosts_groups.groupid = {self.hstgrp_table}.groupid
+            INNER JOIN hosts ON hosts.hostid = hosts_groups.hostid
+            INNER JOIN items ON items.hostid = hosts.hostid
+            WHERE items.itemid IN ({",".join(map(str, itemIds))})
+        """
+        self.db.exec_sql("SET SESSION TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;")
+        cur = self.db.exec_sql(sql)
+        rows = cur.fetchall()
+        cur.close()
+        return [(row[0], row[1]) for row in rows]
+
+
     def classify_by_groups(self, itemIds: List[int], group_names: List[str]) -> Dict[str, List[int]]:
+        if self.item_cache is not None:
+            return self.item_cache.classify_by_groups(itemIds, group_names)
         if len(group_names) == 0:
             return {"all": itemIds}
         if len(itemIds) == 0:
             return {"all": []}
-        cond_itemIds = "AND items.itemid IN (" + ",".join([str(itemid) for itemid in itemIds]) + ")"
+
+        matched = {}
+        for itemId, idx in self._match_groups(itemIds, group_names):
+            matched.setdefault(idx, []).append(itemId)
         groups = {}
-        for group_name in group_names:
-            sql = f"""
-                SET SESSION TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;
-                SELECT DISTINCT items.itemid
-                FROM items 
-                INNER JOIN hosts ON hosts.hostid = items.hostid
-                INNER JOIN hosts_groups ON hosts_groups.hostid = hosts.hostid
-                INNER JOIN {self.hstgrp_table} ON {self.hstgrp_table}.groupid = hosts_groups.groupid 
-                WHERE ({self.hstgrp_table}.name = '{group_name}' OR {self.hstgrp_table}.name LIKE '{group_name}/%') 
-                {cond_itemIds}
-            """
-            self.db.exec_sql("SET SESSION TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;")
-            cur = self.db.exec_sql(sql.split(';', 1)[1])
-            rows = cur.fetchall()
-            cur.close()
-            if len(rows) == 0:
-                continue
-            group_info = [row[0] for row in rows]
-            if len(group_info) > 0: 
-                groups[group_name] = group_info
+        for idx, group_name in enumerate(group_names):
+            if idx in matched:
+                groups[group_name] = sorted(matched[idx])
         return groups
 
     def get_item_relations(self, itemIds: List[int], group_names: List[str]) -> pd.DataFrame:
+        if self.item_cache is not None:
+            return self.item_cache.get_item_relations(itemIds, group_names)
         df = pd.DataFrame()
         if len(itemIds) > 0:
             where_itemIds = "AND items.itemid IN (" + ",".join([str(itemid) for itemid in itemIds]) + ")"
@@ -240,6 +386,8 @@ class ZabbixMySqlGetter(DataGetter):
         return df
 
     def get_item_details(self, itemIds: List[int]) -> Dict:
+        if self.item_cache is not None:
+            return self.item_cache.get_item_details(itemIds)
         if len(itemIds) == 0:
             return {}
         where_itemIds = "WHERE items.itemid IN (" + ",".join([str(itemid) for itemid in itemIds]) + ")"
@@ -273,7 +421,35 @@ class ZabbixMySqlGetter(DataGetter):
         cur.close()
         return [row[0] for row in rows]
 
+    def check_itemId_conds(self, itemIds: List[int], item_conds: List[str]) -> List[List[int]]:
+        # one 0/1 column per filter, evaluated in a single query
+        conds = [item_cond for item_cond in item_conds if item_cond != ""]
+        rows = []
+        if len(itemIds) > 0 and len(conds) > 0:
+            columns = ", ".join([f"COALESCE(({item_cond}), 0)" for item_cond in conds])
+            sql = f"""
+                SELECT itemid, {columns}
+                FROM items
+                WHERE itemid IN ({",".join(map(str, itemIds))})
+            """
+            self.db.exec_sql("SET SESSION TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;")
+            cur = self.db.exec_sql(sql)
+            rows = cur.fetchall()
+            cur.close()
+
+        results = []
+        i = 0
+        for item_cond in item_conds:
+            if item_cond == "":
+                results.append(list(itemIds))
+                continue
+            i += 1
+            results.append([row[0] for row in rows if row[i]])
+        return results
+
     def get_items_details(self, itemIds: List[int]) -> pd.DataFrame:
+        if self.item_cache is not None:
+            return self.item_cache.get_items_details(itemIds)
         sql = f"""
             SET SESSION TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;
             SELECT {self.hstgrp_table}.name AS group_name, hosts.hostid AS hostid, hosts.host AS host_name, items.itemid AS itemid, items.key_ AS item_name
@@ -289,28 +465,15 @@ class ZabbixMySqlGetter(DataGetter):
         return df
 
     def get_group_map(self, itemIds: List[int], group_names: List[str]) -> Dict[int, str]:
+        if self.item_cache is not None:
+            return self.item_cache.get_group_map(itemIds, group_names)
         if len(itemIds) == 0 or len(group_names) == 0:
             return {}
+
+        # a later group name wins, as when the groups were queried one by one
         group_map = {}
-        for group_name in group_names:
-            sql = f"""
-                SET SESSION TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;
-                SELECT items.itemid
-                FROM hosts 
-                INNER JOIN items ON hosts.hostid = items.hostid
-                INNER JOIN hosts_groups ON hosts_groups.hostid = hosts.hostid
-                INNER JOIN {self.hstgrp_table} ON {self.hstgrp_table}.groupid = hosts_groups.groupid 
-                WHERE ({self.hstgrp_table}.name = '{group_name}' OR {self.hstgrp_table}.name LIKE '{group_name}/%') 
-                AND items.itemid IN ({",".join(map(str, itemIds))})
-            """
-            self.db.exec_sql("SET SESSION TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;")
-            cur = self.db.exec_sql(sql.split(';', 1)[1])
-            rows = cur.fetchall()
-            cur.close()
-            if len(rows) == 0:
-                continue
-            for row in rows:
-                group_map[row[0]] = group_name
+        for itemId, idx in sorted(self._match_groups(itemIds, group_names), key=lambda pair: pair[1]):
+            group_map[itemId] = group_names[idx]
         return group_map
 
     def get_item_html_title(self, itemId: int, chart_type="") -> str:
@@ -2,7 +2,10 @@
 class to get data from zabbix postgreSQL database
 """
 from data_getter.data_getter import DataGetter
-from typing import Dict, List
+from data_getter.item_cache import ItemCache
+from data_getter.concurrent_fetch import read_merged, FetchWorkers
+from typing import Dict, List, Iterator, Tuple
+import weakref
 import pandas as pd # type: ignore
 
 from db.postgresql import PostgreSqlDB
@@ -21,6 +24,26 @@ class ZabbixPSqlGetter(DataGetter):
         if str(version)[0] == "3":
             self.hstgrp_table = 'groups'
         self.api_url = data_source['api_url']
+        # query history/history_uint and trends/trends_uint on separate pooled connections
+        self.concurrent_fetch = bool(data_source.get("concurrent_fetch", False))
+        self.fetch_workers = None
+        if self.concurrent_fetch:
+            self.fetch_workers = FetchWorkers("zabbix-psql-fetch", len(self.history_tables))
+            weakref.finalize(self, self.fetch_workers.close)
+
+        self.item_cache = None
+        item_cache_ttl = int(data_source.get("item_cache_ttl", 0))
+        if item_cache_ttl > 0:
+            self.item_cache = ItemCache(f"{data_source['host']}_{data_source['dbname']}",
+                                        self._load_item_metadata,
+                                        ttl=item_cache_ttl,
+                                        full_ttl=int(data_source.get("item_cache_full_ttl", 3600)),
+                                        signature=self._item_metadata_signature,
+                                        cache_dir=data_source.get("item_cache_dir", ""))
+
+    def close(self):
+        if self.fetch_workers is not None:
+            self.fetch_workers.close()
 
     def check_conn(self) -> bool:
         cur = self.db.exec_sql("SELECT version();")
@@ -30,7 +53,7 @@ class ZabbixPSqlGetter(DataGetter):
         
         return cnt > 0
 
-    def get_history_data(self, startep: int, endep: int, itemIds: List[int] = [], use_cache=False) -> pd.DataFrame:
+    def _history_sql(self, startep: int, endep: int, itemIds: List[int] = []) -> str:
         if len(itemIds) > 0:
             where_itemIds = " AND itemid = ANY(ARRAY[" + ",".join([str(itemid) for itemid in itemIds]) + "])"
         else:
@@ -39,7 +62,7 @@ class ZabbixPSqlGetter(DataGetter):
         startep = int(startep)
         endep = int(endep)
         # join history and history_uint tables
-        sql = f"""
+        return f"""
             SELECT itemid, clock, value
             FROM history
             WHERE clock BETWEEN {startep} AND {endep}
@@ -51,6 +74,31 @@ class ZabbixPSqlGetter(DataGetter):
             {where_itemIds}
         """
 
+    def _ordered_sqls(self, tables: List[str], columns: str, startep: int, endep: int, itemIds: List[int] = []) -> List[str]:
+        # one query per table, ordered so that the results can be merged without sorting
+        if len(itemIds) > 0:
+            where_itemIds = " AND itemid = ANY(ARRAY[" + ",".join([str(itemid) for itemid in itemIds]) + "])"
+        else:
+            where_itemIds = ""
+        return [f"""
+            SELECT {columns}
+            FROM {table}
+            WHERE clock BETWEEN {int(startep)} AND {int(endep)}
+            {where_itemIds}
+            ORDER BY itemid, clock
+        """ for table in tables]
+
+    def _read_concurrently(self, tables: List[str], columns: str, fields: List[str], 
+                           startep: int, endep: int, itemIds: List[int] = []) -> pd.DataFrame:
+        sqls = self._ordered_sqls(tables, columns, startep, endep, itemIds)
+        dtypes = {field: 'int64' if field in ['itemid', 'clock'] else 'float64' for field in fields}
+        return read_merged(lambda sql, conn: self.db.read_sql(sql), sqls, fields, dtypes, workers=self.fetch_workers)
+
+    def get_history_data(self, startep: int, endep: int, itemIds: List[int] = [], use_cache=False) -> pd.DataFrame:
+        if self.concurrent_fetch:
+            return self._read_concurrently(self.history_tables, "itemid, clock, value", self.fields, 
+                                           startep, endep, itemIds)
+        sql = self._history_sql(startep, endep, itemIds)
         df = self.db.read_sql(sql)
         if len(df) == 0:
             return pd.DataFrame(columns=self.fields, dtype=object)
@@ -61,6 +109,9 @@ class ZabbixPSqlGetter(DataGetter):
     
 
     def get_trends_data(self, startep: int, endep: int, itemIds: List[int] = [], use_cache=False) -> pd.DataFrame:
+        if self.concurrent_fetch:
+            return self._read_concurrently(self.trends_tables, "itemid, clock, value_avg", self.fields, 
+                                           startep, endep, itemIds)
         if len(itemIds) > 0:
             where_itemIds = " AND itemid = ANY(ARRAY[" + ",".join([str(itemid) for itemid in itemIds]) + "])"
         else:
@@ -88,14 +139,13 @@ class ZabbixPSqlGetter(DataGetter):
         df = df.sort_values(['itemid', 'clock'])
         return df
     
-    def get_trends_full_data(self, startep: int, endep: int, itemIds: List[int] = [], use_cache=False) -> pd.DataFrame:
+    def _trends_full_sql(self, startep: int, endep: int, itemIds: List[int] = []) -> str:
         if len(itemIds) > 0:
             where_itemIds = " AND itemid IN (" + ",".join([str(itemid) for itemid in itemIds]) + ")"
         else:
             where_itemIds = ""
         
-        sql = f"""
-            SET TRANSACTION ISOLATION LEVEL READ COMMITTED;
+        return f"""
             SELECT itemid, clock, value_min, value_avg, value_max
             FROM trends
             WHERE clock >= {startep} AND clock <= {endep}
@@ -107,6 +157,11 @@ class ZabbixPSqlGetter(DataGetter):
             {where_itemIds}
         """
 
+    def get_trends_full_data(self, startep: int, endep: int, itemIds: List[int] = [], use_cache=False) -> pd.DataFrame:
+        if self.concurrent_fetch:
+            return self._read_concurrently(self.trends_tables, "itemid, clock, value_min, value_avg, value_max", 
+                                           self.fields_full, startep, endep, itemIds)
+        sql = "SET TRANSACTION ISOLATION LEVEL READ COMMITTED;" + self._trends_full_sql(startep, endep, itemIds)
         df = self.db.read_sql(sql)
         if len(df) == 0:
             return pd.DataFrame(columns=['itemid', 'clock', 'value_min', 'value_avg', 'value_max'], dtype=object)
@@ -116,11 +171,86 @@ class ZabbixPSqlGetter(DataGetter):
         return df
 
 
+    def _sums_sql(self, tables: List[str], value_field: str, startep: int, endep: int, itemIds: List[int] = [], interval: int = 0) -> str:
+        if len(itemIds) > 0:
+            where_itemIds = " AND itemid = ANY(ARRAY[" + ",".join([str(itemid) for itemid in itemIds]) + "])"
+        else:
+            where_itemIds = ""
+        
+        startep = int(startep)
+        endep = int(endep)
+        # per bucket of interval secs when interval > 0
+        bucket = ""
+        group_by = "itemid"
+        if interval > 0:
+            bucket = f"clock / {int(interval)} * {int(interval)} AS bucket, "
+            group_by = "itemid, bucket"
+        selects = [f"""
+                SELECT itemid, {bucket}{value_field} as value
+                FROM {table}
+                WHERE clock BETWEEN {startep} AND {endep}
+                {where_itemIds}""" for table in tables]
+        return f"""
+            SELECT {group_by}, sum(value), sum(value * value), count(value), avg(value), var_pop(value) * count(value)
+            FROM ({" UNION ALL ".join(selects)}
+            ) t
+            GROUP BY {group_by}
+        """
+
+    def get_history_sums(self, startep: int, endep: int, itemIds: List[int] = []) -> pd.DataFrame:
+        sql = self._sums_sql(self.history_tables, "value", startep, endep, itemIds)
+        return self._typed_sums(self.db.read_sql(sql))
+
+    def get_history_bucket_sums(self, startep: int, endep: int, interval: int, itemIds: List[int] = []) -> pd.DataFrame:
+        sql = self._sums_sql(self.history_tables, "value", startep, endep, itemIds, interval=interval)
+        return self._typed_bucket_sums(self.db.read_sql(sql))
+
+    def get_trends_sums(self, startep: int, endep: int, itemIds: List[int] = []) -> pd.DataFrame:
+        sql = self._sums_sql(self.trends_tables, "value_avg", startep, endep, itemIds)
+        return self._typed_sums(self.db.read_sql(sql))
+
+    # streaming variants: rows come ordered by itemid, clock in chunks of itersize rows
+    def iter_history_data(self, startep: int, endep: int, itemIds: List[int] = [], itersize: int = 0) -> Iterator[pd.DataFrame]:
+        sql = self._history_sql(startep, endep, itemIds) + " ORDER BY itemid, clock"
+        dtypes = {'itemid': 'int64', 'clock': 'int64', 'value': 'float64'}
+        return self.db.read_sql_chunks(sql, columns=self.fields, dtypes=dtypes, itersize=itersize)
+
+    def iter_trends_full_data(self, startep: int, endep: int, itemIds: List[int] = [], itersize: int = 0) -> Iterator[pd.DataFrame]:
+        sql = self._trends_full_sql(startep, endep, itemIds) + " ORDER BY itemid, clock"
+        dtypes = {'itemid': 'int64', 'clock': 'int64', 
+                  'value_min': 'float64', 'value_avg': 'float64', 'value_max': 'float64'}
+        return self.db.read_sql_chunks(sql, columns=self.fields_full, dtypes=dtypes, itersize=itersize)
+
+
+    def _load_item_metadata(self, min_itemid: int = 0) -> pd.DataFrame:
+        # rows for the item cache: one per item and host group
+        sql = f"""
+            SELECT items.itemid, hosts.hostid, hosts.host, hosts.name, items.key_, items.name, {self.hstgrp_table}.name
+            FROM items
+            INNER JOIN hosts ON hosts.hostid = items.hostid
+            LEFT JOIN hosts_groups ON hosts_groups.hostid = hosts.hostid
+            LEFT JOIN {self.hstgrp_table} ON {self.hstgrp_table}.groupid = hosts_groups.groupid
+            WHERE items.itemid > {int(min_itemid)}
+        """
+        return self.db.read_sql(sql)
+
+    def _item_metadata_signature(self) -> List[int]:
+        # changes but new items make the item cache reload everything
+        sql = f"""
+            SELECT (SELECT COUNT(*) FROM items), (SELECT COALESCE(MAX(itemid), 0) FROM items),
+                (SELECT COUNT(*) FROM hosts_groups), (SELECT COALESCE(MAX(hostgroupid), 0) FROM hosts_groups),
+                (SELECT COUNT(*) FROM {self.hstgrp_table}), (SELECT COALESCE(MAX(groupid), 0) FROM {self.hstgrp_table})
+        """
+        return self.db.read_sql(sql).iloc[0].tolist()
+
+
     def get_itemIds(self, item_names: List[str] = [], 
                     host_names: List[str] = [], 
                     group_names: List[str] = [],
                     itemIds: List[int] = [],
                     max_itemIds = 0) -> List[int]:
+        if self.item_cache is not None:
+            return self.item_cache.get_itemIds(item_names, host_names, group_names, itemIds, max_itemIds)
         where_conds = []
         # if names includes '*', convert them to '%' and use LIKE operator
         # else use '=' operator
@@ -167,6 +297,8 @@ class ZabbixPSqlGetter(DataGetter):
 
 
     def get_item_host_dict(self, itemIds: List[int] = []) -> Dict[int, int]:
+        if self.item_cache is not None:
+            return self.item_cache.get_item_host_dict(itemIds)
         if len(itemIds) > 0:
             where_itemIds = "WHERE itemid IN (" + ",".join([str(itemid) for itemid in itemIds]) + ")"
         else:
@@ -186,44 +318,49 @@ class ZabbixPSqlGetter(DataGetter):
         return {row[0]: row[1] for row in rows}
     
 
+    def _match_groups(self, itemIds: List[int], group_names: List[str]) -> List[Tuple[int, int]]:
+        """
+        (itemid, index in group_names) of every item in a group named group_names[index]
+        or in one of its sub groups (ex: app/sim/rp is a sub group of app/sim),
+        for all group names in one query.
+        """
+        names = [name.replace("'", "''") for name in group_names]
+        values = ", ".join([f"({i}, '{name}')" for i, name in enumerate(names)])
+        sql = f"""
+            SELECT DISTINCT items.itemid, g.idx
+            FROM (VALUES {values}) AS g(idx, name)
+            INNER JOIN {self.hstgrp_table} ON ({self.hstgrp_table}.name = g.name OR {self.hstgrp_table}.name LIKE g.name || '/%')
+            INNER JOIN hosts_groups ON hosts_groups.groupid = {self.hstgrp_table}.groupid
+            INNER JOIN hosts ON hosts.hostid = hosts_groups.hostid
+            INNER JOIN items ON items.hostid = hosts.hostid
+            WHERE items.itemid IN ({",".join(map(str, itemIds))})
+        """
+        cur = self.db.exec_sql(sql)
+        rows = cur.fetchall()
+        cur.close()
+        return [(row[0], row[1]) for row in rows]
+
+
     def classify_by_groups(self, itemIds: List[int], group_names: List[str]) -> Dict[str, List[int]]:
+        if self.item_cache is not None:
+            return self.item_cache.classify_by_groups(itemIds, group_names)
         if len(group_names) == 0:
             return {"all": itemIds}
-        
         if len(itemIds) == 0:
             return {"all": []}
-        
-        cond_itemIds = "AND itemid IN (" + ",".join([str(itemid) for itemid in itemIds]) + ")"
 
-        
-        # get groupid from given group_names considering sub groups.
-        # ex) app/sim/rp is sub group of app/sim
+        matched = {}
+        for itemId, idx in self._match_groups(itemIds, group_names):
+            matched.setdefault(idx, []).append(itemId)
         groups = {}
-        for group_name in group_names:
-            sql = f"""
-                SELECT distinct items.itemid
-                FROM items 
-                inner join hosts on hosts.hostid = items.hostid
-                inner join hosts_groups on hosts_groups.hostid = hosts.hostid
-                inner join {self.hstgrp_table} on {self.hstgrp_table}.groupid = hosts_groups.groupid 
-                WHERE ({self.hstgrp_table}.name = '{group_name}' OR {self.hstgrp_table}.name LIKE '{group_name}/%') 
-                {cond_itemIds}
-            """
-
-            cur = self.db.exec_sql(sql)
-            rows = cur.fetchall()
-            cur.close()
-            if len(rows) == 0:
-                continue
-
-            group_info = [row[0] for row in rows]
-            if len(group_info) > 0: 
-                groups[group_name] = group_info
-
+        for idx, group_name in enumerate(group_names):
+            if idx in matched:
+                groups[group_name] = sorted(matched[idx])
         return groups
-            
 
     def get_item_relations(self, itemIds: List[int], group_names: List[str]) -> pd.DataFrame:
+        if self.item_cache is not None:
+            return self.item_cache.get_item_relations(itemIds, group_names)
         df = pd.DataFrame()
         if len(itemIds) > 0:
             where_itemIds = "AND items.itemid IN (" + ",".join([str(itemid) for itemid in itemIds]) + ")"
@@ -259,6 +396,8 @@ class ZabbixPSqlGetter(DataGetter):
                 'item_name': <itemName>}
         }
         """
+        if self.item_cache is not None:
+            return self.item_cache.get_item_details(itemIds)
         if len(itemIds) == 0:
             return {}
         
@@ -292,8 +431,35 @@ class ZabbixPSqlGetter(DataGetter):
         
         return [row[0] for row in rows]
     
+    def check_itemId_conds(self, itemIds: List[int], item_conds: List[str]) -> List[List[int]]:
+        # one boolean column per filter, evaluated in a single query
+        conds = [item_cond for item_cond in item_conds if item_cond != ""]
+        rows = []
+        if len(itemIds) > 0 and len(conds) > 0:
+            columns = ", ".join([f"COALESCE(({item_cond}), FALSE)" for item_cond in conds])
+            sql = f"""
+                SELECT itemid, {columns}
+                FROM items
+                WHERE itemid IN ({",".join(map(str, itemIds))})
+            """
+            cur = self.db.exec_sql(sql)
+            rows = cur.fetchall()
+            cur.close()
+
+        results = []
+        i = 0
+        for item_cond in item_conds:
+            if item_cond == "":
+                results.append(list(itemIds))
+                continue
+            i += 1
+            results.append([row[0] for row in rows if row[i]])
+        return results
+
 
     def get_items_details(self, itemIds: List[int]) -> pd.DataFrame:
+        if self.item_cache is not None:
+            return self.item_cache.get_items_details(itemIds)
         sql = f"""
             select {self.hstgrp_table}.name as group_name, hosts.hostid as hostid, hosts.host as host_name, items.itemid as itemid, items.key_ item_name
                 from hosts 
@@ -310,35 +476,17 @@ class ZabbixPSqlGetter(DataGetter):
     
 
     def get_group_map(self, itemIds: List[int], group_names: List[str]) -> Dict[int, str]:
-        if len(itemIds) == 0:
-            return {}
-        
-        if len(group_names) == 0:
+        if self.item_cache is not None:
+            return self.item_cache.get_group_map(itemIds, group_names)
+        if len(itemIds) == 0 or len(group_names) == 0:
             return {}
-        
-        group_map = {}
-        for group_name in group_names:
-            sql = f"""
-                SELECT items.itemid
-                FROM hosts 
-                inner join items on hosts.hostid = items.hostid
-                inner join hosts_groups on hosts_groups.hostid = hosts.hostid
-                inner join {self.hstgrp_table} on {self.hstgrp_table}.groupid = hosts_groups.groupid 
-                WHERE ({self.hstgrp_table}.name = '{group_name}' OR {self.hstgrp_table}.name LIKE '{group_name}/%') 
-                AND items.itemid IN ({",".join(map(str, itemIds))})
-            """
-
-            cur = self.db.exec_sql(sql)
-            rows = cur.fetchall()
-            cur.close()
-            if len(rows) == 0:
-                continue
-
-            for row in rows:
-                group_map[row[0]] = group_name
 
+        # a later group name wins, as when the groups were queried one by one
+        group_map = {}
+        for itemId, idx in sorted(self._match_groups(itemIds, group_names), key=lambda pair: pair[1]):
+            group_map[itemId] = group_names[idx]
         return group_map
-    
+
     def get_item_html_title(self, itemId: int, chart_type="") -> str:
         # link to zabbix chart 
         # http://{{ api_url }}/history.php?itemids%5B0%5D={{ itemid }}&period=now-30d&action=showgraph
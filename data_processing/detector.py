@@ -9,6 +9,9 @@ from utils import normalizer
 import data_getter
 from models.models_set import ModelsSet
 from data_processing.history_stats import HistoryStats
+from data_processing import parallel
+from data_processing.pipeline import run_pipelined
+from data_processing.frame_cache import FrameCache
 
 
 
@@ -39,6 +42,9 @@ class Detector:
         self.long_trends_retention = int(data_source.get("long_trends_retention", 60))
         self.anomaly_valid_count_rate = data_source["anomaly_valid_count_rate"]
         self.anomaly_keep_secs = int(data_source["anomaly_keep_secs"])
+        self.workers = int(data_source.get("workers", 1))
+        self.frame_cache_mb = int(data_source.get("frame_cache_mb", 512))
+        self.prefetch_depth = int(data_source.get("prefetch_depth", 1))
         
         self.data_source = data_source
         self.data_source_name = data_source_name
@@ -55,11 +61,17 @@ class Detector:
             raise ValueError("No itemIds found in data source")
         self.itemIds = itemIds
 
+        self.trends_cache = None
+        self.history_cache = None
+        self.cache_t_start = 0
+        self.cache_endep = 0
+
 
     def initialize_data(self):
         ms = self.ms
         ms.history.truncate()
         ms.history_stats.truncate()
+        ms.history_stats_buckets.truncate()
         ms.history_updates.truncate()
         ms.anomalies.truncate()
        
@@ -86,6 +98,7 @@ class Detector:
         oldendep = ms.history_updates.get_endep()
         if oldendep > 0:
             if startep > oldendep + history_interval*2:
+                # the stored buckets are all out of the window, they are overwritten as the window fills
                 ms.history_updates.truncate()
                 ms.history.truncate()
                 ms.history_stats.truncate()
@@ -126,37 +139,43 @@ class Detector:
             if hist_df.empty:
                 return 
             
-            for itemId in batch_itemIds:
-                item_hist_df = hist_df[hist_df['itemid'] == itemId]
-                if item_hist_df.empty:
-                    continue
-
-                # sort by clock
-                item_hist_df = item_hist_df.sort_values(by='clock')
-
-                values = normalizer.fit_to_base_clocks(
-                    base_clocks, 
-                    item_hist_df['clock'].tolist(), 
-                    item_hist_df['value'].tolist())
-                ms.history.upsert([itemId]*len(base_clocks), base_clocks, values)
+            # resample all items of the batch in one pass
+            hist_df = hist_df[hist_df['itemid'].isin(batch_itemIds)]
+            fitted_itemIds, values = normalizer.fit_to_base_clocks_matrix(hist_df, base_clocks)
+            if len(fitted_itemIds) > 0:
+                ms.history.upsert_df(normalizer.matrix2df(fitted_itemIds, base_clocks, values))
 
             if oldep > 0:
                 # delete old history data
                 ms.history.remove_old_data(oldep)
 
 
+
+    def _run_batches(self, method_name: str, itemIds: List[int], **kwargs) -> List:
+        # runs self.<method_name>(batch_itemIds, **kwargs) per batch, on a process pool if workers > 1.
+        # Otherwise methods split into <name>_fetch and <name>_compute prefetch the next batch
+        # while the current one is computed.
+        batch_size = self.batch_size
+        batches = [itemIds[i:i+batch_size] for i in range(0, len(itemIds), batch_size)]
+        name = method_name[:-len("_batch")]
+        if self.workers <= 1 and hasattr(self, f"{name}_fetch"):
+            fetch = getattr(self, f"{name}_fetch")
+            compute = getattr(self, f"{name}_compute")
+            return run_pipelined(name, 
+                                 lambda batch: fetch(batch, **kwargs), 
+                                 lambda batch, data: compute(batch, data, **kwargs), 
+                                 batches, self.prefetch_depth)
+        return parallel.run_batches(self, method_name, batches, self.workers, **kwargs)
+
         
     def detect1(self) -> List[int]:
-        batch_size = self.batch_size
         ms = self.ms
         itemIds = self.itemIds
         
         log(f"detector.detect1: itemIds: {len(itemIds)}")
 
         anomaly_itemIds = []
-        for i in range(0, len(itemIds), batch_size):
-            batch_itemIds = itemIds[i:i + batch_size]
-            batch_anomaly_itemIds = self.detect1_batch(batch_itemIds)
+        for batch_anomaly_itemIds in self._run_batches("detect1_batch", itemIds):
             if len(batch_anomaly_itemIds) > 0:
                 anomaly_itemIds += batch_anomaly_itemIds
 
@@ -164,9 +183,10 @@ class Detector:
         return anomaly_itemIds
 
 
-    def _evaluate_cond(self, value: float, cond: Dict) -> bool:
+    def _evaluate_cond(self, value, cond: Dict):
+        # value may be a scalar or an array, an array of bools is returned for arrays
         if "condition" not in cond.keys():
-            return False
+            return np.zeros_like(value, dtype=bool) if np.ndim(value) > 0 else False
 
         operator = cond["condition"].get("operator", "")
         threshold = cond["condition"].get("value", "")
@@ -180,7 +200,7 @@ class Detector:
             return value >= threshold
         elif operator == "<=":
             return value <= threshold
-        return False
+        return np.zeros_like(value, dtype=bool) if np.ndim(value) > 0 else False
 
     def _get_h_stats(self, itemIds: List[int]) -> pd.DataFrame:
         ms = self.ms
@@ -232,86 +252,116 @@ class Detector:
         
 
     def _filter_by_conds(self, itemIds: List[int], h_stats_df: pd.DataFrame) -> List[int]:
-        dg = self.dg
-        # filter by defined conds
-        #log(f"detector.filter_by_cond(itemIds)")
-        item_conds = self.item_conds
-        if len(item_conds) > 0 and len(itemIds) > 0:
-            for cond in item_conds:
-                if len(itemIds) == 0:
-                    break
-                itemIds2 = dg.check_itemId_cond(itemIds, cond["filter"])
-                for itemId in itemIds2:
-                    #print(h_stats_df[h_stats_df['itemid'] == itemId].iloc[0])
-                    value = h_stats_df[h_stats_df['itemid'] == itemId].iloc[0]['mean_h']
-                    if self._evaluate_cond(value, cond) == False:
-                        itemIds.remove(itemId)
+        """
+        Drops items matching a filter of item_conds (item_diff_conds) whose history mean
+        (|history mean - trends mean|) does not satisfy the condition.
+        All filters are resolved with one data source lookup and evaluated as masks.
+        """
+        conds = [(cond, 'mean_h') for cond in self.item_conds]
+        conds += [(cond, 'diff') for cond in self.item_diff_conds]
+        if len(conds) == 0 or len(itemIds) == 0:
+            return itemIds
 
+        matches = self.dg.check_itemId_conds(itemIds, [cond['filter'] for cond, _ in conds])
 
-        if len(itemIds) == 0:
-            return []
+        stats = h_stats_df.drop_duplicates('itemid').set_index('itemid')[['mean_h', 'mean_t']]
+        stats = stats.assign(diff=(stats['mean_h'] - stats['mean_t']).abs()).reindex(itemIds)
+        keep = np.ones(len(itemIds), dtype=bool)
+        for (cond, column), matched in zip(conds, matches):
+            if len(matched) == 0:
+                continue
+            is_matched = stats.index.isin(matched)
+            # items without stats cannot satisfy a condition
+            keep &= ~is_matched | self._evaluate_cond(stats[column].to_numpy(dtype=float), cond)
 
-        # filter by defined diff conds
-        item_diff_conds = self.item_diff_conds
-        h_stats_df['diff'] = abs(h_stats_df['mean_h'] - h_stats_df['mean_t'])
-
-        if len(item_diff_conds) > 0 and len(itemIds) > 0:
-            for cond in item_diff_conds:
-                if len(itemIds) == 0:
-                    break
-                itemIds2 = dg.check_itemId_cond(itemIds, cond['filter'])
-                for itemId in itemIds2:
-                    #if cond['filter'] == "key_ LIKE 'vmware.vm.guest.osuptime%'":
-                    #    print("")
-                    value = h_stats_df[h_stats_df['itemid'] == itemId].iloc[0]['diff']
-                    if self._evaluate_cond(value, cond) == False:
-                        itemIds.remove(itemId)
-        
-        return itemIds
+        return [itemId for itemId, k in zip(itemIds, keep) if k]
     
 
+    def open_frame_cache(self, endep: int, long_trends: bool = True) -> None:
+        """
+        Keep trends and history frames in memory until close_frame_cache().
+        Trends are fetched once per item from the widest window detect2/3/4 need
+        (long_trends_retention when long_trends) and narrower windows are sliced out.
+        """
+        retention = self.trends_retention
+        if long_trends:
+            retention = max(retention, self.long_trends_retention)
+        self.cache_t_start = endep - self.trends_interval * retention
+        self.cache_endep = endep
+        max_bytes = self.frame_cache_mb * 1024 * 1024
+        # split the budget evenly between trends and history
+        self.trends_cache = FrameCache("trends", max_bytes // 2)
+        self.history_cache = FrameCache("history", max_bytes // 2)
+
+
+    def close_frame_cache(self) -> None:
+        if self.trends_cache is None:
+            return
+        log(f"detector.frame_cache: trends: {self.trends_cache.stats()}, history: {self.history_cache.stats()}")
+        self.trends_cache = None
+        self.history_cache = None
+
+
+    def _get_trends_df(self, itemIds: List[int], startep: int, endep: int) -> pd.DataFrame:
+        if self.trends_cache is None or startep < self.cache_t_start or endep > self.cache_endep:
+            return self.dg.get_trends_full_data(itemIds=itemIds, startep=startep, endep=endep)
+        df = self.trends_cache.get(itemIds, 
+                                   lambda ids: self.dg.get_trends_full_data(itemIds=ids, 
+                                                                            startep=self.cache_t_start, 
+                                                                            endep=self.cache_endep))
+        if df.empty:
+            return df
+        return df[(df['clock'] >= startep) & (df['clock'] <= endep)].reset_index(drop=True)
+
+
+    def _get_history_df(self, itemIds: List[int], startep: int = 0, endep: int = 0) -> pd.DataFrame:
+        if self.history_cache is None:
+            return self.ms.history.get_data(itemIds, startep=startep, endep=endep)
+        df = self.history_cache.get(itemIds, lambda ids: self.ms.history.get_data(ids))
+        if df.empty:
+            return df
+        if startep > 0:
+            df = df[df['clock'] >= startep]
+        if endep > 0:
+            df = df[df['clock'] <= endep]
+        return df.reset_index(drop=True)
+
+
     def _get_df(self, itemIds: List[int], t_start: int, h_start: int, h_end: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
-        dg = self.dg
-        ms = self.ms
-        trends_df = dg.get_trends_full_data(itemIds=itemIds, startep=t_start, endep=h_start)
+        trends_df = self._get_trends_df(itemIds, startep=t_start, endep=h_start)
         if trends_df.empty:
             return pd.DataFrame(),pd.DataFrame()
-        history_df = ms.history.get_data(itemIds, startep=h_start, endep=h_end)
+        history_df = self._get_history_df(itemIds, startep=h_start, endep=h_end)
         if history_df.empty:
             return pd.DataFrame(),pd.DataFrame()
 
         return trends_df, history_df
 
 
-    def _detect_diff_anomalies(self, itemIds: List[int], 
-                            trends_df: pd.DataFrame, recent_stats: pd.DataFrame, 
+    def _get_trends_diff_stats(self, itemIds: List[int], trends_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        mean and std of the non-zero differences between adjacent trends of each item,
+        for value_max and value_min at once.
+        Returns columns itemid, mean_max, std_max, mean_min, std_min.
+        """
+        trends_df = trends_df[trends_df['itemid'].isin(itemIds)]
+        diffs = trends_df.groupby('itemid', sort=False)[['value_max', 'value_min']].diff().fillna(0)
+        # zero diffs (and the first trend of each item) are not counted
+        diffs = diffs.where(diffs != 0)
+        diffs['itemid'] = trends_df['itemid']
+        stats_df = diffs.groupby('itemid')[['value_max', 'value_min']].agg(['mean', 'std'])
+        stats_df.columns = ['mean_max', 'std_max', 'mean_min', 'std_min']
+        return stats_df.reset_index()
+
+
+    def _detect_diff_anomalies(self, trends_diff_stats: pd.DataFrame, recent_stats: pd.DataFrame, 
                             lamnda_threshold: float,
                             is_up=True) -> List[int]:
         ignore_diff_rate = self.ignore_diff_rate
-        if is_up:
-            trends_df2 = trends_df[['itemid', 'clock', 'value_max']]
-            trends_df2.columns = ['itemid', 'clock', 'value']
-        else:
-            trends_df2 = trends_df[['itemid', 'clock', 'value_min']]
-            trends_df2.columns = ['itemid', 'clock', 'value']
-
-
-        # create a dataframe with adjacent value_xx peaks from trends_df
-        trends_diff = pd.DataFrame(columns=['itemid', 'clock', 'value', 'diff'], dtype=object)
-        for itemId in itemIds:
-            df = trends_df2[trends_df2['itemid'] == itemId]
-            df = df.copy()
-            df['diff'] = df['value'].diff().fillna(0)
-            df = df[df['diff'] != 0]
-            if trends_diff.empty:
-                trends_diff = df
-            elif not df.empty and len(df) > 0:
-                trends_diff = pd.concat([trends_diff, df])
-
-        # calculate trends_diff mean and std
-        trends_diff_stats = trends_diff.groupby('itemid')['diff'].agg(['mean', 'std']).reset_index()
-        #recent_stats = recent_diff.groupby('itemid')['diff'].agg(['min', 'max']).reset_index()
-        
+        suffix = 'max' if is_up else 'min'
+        trends_diff_stats = trends_diff_stats[['itemid', f'mean_{suffix}', f'std_{suffix}']]
+        trends_diff_stats.columns = ['itemid', 'mean', 'std']
+
         # merge with hist_stats by itemid
         stats_df = pd.merge(recent_stats, trends_diff_stats, on='itemid', how='inner')
         stats_df = stats_df[stats_df['std'] > 0]
@@ -347,9 +397,10 @@ class Detector:
         r_stats = r_stats[['itemid', 'min_diff', 'max_diff']]
         r_stats.columns = ['itemid', 'min', 'max']
 
+        trends_diff_stats = self._get_trends_diff_stats(itemIds, trends_df)
 
-        itemIds_up = self._detect_diff_anomalies(itemIds, trends_df, r_stats, self.detect2_lambda_threshold, is_up=True)
-        itemIds_dw = self._detect_diff_anomalies(itemIds, trends_df, r_stats, self.detect2_lambda_threshold, is_up=False)
+        itemIds_up = self._detect_diff_anomalies(trends_diff_stats, r_stats, self.detect2_lambda_threshold, is_up=True)
+        itemIds_dw = self._detect_diff_anomalies(trends_diff_stats, r_stats, self.detect2_lambda_threshold, is_up=False)
 
         itemIds = itemIds_up + itemIds_dw
         itemIds = list(set(itemIds))
@@ -357,7 +408,6 @@ class Detector:
 
 
     def detect2(self, itemIds: List[int], endep: int) -> List[int]:
-        batch_size = self.batch_size
         if len(itemIds) == 0:
             itemIds = self.itemIds        
         log(f"detector.detect2: itemIds: {len(itemIds)}")
@@ -367,41 +417,45 @@ class Detector:
         
 
         anomaly_itemIds = []
-        for i in range(0, len(itemIds), batch_size):
-            batch_itemIds = itemIds[i:i+batch_size]
-            trends_df, history_df = self._get_df(batch_itemIds, t_start=t_start, h_start=h_start, h_end=endep)
-            if trends_df.empty or history_df.empty:
-                continue
-
-            anomaly_itemIds.extend(self._detect2_batch(history_df, trends_df, batch_itemIds))
+        for batch_anomaly_itemIds in self._run_batches("detect2_batch", itemIds, 
+                                                       t_start=t_start, h_start=h_start, endep=endep):
+            anomaly_itemIds.extend(batch_anomaly_itemIds)
 
         log(f"detector.detect2: found anomalies: {len(anomaly_itemIds)}")
         return anomaly_itemIds
+
+    def detect2_batch(self, itemIds: List[int], t_start: int, h_start: int, endep: int) -> List[int]:
+        data = self.detect2_fetch(itemIds, t_start=t_start, h_start=h_start, endep=endep)
+        return self.detect2_compute(itemIds, data, t_start=t_start, h_start=h_start, endep=endep)
+
+    def detect2_fetch(self, itemIds: List[int], t_start: int, h_start: int, endep: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        return self._get_df(itemIds, t_start=t_start, h_start=h_start, h_end=endep)
+
+    def detect2_compute(self, itemIds: List[int], data: Tuple[pd.DataFrame, pd.DataFrame], 
+                        t_start: int, h_start: int, endep: int) -> List[int]:
+        trends_df, history_df = data
+        if trends_df.empty or history_df.empty:
+            return []
+        return self._detect2_batch(history_df, trends_df, itemIds)
     
 
     def _filter_anomalies(self, df: pd.DataFrame, 
                         stats_df: pd.DataFrame,
                         lambda_threshold: float,
                         is_up=True) -> pd.DataFrame:
-        dtypes = np.dtype([('itemid', 'int64'), ('clock', 'int64'), ('value', 'float64')])
-        new_df = pd.DataFrame(np.empty(0, dtype=dtypes))
-        #new_df = pd.DataFrame(columns=['itemid', 'clock', 'value'])
-        for row in stats_df.itertuples():
-            itemId = row.itemid
-            std = row.std
-            mean = row.mean
-            if is_up:
-                df_part = df[(df['itemid'] == itemId) & (df['value'] > mean + lambda_threshold * std)]
-            else:
-                df_part = df[(df['itemid'] == itemId) & (df['value'] < mean - lambda_threshold * std)]
-            if df_part.empty:
-                continue
-            if new_df.empty:
-                new_df = df_part
-            else:
-                new_df = pd.concat([new_df, df_part])
-
-        return new_df
+        # rows of df beyond mean +/- lambda_threshold * std of their item in stats_df
+        if df.empty or stats_df.empty:
+            dtypes = np.dtype([('itemid', 'int64'), ('clock', 'int64'), ('value', 'float64')])
+            return pd.DataFrame(np.empty(0, dtype=dtypes))
+        stats_df = stats_df.drop_duplicates('itemid').set_index('itemid')
+        if is_up:
+            thresholds = stats_df['mean'] + lambda_threshold * stats_df['std']
+        else:
+            thresholds = stats_df['mean'] - lambda_threshold * stats_df['std']
+        thresholds = df['itemid'].map(thresholds)
+        if is_up:
+            return df[df['value'] > thresholds]
+        return df[df['value'] < thresholds]
 
     def _filter_by_anomaly_cnt(self, stats_df: pd.DataFrame, 
         hist_count: int,
@@ -417,44 +471,78 @@ class Detector:
             return []
 
         # get anomaly counts
-        df_anom_counts = df.groupby('itemid')['value'].count().reset_index()
-        df_anom_counts.columns = ['itemid', 'anom_cnt']
-        
-        # merge counts
-        #df_anom_counts = pd.merge(df_counts, df_anom_counts, on='itemid', how='left')
-        df_anom_counts = df_anom_counts.fillna(0)
-
-        # filter by anomaly up count
-        itemIds = df_anom_counts[(df_anom_counts['anom_cnt'] / hist_count > anomaly_valid_count_rate)]['itemid'].tolist()
+        anom_cnts = df.groupby('itemid')['value'].count()
 
-        # make unique
-        itemIds = list(set(itemIds))
+        # filter by anomaly count
+        itemIds = anom_cnts[anom_cnts / hist_count > anomaly_valid_count_rate].index.tolist()
         return itemIds
 
 
     def _calc_local_peak(self, itemIds: List[int], df: pd.DataFrame, window: int, is_up=True) -> pd.DataFrame:
-        new_df = []
-        for itemId in itemIds:
-            df_item = df[df['itemid'] == itemId]
-            if df_item.empty:
-                continue
-            epoch = df_item.iloc[-1]['clock']
-            startep = df_item.iloc[0]['clock']
-            window_half = window // 2
-            peak_val = -float('inf') if is_up else float('inf')
-            peak_epoch = 0
-            while epoch >= startep:
-                val = df_item[(df_item['clock'] <= epoch) & (df_item['clock'] > epoch - window)]['value'].mean()
-                if is_up:
-                    peak_val = max(peak_val, val)
-                    peak_epoch = epoch
-                else:
-                    peak_val = min(peak_val, val)
-                    peak_epoch = epoch
-                epoch -= window_half
-            new_df.append({'itemid': itemId, 'local_peak': peak_val, 'peak_clock': peak_epoch})
-            
-        return pd.DataFrame(new_df)
+        """
+        For each item, slides a window of `window` secs back from the last clock
+        in steps of window // 2 and returns the highest (lowest if not is_up) mean
+        value of the windows, as columns itemid, local_peak, peak_clock.
+        peak_clock is the start of the last window stepped to.
+        All items and windows are evaluated at once on the sorted values.
+        """
+        columns = ['itemid', 'local_peak', 'peak_clock']
+        df = df[df['itemid'].isin(itemIds)]
+        if df.empty:
+            return pd.DataFrame(columns=columns)
+        window_half = window // 2
+
+        # first and last clock of each item in the order given
+        ends = df.groupby('itemid', sort=False)['clock'].agg(['first', 'last'])
+        ends = ends.reindex([itemId for itemId in dict.fromkeys(itemIds) if itemId in ends.index])
+        firsts = ends['first'].to_numpy(dtype=np.int64)
+        lasts = ends['last'].to_numpy(dtype=np.int64)
+
+        # window end epochs: last, last - half, ... while >= first
+        n_steps = np.where(lasts >= firsts, (lasts - firsts) // window_half + 1, 0)
+        item_pos = np.repeat(np.arange(len(ends)), n_steps)
+        step = np.arange(n_steps.sum()) - np.repeat(np.cumsum(n_steps) - n_steps, n_steps)
+        epochs = lasts[item_pos] - step * window_half
+
+        # sort values by (item position, clock) and search both window edges in one array
+        sorted_df = df.assign(pos=ends.index.get_indexer(df['itemid'])).sort_values(['pos', 'clock'], kind='stable')
+        pos = sorted_df['pos'].to_numpy(dtype=np.int64)
+        clocks = sorted_df['clock'].to_numpy(dtype=np.int64)
+        values = sorted_df['value'].to_numpy(dtype=float)
+        offset = min(clocks.min(), epochs.min() - window) if len(epochs) > 0 else clocks.min()
+        span = clocks.max() - offset + 1
+        keys = pos * span + (clocks - offset)
+        hi = np.searchsorted(keys, item_pos * span + (epochs - offset), side='right')
+        lo = np.searchsorted(keys, item_pos * span + (epochs - window - offset), side='right')
+
+        # window means, NaN when the window has no values
+        valid = ~np.isnan(values)
+        cnts = np.concatenate([[0], np.cumsum(valid)])
+        cnt = cnts[hi] - cnts[lo]
+        sums = np.zeros(len(epochs))
+        has_rows = hi > lo
+        if has_rows.any():
+            # reduceat over (lo, hi) pairs sums values[lo:hi] at the even positions
+            padded = np.append(np.where(valid, values, 0.0), 0.0)
+            bounds = np.column_stack([lo[has_rows], hi[has_rows]]).ravel()
+            sums[has_rows] = np.add.reduceat(padded, bounds)[::2]
+        means = np.full(len(epochs), np.nan)
+        means[cnt > 0] = sums[cnt > 0] / cnt[cnt > 0]
+
+        # peak over the windows of each item, ignoring empty windows
+        fill = -np.inf if is_up else np.inf
+        peaks = np.full(len(ends), fill)
+        has_steps = n_steps > 0
+        if has_steps.any():
+            reduce = np.fmax if is_up else np.fmin
+            starts = (np.cumsum(n_steps) - n_steps)[has_steps]
+            item_peaks = reduce.reduceat(means, starts)
+            peaks[has_steps] = np.where(np.isnan(item_peaks), fill, item_peaks)
+        peak_clocks = np.where(has_steps, lasts - (n_steps - 1) * window_half, 0)
+
+        return pd.DataFrame({'itemid': ends.index.to_numpy(), 
+                             'local_peak': peaks, 
+                             'peak_clock': peak_clocks}, columns=columns)
 
 
     # df_counts, lambda2_threshold, density_window
@@ -499,9 +587,10 @@ class Detector:
             trends_df: pd.DataFrame,
             base_clocks: List[int],
             itemIds: List[int], 
-            startep2: int) -> List[int]:
+            startep2: int,
+            history_df: pd.DataFrame = None) -> List[int]:
+        # history_df: the local history of the batch if already fetched
 
-        ms = self.ms
         cnts = trends_df.groupby('itemid')['value_avg'].count().reset_index()
         cnts.columns = ['itemid', 'cnt']
         itemIds = cnts[cnts['cnt'] > 0]['itemid'].tolist()
@@ -513,7 +602,10 @@ class Detector:
 
         
         # get history data
-        history_df1 = ms.history.get_data(itemIds)
+        if history_df is None:
+            history_df1 = self._get_history_df(itemIds)
+        else:
+            history_df1 = history_df[history_df['itemid'].isin(itemIds)].reset_index(drop=True)
         if history_df1.empty:
             return []
         
@@ -560,7 +652,6 @@ class Detector:
 
     
     def detect3(self, itemIds: List[int], endep: int, is_long_trend=False) -> List[int]:
-        batch_size = self.batch_size
         if len(itemIds) == 0:
             itemIds = self.itemIds
         if is_long_trend:
@@ -572,17 +663,35 @@ class Detector:
         log(f"detector.detect3: itemIds: {len(itemIds)}")
 
         anomaly_itemIds = []
-        for i in range(0, len(itemIds), batch_size):
-            batch_itemIds = itemIds[i:i+batch_size]
-            trends_df, history_df = self._get_df(batch_itemIds, t_start=t_start, h_start=h_start, h_end=endep)
-            if trends_df.empty or history_df.empty:
-                continue
-
-            anomaly_itemIds.extend(self._detect3_batch(trends_df, base_clocks, batch_itemIds, h_start))
+        for batch_anomaly_itemIds in self._run_batches("detect3_batch", itemIds, 
+                                                       t_start=t_start, h_start=h_start, endep=endep, 
+                                                       base_clocks=base_clocks):
+            anomaly_itemIds.extend(batch_anomaly_itemIds)
 
         log(f"detector.detect3: found anomalies: {anomaly_itemIds}")
         return anomaly_itemIds
 
+    def detect3_batch(self, itemIds: List[int], t_start: int, h_start: int, endep: int, 
+                      base_clocks: List[int]) -> List[int]:
+        data = self.detect3_fetch(itemIds, t_start=t_start, h_start=h_start, endep=endep, base_clocks=base_clocks)
+        return self.detect3_compute(itemIds, data, t_start=t_start, h_start=h_start, endep=endep, 
+                                    base_clocks=base_clocks)
+
+    def detect3_fetch(self, itemIds: List[int], t_start: int, h_start: int, endep: int, 
+                      base_clocks: List[int]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        # trends and the whole local history of the batch, empty frames without recent history
+        trends_df, history_df = self._get_df(itemIds, t_start=t_start, h_start=h_start, h_end=endep)
+        if trends_df.empty or history_df.empty:
+            return trends_df, history_df
+        return trends_df, self._get_history_df(itemIds)
+
+    def detect3_compute(self, itemIds: List[int], data: Tuple[pd.DataFrame, pd.DataFrame], 
+                        t_start: int, h_start: int, endep: int, base_clocks: List[int]) -> List[int]:
+        trends_df, history_df = data
+        if trends_df.empty or history_df.empty:
+            return []
+        return self._detect3_batch(trends_df, base_clocks, itemIds, h_start, history_df)
+
 
 
     # group_map is a dict of itemId to group_name
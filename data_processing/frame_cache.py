@@ -0,0 +1,117 @@
+"""
+Per-run cache of item data frames.
+
+Detector stages (detect2, detect3, detect4) read trends and history for
+shrinking subsets of the same items over nested time windows. FrameCache
+keeps what has been fetched keyed by itemid, so a stage only queries the items
+it has not seen yet and serves the rest from memory. The caller fetches the
+widest window once and slices narrower windows out of the returned frame.
+
+Frames are kept as one chunk per fetch and evicted least recently used first
+once their total size exceeds max_bytes.
+"""
+from collections import OrderedDict
+from typing import Callable, Dict, List
+import logging
+
+import pandas as pd
+
+
+def log(msg, level=logging.INFO):
+    msg = f"[data_processing/frame_cache.py] {msg}"
+    logging.log(level, msg)
+
+
+class FrameCache:
+    def __init__(self, name: str, max_bytes: int):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        # chunk_id -> (itemIds, df, nbytes), least recently used first
+        self._chunks = OrderedDict()
+        # itemid -> chunk_id
+        self._item_chunk: Dict[int, int] = {}
+        self._next_chunk_id = 0
+        self._columns = None
+
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "fetches": 0,
+            "evictions": 0,
+        }
+
+    def get(self, itemIds: List[int], fetch: Callable[[List[int]], pd.DataFrame]) -> pd.DataFrame:
+        """
+        Returns the rows of itemIds sorted by itemid and clock.
+        fetch(missing_itemIds) is called at most once for the items not cached yet.
+        """
+        itemIds = list(dict.fromkeys(itemIds))
+        missing = [itemId for itemId in itemIds if itemId not in self._item_chunk]
+        cached = [itemId for itemId in itemIds if itemId in self._item_chunk]
+        self.counters["hits"] += len(cached)
+        self.counters["misses"] += len(missing)
+
+        frames = []
+        # group cached items by chunk
+        by_chunk: Dict[int, List[int]] = {}
+        for itemId in cached:
+            by_chunk.setdefault(self._item_chunk[itemId], []).append(itemId)
+        for chunk_id, chunk_itemIds in by_chunk.items():
+            all_itemIds, df, _ = self._chunks[chunk_id]
+            self._chunks.move_to_end(chunk_id)
+            if len(chunk_itemIds) == len(all_itemIds):
+                frames.append(df)
+            else:
+                frames.append(df[df['itemid'].isin(chunk_itemIds)])
+
+        if len(missing) > 0:
+            df = fetch(missing)
+            self.counters["fetches"] += 1
+            if self._columns is None:
+                self._columns = list(df.columns)
+            self._put(missing, df)
+            frames.append(df)
+
+        frames = [df for df in frames if not df.empty]
+        if len(frames) == 0:
+            return pd.DataFrame(columns=self._columns, dtype=object)
+        if len(frames) == 1:
+            return frames[0].reset_index(drop=True)
+        df = pd.concat(frames, ignore_index=True)
+        return df.sort_values(['itemid', 'clock'], ignore_index=True)
+
+    def _put(self, itemIds: List[int], df: pd.DataFrame):
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.max_bytes:
+            log(f"{self.name}: {nbytes} bytes for {len(itemIds)} items exceeds the limit, not cached",
+                level=logging.DEBUG)
+            return
+        while self.bytes + nbytes > self.max_bytes and len(self._chunks) > 0:
+            self._evict()
+
+        chunk_id = self._next_chunk_id
+        self._next_chunk_id += 1
+        self._chunks[chunk_id] = (itemIds, df, nbytes)
+        for itemId in itemIds:
+            self._item_chunk[itemId] = chunk_id
+        self.bytes += nbytes
+
+    def _evict(self):
+        chunk_id, (itemIds, _, nbytes) = self._chunks.popitem(last=False)
+        for itemId in itemIds:
+            if self._item_chunk.get(itemId) == chunk_id:
+                del self._item_chunk[itemId]
+        self.bytes -= nbytes
+        self.counters["evictions"] += 1
+
+    def clear(self):
+        self._chunks.clear()
+        self._item_chunk.clear()
+        self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        stats = dict(self.counters)
+        stats["items"] = len(self._item_chunk)
+        stats["bytes"] = self.bytes
+        return stats
@@ -1,5 +1,74 @@
-from data_processing.stats import Stats
+from typing import List
+import numpy as np
+import pandas as pd
+import logging
+
+from data_processing.stats import Stats, moments_std
+from data_processing.pipeline import run_pipelined
+
+
+def log(msg, level=logging.INFO):
+    msg = f"[data_processing/history_stats.py] {msg}"
+    logging.log(level, msg)
+
 
 class HistoryStats(Stats):
+    """
+    History window stats kept as per item, per history_interval buckets of
+    cnt, mean and m2 (ms.history_stats_buckets).
+    Each run only fetches the buckets that are not stored yet, plus the last
+    stored one which was still being filled. The window stats are merged from
+    the buckets in the window, so expired data is never fetched again.
+    """
     data_type = "history"
 
+    def _fetch_buckets_batch(self, itemIds: List[int], fetch_startep: int, endep: int) -> pd.DataFrame:
+        return self.dg.get_history_bucket_sums(startep=fetch_startep, endep=endep,
+                                               interval=self.ms.history_stats_buckets.interval,
+                                               itemIds=itemIds)
+
+    def _update_buckets_batch(self, buckets: pd.DataFrame):
+        if len(buckets) == 0:
+            return
+        res = self.ms.history_stats_buckets.upsert_buckets_df(buckets[['itemid', 'bucket', 'cnt', 'mean', 'm2']])
+        log(f"history_stats_buckets upserted {res['rows']} rows in {res['secs']:.3f} secs")
+
+    def _update_window_stats(self, itemIds: List[int], window_startep: int, endep: int):
+        stats = self.ms.history_stats_buckets.read_window_moments(itemIds, window_startep, endep)
+        if len(stats) == 0:
+            return
+        stats['std'] = moments_std(stats['cnt'], stats['m2'])
+        stats['sum'] = stats['mean'] * stats['cnt']
+        stats['sqr_sum'] = stats['m2'] + stats['cnt'] * np.square(stats['mean'])
+        self._upsert_stats(stats)
+
+    def update_stats(self, startep: int, diff_startep: int, endep: int, oldstartep: int):
+        """
+        diff_startep is the first clock not covered by the previous run
+        (startep after a gap or on the first run). oldstartep is not needed
+        as expired buckets are simply left out of the window.
+        """
+        if diff_startep == 0:
+            raise ValueError("diff_startep must be given")
+        batch_size = self.data_source["batch_size"]
+        buckets = self.ms.history_stats_buckets
+
+        # buckets starting in [window_startep, endep] make up the window
+        window_startep = buckets.align(startep)
+        # the bucket holding the previous endep was partial, fetch it again
+        fetch_startep = max(buckets.align(int(diff_startep) - 1), window_startep)
+
+        existing, nonexisting = buckets.separate_existing_itemIds(self.itemIds)
+        prefetch_depth = int(self.data_source.get("prefetch_depth", 1))
+
+        def compute(batch_itemIds: List[int], batch_buckets: pd.DataFrame):
+            self._update_buckets_batch(batch_buckets)
+            self._update_window_stats(batch_itemIds, window_startep, int(endep))
+
+        # the missing buckets of existing items, the whole window for items without buckets.
+        # The next batch is fetched while the current one is stored.
+        for group_itemIds, group_startep in [(existing, fetch_startep), (nonexisting, window_startep)]:
+            batches = [group_itemIds[i:i+batch_size] for i in range(0, len(group_itemIds), batch_size)]
+            run_pipelined("history_stats_buckets", 
+                          lambda batch: self._fetch_buckets_batch(batch, group_startep, int(endep)), 
+                          compute, batches, prefetch_depth)
@@ -0,0 +1,78 @@
+"""
+Run Detector batches on a process pool.
+
+Each worker process builds its own Detector (and therefore its own data getter
+and DB connections) once in the pool initializer and then runs batch methods by
+name. Results are put back in batch order, so the merged output is the same as
+a sequential run. Batches whose worker failed are re-run in the main process.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List
+import logging
+import os
+import time
+
+import utils.config_loader as config_loader
+
+
+def log(msg, level=logging.INFO):
+    msg = f"[data_processing/parallel.py] {msg}"
+    logging.log(level, msg)
+
+
+_worker_detector = None
+
+
+def _init_worker(conf: Dict, data_source_name: str, data_source: Dict, itemIds: List[int]):
+    global _worker_detector
+    from data_processing.detector import Detector
+    config_loader.conf = conf
+    data_source = dict(data_source)
+    data_source["workers"] = 1
+    _worker_detector = Detector(data_source_name, data_source, itemIds)
+
+
+def _run_batch(method_name: str, batch_itemIds: List[int], kwargs: Dict):
+    start = time.time()
+    result = getattr(_worker_detector, method_name)(batch_itemIds, **kwargs)
+    return result, os.getpid(), time.time() - start
+
+
+def run_batches(detector, method_name: str, batches: List[List[int]], workers: int, **kwargs) -> List:
+    """
+    Calls detector.<method_name>(batch, **kwargs) for every batch and returns
+    the results in batch order.
+    """
+    if workers <= 1 or len(batches) <= 1:
+        return [getattr(detector, method_name)(batch, **kwargs) for batch in batches]
+
+    results = [None] * len(batches)
+    failed = []
+    timings = {}
+    start = time.time()
+    initargs = (config_loader.conf, detector.data_source_name, detector.data_source, detector.itemIds)
+    with ProcessPoolExecutor(max_workers=min(workers, len(batches)),
+                             initializer=_init_worker, initargs=initargs) as executor:
+        futures = {executor.submit(_run_batch, method_name, batch, kwargs): i for i, batch in enumerate(batches)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                result, pid, secs = future.result()
+            except Exception as e:
+                log(f"{method_name}: batch {i} failed in worker: {e}", level=logging.WARNING)
+                failed.append(i)
+                continue
+            results[i] = result
+            timing = timings.setdefault(pid, {"batches": 0, "secs": 0.0})
+            timing["batches"] += 1
+            timing["secs"] += secs
+
+    for i in sorted(failed):
+        log(f"{method_name}: re-running batch {i} in the main process")
+        results[i] = getattr(detector, method_name)(batches[i], **kwargs)
+
+    for pid, timing in sorted(timings.items()):
+        log(f"{method_name}: worker {pid}: {timing['batches']} batches in {timing['secs']:.3f} secs")
+    log(f"{method_name}: {len(batches)} batches on {workers} workers in {time.time() - start:.3f} secs "
+        f"({len(failed)} re-run)")
+    return results
@@ -0,0 +1,96 @@
+"""
+Prefetch pipeline for batch loops.
+
+A batch loop normally waits for the data source, then computes, then waits
+again for the next batch. run_pipelined() fetches on a background thread
+instead, so that batch i+1 is fetched while batch i is computed. At most
+`depth` fetched batches wait in the queue, which bounds the extra memory.
+
+fetch runs on the background thread and compute on the calling thread, so
+fetch must only use thread-safe resources (the data getter, pooled
+connections) and compute must not touch what fetch uses without a lock.
+"""
+from queue import Queue, Empty, Full
+from typing import Any, Callable, Dict, List
+import threading
+import logging
+import time
+
+
+def log(msg, level=logging.INFO):
+    msg = f"[data_processing/pipeline.py] {msg}"
+    logging.log(level, msg)
+
+
+class _Failed:
+    def __init__(self, e: BaseException):
+        self.e = e
+
+
+def run_pipelined(name: str,
+                  fetch: Callable[[List[int]], Any],
+                  compute: Callable[[List[int], Any], Any],
+                  batches: List[List[int]], depth: int) -> List:
+    """
+    Returns [compute(batch, fetch(batch)) for batch in batches].
+    With depth > 0 and more than one batch, fetch runs ahead on a background
+    thread with at most depth fetched batches queued. Stage timings are logged.
+    """
+    if depth <= 0 or len(batches) <= 1:
+        return [compute(batch, fetch(batch)) for batch in batches]
+
+    queue = Queue(maxsize=depth)
+    stop = threading.Event()
+    timings = {"fetch": 0.0, "compute": 0.0, "wait": 0.0}
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce():
+        for batch in batches:
+            start = time.time()
+            try:
+                data = fetch(batch)
+            except BaseException as e:
+                put(_Failed(e))
+                return
+            timings["fetch"] += time.time() - start
+            if not put(data):
+                return
+
+    start = time.time()
+    producer = threading.Thread(target=produce, name=f"prefetch-{name}", daemon=True)
+    producer.start()
+    results = []
+    try:
+        for batch in batches:
+            wait_start = time.time()
+            while True:
+                try:
+                    data = queue.get(timeout=0.1)
+                    break
+                except Empty:
+                    if not producer.is_alive() and queue.empty():
+                        raise RuntimeError(f"{name}: prefetch thread stopped")
+            timings["wait"] += time.time() - wait_start
+            if isinstance(data, _Failed):
+                raise data.e
+            compute_start = time.time()
+            results.append(compute(batch, data))
+            timings["compute"] += time.time() - compute_start
+    finally:
+        stop.set()
+        producer.join()
+
+    wall = time.time() - start
+    overlap = max(timings["fetch"] + timings["compute"] - wall, 0.0)
+    log(f"{name}: {len(batches)} batches in {wall:.3f} secs: fetch {timings['fetch']:.3f}, "
+        f"compute {timings['compute']:.3f}, waiting for fetch {timings['wait']:.3f}, "
+        f"overlapped {overlap:.3f} secs (depth={depth})")
+    return results
@@ -1,9 +1,42 @@
 import pandas as pd
-from typing import List, Dict
+from typing import List, Dict, Tuple
 import numpy as np
+import logging
 import data_getter
 from models.models_set import ModelsSet
-import utils
+from data_processing.pipeline import run_pipelined
+
+
+def log(msg, level=logging.INFO):
+    msg = f"[data_processing/stats.py] {msg}"
+    logging.log(level, msg)
+
+
+# Chan et al.'s parallel algorithm on (cnt, mean, m2) partitions,
+# m2 being the sum of squared differences from the mean.
+# Unlike sqr_sum - sum^2/cnt it does not cancel for large values.
+def merge_moments(cnt_a, mean_a, m2_a, cnt_b, mean_b, m2_b):
+    """ (cnt, mean, m2) of the union of partitions a and b """
+    cnt = cnt_a + cnt_b
+    safe_cnt = np.where(cnt > 0, cnt, 1)
+    delta = mean_b - mean_a
+    mean = np.where(cnt > 0, mean_a + delta * cnt_b / safe_cnt, 0.0)
+    m2 = np.where(cnt > 0, m2_a + m2_b + np.square(delta) * cnt_a * cnt_b / safe_cnt, 0.0)
+    return cnt, mean, m2
+
+def subtract_moments(cnt_t, mean_t, m2_t, cnt_b, mean_b, m2_b):
+    """ (cnt, mean, m2) of partition a where t is the union of a and b """
+    cnt = cnt_t - cnt_b
+    safe_cnt = np.where(cnt > 0, cnt, 1)
+    mean = np.where(cnt > 0, mean_t + (mean_t - mean_b) * cnt_b / safe_cnt, 0.0)
+    delta = mean_b - mean
+    m2 = m2_t - m2_b - np.square(delta) * cnt * cnt_b / np.where(cnt_t > 0, cnt_t, 1)
+    m2 = np.where(cnt > 0, np.maximum(m2, 0.0), 0.0)
+    return cnt, mean, m2
+
+def moments_std(cnt, m2):
+    """ sample std (Bessel's correction, like pandas' std()) """
+    return np.where(cnt > 1, np.sqrt(np.maximum(m2, 0.0) / np.where(cnt > 1, cnt - 1, 1)), 0.0)
 
 
 class Stats:
@@ -37,6 +70,13 @@ class Stats:
             return self.dg.get_trends_data(startep=startep, endep=endep, itemIds=itemIds)
         elif self.data_type == "history":
             return self.dg.get_history_data(startep=startep, endep=endep, itemIds=itemIds)
+
+    # sum, sqr_sum, cnt, mean and m2 per itemid, aggregated by the data source
+    def _get_sums(self, startep: int, endep: int, itemIds: List[int]):
+        if self.data_type == "trends":
+            return self.dg.get_trends_sums(startep=startep, endep=endep, itemIds=itemIds)
+        elif self.data_type == "history":
+            return self.dg.get_history_sums(startep=startep, endep=endep, itemIds=itemIds)
         
     def _get_stats(self, itemIds: List[int]):
         if self.data_type == "trends":
@@ -53,31 +93,36 @@ class Stats:
     def _upsert_stats(self, stats: pd.DataFrame):
         ms = self.ms
         if self.data_type == "trends":
-            for _, row in stats.iterrows():
-                ms.trends_stats.upsert_stats(
-                    row['itemid'], row['sum'], row['sqr_sum'], row['cnt'], 
-                    row['mean'], row['std']
-                )
+            res = ms.trends_stats.upsert_stats_df(stats)
         elif self.data_type == "history":
-            for _, row in stats.iterrows():
-                ms.history_stats.upsert_stats(
-                    row['itemid'], row['sum'], row['sqr_sum'], row['cnt'], 
-                    row['mean'], row['std']
-                )
+            res = ms.history_stats.upsert_stats_df(stats)
+        else:
+            return
+        log(f"{self.data_type}_stats upserted {res['rows']} rows in {res['secs']:.3f} secs")
 
 
     def _update_stats_batch(self, itemIds: List[int], 
                                 startep: int, diff_startep: int, endep: int, oldstartep: int):
+        data = self._fetch_stats_batch(itemIds, startep, diff_startep, endep, oldstartep)
+        self._merge_stats_batch(itemIds, data)
+
+    def _fetch_stats_batch(self, itemIds: List[int], 
+                                startep: int, diff_startep: int, endep: int, oldstartep: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        # data source part of a batch: sums of the new range and of the expired range (None if not needed)
         if diff_startep == 0:
             raise ValueError("diff_startep must be given")
-        data = self._get_data(startep=diff_startep, endep=endep, itemIds=itemIds)
-        # calculate sum, sqr_sum, count
-        new_stats = data.groupby('itemid').agg(
-            sum=('value', 'sum'),
-            sqr_sum=('value', utils.square_sum),
-            cnt=('value', 'count'),
-        ).reset_index()
+        # sum, sqr_sum, count, mean and m2 of the new data
+        new_stats = self._get_sums(startep=diff_startep, endep=endep, itemIds=itemIds)
+        if len(new_stats) == 0:
+            return new_stats, None
+
+        old_stats = None
+        if oldstartep > 0 and startep != diff_startep:
+            old_stats = self._get_sums(itemIds=itemIds, startep=oldstartep, endep=startep)
+        return new_stats, old_stats
 
+    def _merge_stats_batch(self, itemIds: List[int], data: Tuple[pd.DataFrame, pd.DataFrame]):
+        new_stats, old_stats = data
         if len(new_stats) == 0:
             return
         
@@ -88,55 +133,41 @@ class Stats:
         if len(stats) > 0:
             # merge new stats to stats
             stats = pd.merge(stats, new_stats, on='itemid', how='inner', suffixes=('', '_new'))
+            stats = stats.astype({'cnt': 'int64', 'mean': 'float64', 'm2': 'float64'})
 
             # add new stats to stats
             if len(new_stats) > 0:
                 stats['sum'] = stats['sum'] + stats['sum_new']
                 stats['sqr_sum'] = stats['sqr_sum'] + stats['sqr_sum_new']
-                stats['cnt'] = stats['cnt'] + stats['cnt_new']
+                stats['cnt'], stats['mean'], stats['m2'] = merge_moments(
+                    stats['cnt'], stats['mean'], stats['m2'], 
+                    stats['cnt_new'], stats['mean_new'], stats['m2_new'])
 
-            stats = stats[['itemid', 'sum', 'sqr_sum', 'cnt']]
+            stats = stats[['itemid', 'sum', 'sqr_sum', 'cnt', 'mean', 'm2']]
         else:
-            stats = new_stats
+            stats = new_stats[['itemid', 'sum', 'sqr_sum', 'cnt', 'mean', 'm2']]
 
         # fillna
         stats = stats.fillna(0)
 
 
-        # get old data
-        if oldstartep > 0 and startep != diff_startep:
-            old_data = self._get_data(itemIds=itemIds, startep=oldstartep, endep=startep)
-            if len(old_data) > 0:
-
-                old_stats = old_data.groupby('itemid').agg(
-                    sum=('value', 'sum'),
-                    sqr_sum=('value', utils.square_sum),
-                    cnt=('value', 'count')
-                ).reset_index()
-
-                # subtract old stats from stats
-                if len(old_stats) > 0:
-                    stats = pd.merge(stats, old_stats, on='itemid', how='outer', suffixes=('', '_old'))
-                    stats = stats.fillna(0)
-                    stats['sum'] = stats['sum'] - stats['sum_old']
-                    stats['sqr_sum'] = stats['sqr_sum'] - stats['sqr_sum_old']
-                    stats['cnt'] = stats['cnt'] - stats['cnt_old']
-                    stats = stats[['itemid', 'sum', 'sqr_sum', 'cnt']]
+        # subtract old stats from stats
+        if old_stats is not None:
+            if len(old_stats) > 0:
+                stats = pd.merge(stats, old_stats, on='itemid', how='outer', suffixes=('', '_old'))
+                stats = stats.fillna(0)
+                stats['sum'] = stats['sum'] - stats['sum_old']
+                stats['sqr_sum'] = stats['sqr_sum'] - stats['sqr_sum_old']
+                stats['cnt'], stats['mean'], stats['m2'] = subtract_moments(
+                    stats['cnt'], stats['mean'], stats['m2'], 
+                    stats['cnt_old'], stats['mean_old'], stats['m2_old'])
+                stats = stats[['itemid', 'sum', 'sqr_sum', 'cnt', 'mean', 'm2']]
 
         
-        # calculate mean and std
-        stats = stats.fillna(0)
-        stats = stats[stats['cnt'] > 0]
-        stats['mean'] = stats['sum'] / stats['cnt']
-        # Adjust standard deviation calculation to match pandas' std() with Bessel's correction
-        stats['std'] = np.sqrt((stats['sqr_sum'] - (np.square(stats['sum']) / stats['cnt'])) / (stats['cnt'] - 1))
-        stats['std'] = stats['std'].replace([np.inf, -np.inf], np.nan).fillna(0)
-        # Replace inf values in the entire DataFrame with 0
-        stats.replace([np.inf, -np.inf], 0, inplace=True)
-
-
-        # fillna
+        # calculate std
         stats = stats.fillna(0)
+        stats = stats[stats['cnt'] > 0].copy()
+        stats['std'] = moments_std(stats['cnt'], stats['m2'])
 
         
         # upsert stats
@@ -153,13 +184,12 @@ class Stats:
         oldstartep = int(oldstartep)
 
         existing, nonexisting = self._separate_existing_itemIds(itemIds)
+        prefetch_depth = int(self.data_source.get("prefetch_depth", 1))
         
-        # import diff for existing itemIds
-        for i in range(0, len(existing), batch_size):
-            batch_itemIds = existing[i:i+batch_size]
-            self._update_stats_batch(batch_itemIds, startep, diff_startep, endep, oldstartep)
-
-        # import full for non existing itemIds
-        for i in range(0, len(nonexisting), batch_size):
-            batch_itemIds = nonexisting[i:i+batch_size]
-            self._update_stats_batch(batch_itemIds, startep, startep, endep, oldstartep)
+        # import diff for existing itemIds, then full for non existing itemIds.
+        # The next batch is fetched while the current one is merged.
+        for group_itemIds, batch_diff_startep in [(existing, diff_startep), (nonexisting, startep)]:
+            batches = [group_itemIds[i:i+batch_size] for i in range(0, len(group_itemIds), batch_size)]
+            run_pipelined(f"{self.data_type}_stats", 
+                          lambda batch: self._fetch_stats_batch(batch, startep, batch_diff_startep, endep, oldstartep), 
+                          self._merge_stats_batch, batches, prefetch_depth)
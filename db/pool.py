@@ -0,0 +1,235 @@
+"""
+Process-wide PostgreSQL connection pool.
+
+One pool is kept per server/database/user so that every PostgreSqlDB built
+from the same config (Model, ModelsSet, ZabbixPSqlGetter, ...) shares the same
+set of connections instead of opening a new session per statement.
+
+Config keys (in admdb or in the data source config):
+    pool_min_size: connections opened eagerly when the pool is created (default 1)
+    pool_max_size: upper bound of connections, further checkouts wait (default 10)
+    pool_timeout: seconds to wait for a free connection (default 30)
+    pool_validate_idle_secs: ping connections idle longer than this on checkout (default 30)
+"""
+import os
+import time
+import threading
+import logging
+from typing import Dict, Tuple
+
+import psycopg2
+import psycopg2.extensions
+
+
+def log(msg, level=logging.INFO):
+    msg = f"[db/pool.py] {msg}"
+    logging.log(level, msg)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PgConnectionPool:
+    def __init__(self, config: Dict):
+        self.config = config
+        self.min_size = int(config.get("pool_min_size", 1))
+        self.max_size = max(int(config.get("pool_max_size", 10)), 1)
+        self.timeout = float(config.get("pool_timeout", 30))
+        self.validate_idle_secs = float(config.get("pool_validate_idle_secs", 30))
+
+        self._cond = threading.Condition(threading.Lock())
+        # idle connections: list of (conn, last_used)
+        self._idle = []
+        self._in_use = set()
+        # search_path currently set on each connection
+        self._search_paths: Dict[int, str] = {}
+
+        self.counters = {
+            "checkouts": 0,
+            "waits": 0,
+            "created": 0,
+            "reconnects": 0,
+            "discarded": 0,
+        }
+
+        for _ in range(min(self.min_size, self.max_size)):
+            conn = self._new_conn()
+            self._idle.append((conn, time.time()))
+
+    def _new_conn(self):
+        config = self.config
+        conn_string = "host=%s dbname=%s user=%s password=%s" % (
+            config["host"],
+            config["dbname"],
+            config["user"],
+            config["password"])
+        if "port" in config:
+            conn_string += " port=%s" % config["port"]
+        conn = psycopg2.connect(conn_string)
+        conn.autocommit = True
+        # callers connect outside of the lock
+        with self._cond:
+            self.counters["created"] += 1
+        return conn
+
+    def _size(self) -> int:
+        return len(self._idle) + len(self._in_use)
+
+    def _is_alive(self, conn, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.time() - last_used < self.validate_idle_secs:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1;")
+            cur.close()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _set_search_path(self, conn, schema: str):
+        if self._search_paths.get(id(conn)) == schema:
+            return
+        cur = conn.cursor()
+        cur.execute(f"SET search_path TO {schema};")
+        cur.close()
+        self._search_paths[id(conn)] = schema
+
+    def _close_conn(self, conn):
+        self._search_paths.pop(id(conn), None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self, schema: str = "public"):
+        deadline = time.time() + self.timeout
+        with self._cond:
+            self.counters["checkouts"] += 1
+            waited = False
+            while True:
+                if len(self._idle) > 0:
+                    conn, last_used = self._idle.pop()
+                    self._in_use.add(conn)
+                    break
+                if self._size() < self.max_size:
+                    # reserve the slot while connecting outside of the lock
+                    conn, last_used = None, 0.0
+                    break
+                if not waited:
+                    self.counters["waits"] += 1
+                    waited = True
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolTimeout(f"no free connection after {self.timeout} seconds "
+                                      f"(max_size={self.max_size})")
+                self._cond.wait(remaining)
+
+            if conn is None:
+                # placeholder keeps the size accounting correct while connecting
+                placeholder = object()
+                self._in_use.add(placeholder)
+
+        if conn is None:
+            try:
+                conn = self._new_conn()
+            finally:
+                with self._cond:
+                    self._in_use.discard(placeholder)
+                    self._cond.notify()
+            with self._cond:
+                self._in_use.add(conn)
+        elif not self._is_alive(conn, last_used):
+            self._close_conn(conn)
+            try:
+                new_conn = self._new_conn()
+            except Exception:
+                with self._cond:
+                    self._in_use.discard(conn)
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._in_use.discard(conn)
+                self._in_use.add(new_conn)
+                self.counters["reconnects"] += 1
+            conn = new_conn
+
+        try:
+            self._set_search_path(conn, schema)
+        except psycopg2.Error:
+            self.putconn(conn, broken=True)
+            raise
+        return conn
+
+    def putconn(self, conn, broken: bool = False):
+        with self._cond:
+            if conn not in self._in_use:
+                return
+            self._in_use.discard(conn)
+            if broken or conn.closed:
+                self.counters["discarded"] += 1
+                self._close_conn(conn)
+            elif len(self._idle) >= self.max_size:
+                self._close_conn(conn)
+            else:
+                self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                self._close_conn(conn)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            stats = dict(self.counters)
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = len(self._in_use)
+        return stats
+
+
+_pools: Dict[Tuple, PgConnectionPool] = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+def _pool_key(config: Dict) -> Tuple:
+    return (config["host"], str(config.get("port", "")), config["dbname"], config["user"])
+
+
+def get_pool(config: Dict) -> PgConnectionPool:
+    """
+    Returns the pool shared by all PostgreSqlDB instances with the same
+    host, port, dbname and user. The search_path is tracked per connection,
+    so configs that only differ in schema share the pool as well.
+    """
+    global _pools_pid
+    key = _pool_key(config)
+    with _pools_lock:
+        # connections must not be shared with a forked child process
+        if _pools_pid != os.getpid():
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(key)
+        if pool is None:
+            pool = PgConnectionPool(config)
+            _pools[key] = pool
+        return pool
+
+
+def pool_stats() -> Dict[str, Dict[str, int]]:
+    with _pools_lock:
+        return {f"{k[3]}@{k[0]}/{k[2]}": p.stats() for k, p in _pools.items()}
+
+
+def close_all():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
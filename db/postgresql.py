@@ -4,29 +4,24 @@ from utils.config_loader import *
 from jinja2 import Template
 import pandas as pd
 
+from db.pool import get_pool
+from db.pgcopy import to_binary_copy
+
 class PostgreSqlDB:
 	def __init__(self, config):
 		self.conn = None
 		self.config = config
 		self.retries = config.get('retries', 1)
 		self.delay = config.get('delay', 3)
+		self.schema = config.get("schema", "public")
+		self.pool = get_pool(config)
 
 	def connect(self):
-		config = self.config
-		conn_string = "host=%s dbname=%s user=%s password=%s" % (
-			config["host"],
-			config["dbname"],
-			config["user"],
-			config["password"])
-		conn = psycopg2.connect(conn_string)
-		conn.autocommit = True
-
-		# Connect to the specified schema
-		schema = config.get("schema", "public")
-		cur = conn.cursor()
-		cur.execute(f"SET search_path TO {schema};")
-
-		return conn
+		# check out a pooled connection with search_path set to the schema
+		return self.pool.getconn(self.schema)
+
+	def release(self, conn, broken=False):
+		self.pool.putconn(conn, broken=broken)
 	
 
 	def exec_sql(self, sql):
@@ -34,15 +29,30 @@ class PostgreSqlDB:
 		delay = self.delay
 		cur = None
 		for i in range(retries):
+			conn = self.connect()
 			try:
-				cur = self.connect().cursor()
+				# client side cursors buffer the whole result on execute,
+				# so the connection can go back to the pool right away
+				cur = conn.cursor()
 				cur.execute(sql)
+				self.release(conn)
 				return cur
 			except psycopg2.errors.SerializationFailure:
+				self.release(conn)
 				if i < retries - 1:
 					time.sleep(delay)  # Wait before retrying
 				else:
 					raise  # Give up after max retries
+			except (psycopg2.OperationalError, psycopg2.InterfaceError):
+				# the connection is dropped from the pool and re-created on the next checkout
+				self.release(conn, broken=True)
+				if i < retries - 1:
+					time.sleep(delay)
+				else:
+					raise
+			except:
+				self.release(conn)
+				raise
 		raise Exception("SQL failed after max tries")
 	
 
@@ -63,8 +73,13 @@ class PostgreSqlDB:
 		return row[0]
 
 	def close(self):
+		# connections are owned by the shared pool
 		if self.conn != None:
-			self.conn.close()
+			self.release(self.conn)
+			self.conn = None
+
+	def pool_stats(self):
+		return self.pool.stats()
 
 	def _create_table_from_template(self, sqlFile, tableName, context={}):
 		try:
@@ -127,6 +142,84 @@ class PostgreSqlDB:
 		return pd.DataFrame(rows)
 	
 	
+	def read_sql_chunks(self, sql, columns=None, dtypes=None, itersize=0):
+		"""
+		Stream the result of sql through a named (server-side) cursor and
+		yield DataFrames of at most itersize rows, so memory is bounded by
+		the chunk size instead of the result size.
+		sql must be a single SELECT statement.
+		"""
+		if itersize <= 0:
+			itersize = int(self.config.get("itersize", 20000))
+		conn = self.connect()
+		broken = False
+		try:
+			# DECLARE CURSOR needs a transaction block
+			conn.autocommit = False
+			cur = conn.cursor(name="read_sql_chunks_%d" % id(conn))
+			cur.itersize = itersize
+			cur.execute(sql)
+			while True:
+				rows = cur.fetchmany(itersize)
+				if len(rows) == 0:
+					break
+				df = pd.DataFrame(rows, columns=columns)
+				if dtypes is not None:
+					df = df.astype(dtypes)
+				yield df
+			cur.close()
+		except (psycopg2.OperationalError, psycopg2.InterfaceError):
+			broken = True
+			raise
+		finally:
+			if not conn.closed:
+				conn.rollback()
+				conn.autocommit = True
+			self.release(conn, broken=broken)
+
+	def copy_upsert(self, tableName, df, columns, pg_types, conflict_cols):
+		"""
+		Stream df[columns] with binary COPY into a temporary staging table and
+		merge it into tableName with one INSERT ... ON CONFLICT statement.
+		Returns the number of rows merged.
+		"""
+		if len(df) == 0:
+			return 0
+		# the last row of a repeated key wins, and no row is touched twice in one statement
+		df = df.drop_duplicates(conflict_cols, keep='last')
+		buf = to_binary_copy(df, columns, pg_types)
+		stage = "%s_stage" % tableName.replace(".", "_")
+		cols = ", ".join(columns)
+		keys = ", ".join(conflict_cols)
+		updates = ", ".join(["%s = EXCLUDED.%s" % (c, c) for c in columns if c not in conflict_cols])
+		if updates == "":
+			on_conflict = "DO NOTHING"
+		else:
+			on_conflict = "DO UPDATE SET %s" % updates
+
+		conn = self.connect()
+		broken = False
+		try:
+			cur = conn.cursor()
+			cur.execute("BEGIN;")
+			cur.execute("CREATE TEMP TABLE %s (LIKE %s) ON COMMIT DROP;" % (stage, tableName))
+			cur.copy_expert("COPY %s (%s) FROM STDIN WITH (FORMAT binary)" % (stage, cols), buf)
+			cur.execute("""INSERT INTO %s (%s)
+	SELECT %s FROM %s
+	ON CONFLICT (%s) %s;""" % (tableName, cols, cols, stage, keys, on_conflict))
+			cnt = cur.rowcount
+			cur.execute("COMMIT;")
+			cur.close()
+		except (psycopg2.OperationalError, psycopg2.InterfaceError):
+			broken = True
+			raise
+		except:
+			conn.cursor().execute("ROLLBACK;")
+			raise
+		finally:
+			self.release(conn, broken=broken)
+		return cnt
+
 	# create schema if not exists
 	def create_schema(self, schema_name):
 		sql = f"CREATE SCHEMA IF NOT EXISTS {schema_name};"
@@ -6,8 +6,9 @@ import utils.config_loader as config_loader
 import utils
 import data_getter
 from data_processing.detector import Detector
-import classifiers.dbscan as dbscan
+import classifiers.incremental as incremental
 from models.models_set import ModelsSet
+import db.pool
 
 STAGE_DETECT1 = 1
 STAGE_DETECT2 = 2
@@ -95,23 +96,28 @@ def run(conf: Dict, endep: int = 0,
         if len(anomaly_itemIds) == 0:
             continue
 
-        if STAGE_DETECT2 in detection_stages:
-            log(f"running detect2 for {data_source_name}")
-            anomaly_itemIds = d.detect2(anomaly_itemIds, endep)
-        if len(anomaly_itemIds) == 0:
-            continue
+        # trends and history frames are fetched once and shared by detect2/3/4
+        d.open_frame_cache(endep, long_trends=STAGE_DETECT4 in detection_stages)
+        try:
+            if STAGE_DETECT2 in detection_stages:
+                log(f"running detect2 for {data_source_name}")
+                anomaly_itemIds = d.detect2(anomaly_itemIds, endep)
+            if len(anomaly_itemIds) == 0:
+                continue
 
-        if STAGE_DETECT3 in detection_stages:
-            log(f"running detect3 for {data_source_name}")
-            anomaly_itemIds = d.detect3(anomaly_itemIds, endep, is_long_trend=False)
-        if len(anomaly_itemIds) == 0:
-            continue
+            if STAGE_DETECT3 in detection_stages:
+                log(f"running detect3 for {data_source_name}")
+                anomaly_itemIds = d.detect3(anomaly_itemIds, endep, is_long_trend=False)
+            if len(anomaly_itemIds) == 0:
+                continue
 
-        if STAGE_DETECT4 in detection_stages:
-            log(f"running detect4 for {data_source_name}")
-            anomaly_itemIds = d.detect3(anomaly_itemIds, endep, is_long_trend=True)
-        if len(anomaly_itemIds) == 0:
-            continue
+            if STAGE_DETECT4 in detection_stages:
+                log(f"running detect4 for {data_source_name}")
+                anomaly_itemIds = d.detect3(anomaly_itemIds, endep, is_long_trend=True)
+            if len(anomaly_itemIds) == 0:
+                continue
+        finally:
+            d.close_frame_cache()
 
         group_map = {}
         if len(anomaly_itemIds) > 0 and len(group_names) > 0:
@@ -121,6 +127,7 @@ def run(conf: Dict, endep: int = 0,
 
         anomalies[data_source_name] = anomaly_itemIds
 
+    log(f"db pool stats: {db.pool.pool_stats()}")
     log("completed")
     return anomalies
 
@@ -140,7 +147,7 @@ def classify_charts(endep: int):
         d.update_history(endep, anom_itemIds)
         if len(anom_itemIds) > 1:
             log("classifying charts")
-            clusters, _, _ = dbscan.classify_charts(conf, data_source_name, anom_itemIds, endep=endep)
+            clusters = incremental.classify_charts_incremental(conf, data_source_name, anom_itemIds, endep=endep)
             ModelsSet(data_source_name).anomalies.update_clusterid(clusters)
     else:
         log("no anomalies")
@@ -2,6 +2,7 @@ import pandas as pd
 from typing import List, Dict
 
 from models.model import Model
+import utils.normalizer as normalizer
 
 class AnomaliesModel(Model):
     sql_template = "anomalies"
@@ -28,7 +29,7 @@ class AnomaliesModel(Model):
         return itemIds
     
 
-    def get_charts(self, itemIds: List[int] = []) -> Dict[int, pd.Series]:
+    def get_charts(self, itemIds: List[int] = []) -> Dict[int, pd.DataFrame]:
         if len(itemIds) == 0:
             itemIds = self.get_itemids()
         sql = f"SELECT itemid, created, hostid, clusterid, group_name, host_name, item_name, trend_mean, trend_std FROM {self.table_name} WHERE itemid in (%s);" % ",".join(map(str, itemIds))
@@ -36,18 +37,9 @@ class AnomaliesModel(Model):
         if df.empty:
             return {}
         
-        charts = {}
-        for _, row in df.iterrows():
-            itemId = row.itemid
-            if itemId not in charts:
-                charts[itemId] = []
-            charts[itemId].append(row)
-        
-        # convert to series
-        for itemId in charts:
-            charts[itemId] = pd.Series(charts[itemId])
-        
-        return charts  
+        # rows of each item as a slice of the frame
+        itemIds, bounds, df = normalizer.group_long_df(df)
+        return {int(itemId): df.iloc[bounds[k]:bounds[k+1]] for k, itemId in enumerate(itemIds)}
 
     def get_last_updated(self) -> float:
         sql = f"SELECT max(created) FROM {self.table_name}"
@@ -79,12 +71,22 @@ class AnomaliesModel(Model):
             self.db.exec_sql(sql)
 
     def update_clusterid(self, clusters: Dict):
-        sql = f"update {self.table_name} set clusterid = -1"
-        self.db.exec_sql(sql)
-
-        for itemId, clusterId in clusters.items():
-            sql = f"update {self.table_name} set clusterid = {clusterId} where itemid = {itemId};"
+        """
+        Sets the clusterid of the items in clusters and -1 of the others with one
+        UPDATE ... FROM (VALUES ...) statement, writing only the rows that change.
+        """
+        if len(clusters) == 0:
+            sql = f"UPDATE {self.table_name} SET clusterid = -1 WHERE clusterid <> -1;"
             self.db.exec_sql(sql)
+            return
+
+        values = ",".join([f"({int(itemId)}, {int(clusterId)})" for itemId, clusterId in clusters.items()])
+        sql = f"""UPDATE {self.table_name} AS t SET clusterid = u.clusterid
+FROM (SELECT a.itemid, COALESCE(v.clusterid, -1) AS clusterid
+    FROM (SELECT DISTINCT itemid FROM {self.table_name}) AS a
+    LEFT JOIN (VALUES {values}) AS v(itemid, clusterid) ON a.itemid = v.itemid) AS u
+WHERE t.itemid = u.itemid AND t.clusterid IS DISTINCT FROM u.clusterid;"""
+        self.db.exec_sql(sql)
 
     def delete_old_entries(self, oldep: int):
         sql = f"delete from {self.table_name} WHERE created < {oldep};"
@@ -0,0 +1,42 @@
+import pandas as pd
+from typing import List
+
+from models.model import Model
+
+class ClustersModel(Model):
+    """ cluster of each classified item, kept between runs for incremental classification.
+    fields:
+        itemid: INT
+        clusterid: INT       -1 for noise
+        representative: INT  1 if new items are compared with this item
+        created: INT         endep of the full classification the cluster comes from
+    """
+    sql_template = "clusters"
+    name = "clusters"
+    fields = ['itemid', 'clusterid', 'representative', 'created']
+    pg_types = {'itemid': 'bigint', 'clusterid': 'integer', 'representative': 'integer', 'created': 'integer'}
+
+    def read_members(self) -> pd.DataFrame:
+        sql = f"SELECT {', '.join(self.fields)} FROM {self.table_name};"
+        df = self.db.read_sql(sql)
+        if df.empty:
+            return pd.DataFrame(columns=self.fields, dtype='int64')
+        df.columns = self.fields
+        return df.astype('int64')
+
+    def upsert_members_df(self, df: pd.DataFrame) -> int:
+        if len(df) == 0:
+            return 0
+        df = df[self.fields].astype('int64')
+        return self.db.copy_upsert(self.table_name, df, self.fields, self.pg_types, ['itemid'])
+
+    def replace_members_df(self, df: pd.DataFrame) -> int:
+        self.truncate()
+        return self.upsert_members_df(df)
+
+    def remove_itemIds_not_in(self, itemIds: List[int]):
+        if len(itemIds) == 0:
+            self.truncate()
+            return
+        sql = f"DELETE FROM {self.table_name} WHERE itemid NOT IN ({','.join(map(str, itemIds))});"
+        self.db.exec_sql(sql)
@@ -8,6 +8,7 @@ class HistoryModel(Model):
     sql_template = "history"
     name = "history"
     fields = ['itemid', 'clock', 'value']
+    pg_types = {'itemid': 'bigint', 'clock': 'integer', 'value': 'float'}
 
     def get_data(self, itemIds: List[int]=[], startep: int = 0, endep: int = 0) -> pd.DataFrame:
         sql = f"SELECT * FROM {self.table_name}"
@@ -38,15 +39,19 @@ class HistoryModel(Model):
 
         self.db.exec_sql(sql)
 
-    # buggy
     def upsert(self, itemids: List[int], clocks: List[int], values: List[float]):
-        # prepare sql
-        sql = f"INSERT INTO {self.table_name} (itemid, clock, value) VALUES "
-        for i in range(len(itemids)):
-            sql += f"({itemids[i]}, {clocks[i]}, {values[i]}),"
-        sql = sql[:-1] + " ON CONFLICT (itemid, clock) DO UPDATE SET value = EXCLUDED.value;"
+        df = pd.DataFrame({'itemid': itemids, 'clock': clocks, 'value': values})
+        self.upsert_df(df)
 
-        self.db.exec_sql(sql)
+    def upsert_df(self, df: pd.DataFrame) -> int:
+        """
+        Bulk upsert of an (itemid, clock, value) frame via binary COPY into a
+        staging table and one INSERT ... ON CONFLICT merge.
+        """
+        if len(df) == 0:
+            return 0
+        df = df[self.fields].astype({'itemid': 'int64', 'clock': 'int64', 'value': 'float64'})
+        return self.db.copy_upsert(self.table_name, df, self.fields, self.pg_types, ['itemid', 'clock'])
         
     def remove_old_data(self, clock: int):
         sql = f"DELETE FROM {self.table_name} WHERE clock < {clock};"
@@ -54,14 +59,9 @@ class HistoryModel(Model):
         
 
     def import_history(self, hist_df: pd.DataFrame, base_clocks: List[int]):
-        itemids = hist_df['itemid'].tolist()
-        
-        for itemid in itemids:
-            idx = hist_df[hist_df['itemid'] == itemid].index
-            clocks = hist_df.loc[idx, 'clock'].tolist()
-            values = hist_df.loc[idx, 'value'].tolist()
-            values = normalizer.fit_to_base_clocks(base_clocks, clocks, values)
-            self.upsert([itemid]*len(base_clocks), base_clocks, values)
+        itemIds, values = normalizer.fit_to_base_clocks_matrix(hist_df, base_clocks)
+        if len(itemIds) > 0:
+            self.upsert_df(normalizer.matrix2df(itemIds, base_clocks, values))
 
     def remove_itemIds_not_in(self, itemIds: List[int]):
         sql = f"DELETE FROM {self.table_name} WHERE itemid NOT IN ({','.join(map(str, itemIds))});"
@@ -78,16 +78,4 @@ class HistoryModel(Model):
         return df
 
     def get_charts(self, itemIds: List[int], startep: int, endep: int) -> Dict[int, pd.Series]:
-        df = self.get_charts_df(itemIds, startep, endep)
-        charts = {}
-        for _, row in df.iterrows():
-            itemId = row.itemid
-            if itemId not in charts:
-                charts[itemId] = []
-            charts[itemId].append(row["value"])
-        
-        # convert to series
-        for itemId in charts:
-            charts[itemId] = pd.Series(charts[itemId])
-        
-        return charts
\ No newline at end of file
+        return normalizer.long2charts(self.get_charts_df(itemIds, startep, endep))
\ No newline at end of file
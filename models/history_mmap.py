@@ -0,0 +1,265 @@
+"""
+HistoryModel backed by a memory-mapped NumPy matrix instead of a PostgreSQL table.
+
+The normalized history is dense: one value per item and history_interval.
+The store keeps it as a float matrix with one row per item and one column per
+time slot, plus an itemid -> row index. The time axis is a ring buffer. Clock c
+is kept in column (c // history_interval) % n_slots, so a new clock overwrites
+the oldest one in its column. Empty cells are NaN.
+
+Enabled per data source with `history_store: mmap`. The files are kept under
+history_store_dir/<schema>/<table>. Clocks must be multiples of
+history_interval, which holds for the base clocks Detector.update_history
+writes.
+"""
+import os
+import json
+import shutil
+import logging
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from models.history import HistoryModel
+
+
+def log(msg, level=logging.INFO):
+    msg = f"[models/history_mmap.py] {msg}"
+    logging.log(level, msg)
+
+
+class MmapHistoryModel(HistoryModel):
+    initial_rows = 1024
+
+    def create_table(self):
+        self.interval = int(self.data_source["history_interval"])
+        n_slots = int(self.data_source.get("history_store_slots", 0))
+        if n_slots <= 0:
+            # enough slots for what update_history keeps
+            n_slots = int(self.data_source["anomaly_keep_secs"]) // self.interval + 2
+        self.n_slots = n_slots
+        store_dir = self.data_source.get("history_store_dir", "")
+        if store_dir == "":
+            store_dir = os.path.join(os.path.expanduser("~"), "anomdec/history")
+        self.path = os.path.join(store_dir, self.schema_name, self.table_name)
+
+        meta = {"interval": self.interval, "n_slots": self.n_slots}
+        if os.path.exists(os.path.join(self.path, "meta.json")):
+            with open(os.path.join(self.path, "meta.json")) as f:
+                if json.load(f) == meta:
+                    self._open()
+                    return
+            log(f"{self.path}: layout changed, recreating", level=logging.WARNING)
+            shutil.rmtree(self.path)
+
+        os.makedirs(self.path, exist_ok=True)
+        self._create_files(self.initial_rows)
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        self._open()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.npy")
+
+    def _create_files(self, n_rows: int):
+        itemids = np.lib.format.open_memmap(self._file("itemids"), mode="w+", dtype=np.int64, shape=(n_rows,))
+        itemids[:] = -1
+        itemids.flush()
+        slot_clocks = np.lib.format.open_memmap(self._file("slot_clocks"), mode="w+", dtype=np.int64, shape=(self.n_slots,))
+        slot_clocks[:] = -1
+        slot_clocks.flush()
+        values = np.lib.format.open_memmap(self._file("values"), mode="w+", dtype=np.float64, shape=(n_rows, self.n_slots))
+        values[:] = np.nan
+        values.flush()
+
+    def _open(self):
+        self.itemids = np.load(self._file("itemids"), mmap_mode="r+")
+        self.slot_clocks = np.load(self._file("slot_clocks"), mmap_mode="r+")
+        self.values = np.load(self._file("values"), mmap_mode="r+")
+        used = np.flatnonzero(self.itemids >= 0)
+        self.rows: Dict[int, int] = dict(zip(self.itemids[used].tolist(), used.tolist()))
+
+    def _flush(self):
+        self.itemids.flush()
+        self.slot_clocks.flush()
+        self.values.flush()
+
+    def _grow(self, n_rows: int):
+        # copy into larger files, the old arrays stay valid until replaced
+        old_itemids = np.array(self.itemids)
+        old_values = np.array(self.values)
+        tmp_path = f"{self.path}.grow"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        itemids = np.lib.format.open_memmap(os.path.join(tmp_path, "itemids.npy"), mode="w+", dtype=np.int64, shape=(n_rows,))
+        itemids[:] = -1
+        itemids[:len(old_itemids)] = old_itemids
+        values = np.lib.format.open_memmap(os.path.join(tmp_path, "values.npy"), mode="w+", dtype=np.float64, shape=(n_rows, self.n_slots))
+        values[:] = np.nan
+        values[:len(old_values)] = old_values
+        itemids.flush()
+        values.flush()
+        del itemids, values
+        self.itemids = None
+        self.values = None
+        os.replace(os.path.join(tmp_path, "itemids.npy"), self._file("itemids"))
+        os.replace(os.path.join(tmp_path, "values.npy"), self._file("values"))
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        self._open()
+
+    def _assign_rows(self, itemIds: np.ndarray) -> np.ndarray:
+        new_itemIds = [itemId for itemId in np.unique(itemIds).tolist() if itemId not in self.rows]
+        if len(new_itemIds) > 0:
+            free = np.flatnonzero(self.itemids < 0)
+            if len(free) < len(new_itemIds):
+                n_rows = len(self.itemids)
+                while n_rows - len(self.rows) < len(new_itemIds):
+                    n_rows *= 2
+                self._grow(n_rows)
+                free = np.flatnonzero(self.itemids < 0)
+            for itemId, row in zip(new_itemIds, free.tolist()):
+                self.itemids[row] = itemId
+                self.rows[itemId] = row
+        return np.array([self.rows[itemId] for itemId in itemIds.tolist()], dtype=np.int64)
+
+    def _clear_slots(self, slots: np.ndarray):
+        if len(slots) == 0:
+            return
+        self.values[:, slots] = np.nan
+        self.slot_clocks[slots] = -1
+
+    def _free_empty_rows(self):
+        used = np.flatnonzero(self.itemids >= 0)
+        empty = used[np.isnan(self.values[used]).all(axis=1)]
+        for row in empty.tolist():
+            del self.rows[int(self.itemids[row])]
+        self.itemids[empty] = -1
+
+    def upsert_df(self, df: pd.DataFrame) -> int:
+        if len(df) == 0:
+            return 0
+        itemIds = df['itemid'].to_numpy(dtype=np.int64)
+        clocks = df['clock'].to_numpy(dtype=np.int64)
+        values = df['value'].to_numpy(dtype=np.float64)
+        if (clocks % self.interval != 0).any():
+            raise ValueError(f"{self.table_name}: clocks must be multiples of history_interval ({self.interval})")
+
+        slots = (clocks // self.interval) % self.n_slots
+        # a newer clock takes over its slot, clocks older than the slot's clock are dropped
+        for clock in np.unique(clocks).tolist():
+            slot = (clock // self.interval) % self.n_slots
+            if int(self.slot_clocks[slot]) < clock:
+                self._clear_slots(np.array([slot]))
+                self.slot_clocks[slot] = clock
+        # rows whose slot went to a newer clock, of this frame or stored, are dropped
+        keep = self.slot_clocks[slots] == clocks
+        rows = self._assign_rows(itemIds[keep])
+        self.values[rows, slots[keep]] = values[keep]
+        self._flush()
+        return int(keep.sum())
+
+    def upsert(self, itemids: List[int], clocks: List[int], values: List[float]):
+        self.upsert_df(pd.DataFrame({'itemid': itemids, 'clock': clocks, 'value': values}))
+
+    def insert(self, itemids: List[int], clocks: List[int], values: List[float]):
+        self.upsert(itemids, clocks, values)
+
+    def get_matrix(self, itemIds: List[int] = [], startep: int = 0, endep: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (itemIds, clocks, values) with values[i, j] the value of itemIds[i] at clocks[j],
+        NaN where there is none. Items are sorted by itemid and clocks in time order.
+        Read straight from the mapped matrix.
+        """
+        if len(itemIds) > 0:
+            selected = np.array(sorted(set(itemIds) & self.rows.keys()), dtype=np.int64)
+        else:
+            selected = np.array(sorted(self.rows.keys()), dtype=np.int64)
+        rows = np.array([self.rows[itemId] for itemId in selected.tolist()], dtype=np.int64)
+
+        slot_clocks = np.asarray(self.slot_clocks)
+        mask = slot_clocks >= 0
+        if startep > 0:
+            mask &= slot_clocks >= startep
+        if endep > 0:
+            mask &= slot_clocks <= endep
+        slots = np.flatnonzero(mask)
+        slots = slots[np.argsort(slot_clocks[slots], kind='stable')]
+        return selected, slot_clocks[slots], self.values[np.ix_(rows, slots)]
+
+    def get_data(self, itemIds: List[int]=[], startep: int = 0, endep: int = 0) -> pd.DataFrame:
+        selected, clocks, values = self.get_matrix(itemIds, startep, endep)
+        filled = ~np.isnan(values)
+        if not filled.any():
+            return pd.DataFrame(columns=self.fields, dtype=object)
+        item_pos, clock_pos = np.nonzero(filled)
+        return pd.DataFrame({
+            'itemid': selected[item_pos],
+            'clock': clocks[clock_pos],
+            'value': values[item_pos, clock_pos],
+        })
+
+    def get_charts(self, itemIds: List[int], startep: int, endep: int) -> Dict[int, pd.Series]:
+        # rows of the mapped matrix without a long (itemid, clock, value) frame,
+        # a view of the row when the item has every clock
+        selected, _, values = self.get_matrix(list(set(itemIds)), startep, endep)
+        filled = ~np.isnan(values)
+        charts = {}
+        for k, itemId in enumerate(selected.tolist()):
+            if filled[k].all():
+                charts[itemId] = pd.Series(values[k], copy=False)
+            elif filled[k].any():
+                charts[itemId] = pd.Series(values[k, filled[k]])
+        return charts
+
+    def get_charts_df(self, itemIds: List[int], startep: int, endep: int) -> pd.DataFrame:
+        df = self.get_data(list(set(itemIds)), startep, endep)
+        if df.empty:
+            return {}
+        return df
+
+    def remove_old_data(self, clock: int):
+        slots = np.flatnonzero((self.slot_clocks >= 0) & (self.slot_clocks < clock))
+        self._clear_slots(slots)
+        self._free_empty_rows()
+        self._flush()
+
+    def remove_itemIds_not_in(self, itemIds: List[int]):
+        keep = set(itemIds)
+        for itemId, row in list(self.rows.items()):
+            if itemId not in keep:
+                self.values[row] = np.nan
+                self.itemids[row] = -1
+                del self.rows[itemId]
+        self._flush()
+
+    def separate_existing_itemIds(self, itemIds: List[int]) -> Tuple[List[int],List[int]]:
+        if len(itemIds) == 0:
+            return list(self.rows.keys()), []
+        existing = [itemId for itemId in itemIds if itemId in self.rows]
+        nonexisting = [itemId for itemId in itemIds if itemId not in self.rows]
+        return existing, nonexisting
+
+    def count(self) -> int:
+        rows = np.array(list(self.rows.values()), dtype=np.int64)
+        return int((~np.isnan(self.values[rows])).sum())
+
+    def truncate(self):
+        self.values[:] = np.nan
+        self.itemids[:] = -1
+        self.slot_clocks[:] = -1
+        self.rows = {}
+        self._flush()
+
+    def drop(self):
+        self.itemids = None
+        self.slot_clocks = None
+        self.values = None
+        self.rows = {}
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def check_conn(self) -> bool:
+        ok = os.path.exists(os.path.join(self.path, "meta.json"))
+        if ok == False:
+            print(f"history store {self.path} does not exist")
+        return ok
@@ -0,0 +1,71 @@
+import time
+import pandas as pd
+from typing import List, Dict
+
+from models.model import Model
+
+class HistoryStatsBucketsModel(Model):
+    """ per item count, mean and m2 of one history_interval bucket, kept in a ring buffer.
+    fields:
+        itemid: INT
+        slot: INT     (bucket // history_interval) % n_slots
+        bucket: INT   start clock of the bucket
+        cnt: INT
+        mean: FLOAT
+        m2: FLOAT     sum of squared differences from mean
+    A new bucket overwrites the expired one in its slot, so old data is
+    dropped without a DELETE.
+    """
+    sql_template = "stats_buckets"
+    name = "history_stats_buckets"
+    fields = ['itemid', 'slot', 'bucket', 'cnt', 'mean', 'm2']
+    pg_types = {'itemid': 'bigint', 'slot': 'integer', 'bucket': 'integer', 
+                'cnt': 'integer', 'mean': 'float', 'm2': 'float'}
+
+    def __init__(self, data_source_name=""):
+        super().__init__(data_source_name)
+        self.interval = int(self.data_source["history_interval"])
+        # the window plus the bucket being filled and the one being expired
+        self.n_slots = int(self.data_source["history_retention"]) + 2
+
+    def align(self, clock: int) -> int:
+        return int(clock) // self.interval * self.interval
+
+    def upsert_buckets_df(self, df: pd.DataFrame) -> Dict[str, float]:
+        """
+        Bulk upsert of an (itemid, bucket, cnt, mean, m2) frame.
+        Returns the number of rows written and the elapsed seconds.
+        """
+        start = time.time()
+        if len(df) == 0:
+            return {'rows': 0, 'secs': 0.0}
+        df = df.astype({'itemid': 'int64', 'bucket': 'int64', 'cnt': 'int64', 
+                        'mean': 'float64', 'm2': 'float64'})
+        df = df.assign(slot=df['bucket'] // self.interval % self.n_slots)[self.fields]
+        rows = self.db.copy_upsert(self.table_name, df, self.fields, self.pg_types, ['itemid', 'slot'])
+        return {'rows': rows, 'secs': time.time() - start}
+
+    def read_window_moments(self, itemIds: List[int], startep: int, endep: int) -> pd.DataFrame:
+        """
+        cnt, mean and m2 per itemid over the buckets starting in [startep, endep].
+        The buckets are combined with the pairwise update of Chan et al. written as a sum:
+        m2 = sum(m2_i) + sum(cnt_i * (mean_i - mean)^2)
+        """
+        where = f"bucket >= {int(startep)} AND bucket <= {int(endep)} AND cnt > 0"
+        if len(itemIds) > 0:
+            where += f" AND itemid IN ({','.join(map(str, itemIds))})"
+        sql = f"""WITH b AS (SELECT itemid, cnt, mean, m2 FROM {self.table_name} WHERE {where}),
+    t AS (SELECT itemid, SUM(cnt) AS cnt, SUM(cnt * mean) / SUM(cnt) AS mean FROM b GROUP BY itemid)
+SELECT t.itemid, t.cnt, t.mean, SUM(b.m2 + b.cnt * (b.mean - t.mean) * (b.mean - t.mean))
+FROM b JOIN t ON b.itemid = t.itemid
+GROUP BY t.itemid, t.cnt, t.mean;"""
+        df = self.db.read_sql(sql)
+        fields = ['itemid', 'cnt', 'mean', 'm2']
+        if len(df) == 0:
+            return pd.DataFrame(columns=fields, dtype=object)
+        df.columns = fields
+        return df.astype({'itemid': 'int64', 'cnt': 'int64', 'mean': 'float64', 'm2': 'float64'})
+
+    def remove_itemIds_not_in(self, itemIds: List[int]):
+        sql = f"DELETE FROM {self.table_name} WHERE itemid NOT IN ({','.join(map(str, itemIds))});"
+        self.db.exec_sql(sql)
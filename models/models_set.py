@@ -1,10 +1,13 @@
 from models.history import HistoryModel
+from models.history_mmap import MmapHistoryModel
 from models.history_stats import HistoryStatsModel
+from models.history_stats_buckets import HistoryStatsBucketsModel
 from models.history_updates import HistoryUpdatesModel
 from models.trends_stats import TrendsStatsModel
 from models.trends_updates import TrendsUpdatesModel
 from models.anomalies import AnomaliesModel
 from models.topitems import TopItemsModel
+from models.clusters import ClustersModel
 from db.postgresql import PostgreSqlDB
 import utils.config_loader as config_loader
 
@@ -23,22 +26,30 @@ class ModelsSet:
 
     
     def load_models(self):
-        self.history = HistoryModel(self.data_source_name)
+        data_source = config_loader.conf.get("data_sources", {}).get(self.data_source_name, config_loader.conf)
+        if data_source.get("history_store", "pgsql") == "mmap":
+            self.history = MmapHistoryModel(self.data_source_name)
+        else:
+            self.history = HistoryModel(self.data_source_name)
         self.history_updates = HistoryUpdatesModel(self.data_source_name)
         self.history_stats = HistoryStatsModel(self.data_source_name)
+        self.history_stats_buckets = HistoryStatsBucketsModel(self.data_source_name)
         self.trends_stats = TrendsStatsModel(self.data_source_name)
         self.trends_updates = TrendsUpdatesModel(self.data_source_name)
         self.anomalies = AnomaliesModel(self.data_source_name)
         self.topitems = TopItemsModel(self.data_source_name)
+        self.clusters = ClustersModel(self.data_source_name)
         
         self.models = [
             self.history,
             self.history_updates,
             self.history_stats,
+            self.history_stats_buckets,
             self.trends_stats,
             self.trends_updates,
             self.anomalies,
-            self.topitems
+            self.topitems,
+            self.clusters
         ]
         
 
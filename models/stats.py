@@ -1,5 +1,7 @@
+import time
+import numpy as np
 import pandas as pd
-from typing import List
+from typing import List, Dict
 
 from models.model import Model
 
@@ -11,26 +13,58 @@ class StatsModel(Model):
         end: INT
         mean: FLOAT
         std: FLOAT
+        m2: FLOAT   sum of squared differences from mean, merged with Chan's algorithm
     """
     sql_template = "stats"
     name = sql_template
-    fields = ['itemid', 'sum', 'sqr_sum', 'cnt', 'mean', 'std']
+    fields = ['itemid', 'sum', 'sqr_sum', 'cnt', 'mean', 'std', 'm2']
+    pg_types = {'itemid': 'bigint', 'sum': 'float', 'sqr_sum': 'float', 'cnt': 'integer', 
+                'mean': 'float', 'std': 'float', 'm2': 'float'}
+
+    def create_table(self):
+        super().create_table()
+        # tables created before m2 was added: derive it from std
+        if self.db.select1value("information_schema.columns", "count(*)", 
+                                [f"table_schema = '{self.schema_name}'", 
+                                 f"table_name = '{self.table_name.lower()}'", 
+                                 "column_name = 'm2'"]) == 0:
+            self.db.exec_sql(f"ALTER TABLE {self.table_name} ADD COLUMN m2 FLOAT;")
+            self.db.exec_sql(f"UPDATE {self.table_name} SET m2 = std * std * GREATEST(cnt - 1, 0);")
 
 
     
     def upsert_stats(self, itemid: int, sum: float, sqr_sum: float, cnt: int, 
-                     mean: float, std: float):
+                     mean: float, std: float, m2: float = None):
+        if m2 is None:
+            m2 = std * std * max(cnt - 1, 0)
         # prepare sql
-        sql = f"INSERT INTO {self.table_name} (itemid, sum, sqr_sum, cnt, mean, std) VALUES "
-        sql += f"({itemid}, {sum}, {sqr_sum}, {cnt}, {mean}, {std}) "
+        sql = f"INSERT INTO {self.table_name} (itemid, sum, sqr_sum, cnt, mean, std, m2) VALUES "
+        sql += f"({itemid}, {sum}, {sqr_sum}, {cnt}, {mean}, {std}, {m2}) "
         sql += " ON CONFLICT (itemid) DO UPDATE SET "
         sql += "sum = EXCLUDED.sum, sqr_sum = EXCLUDED.sqr_sum, cnt = EXCLUDED.cnt, "
         sql += "mean = EXCLUDED.mean, "
-        sql += "std = EXCLUDED.std;"
+        sql += "std = EXCLUDED.std, "
+        sql += "m2 = EXCLUDED.m2;"
         sql = sql[:-1] + ";"
 
         self.db.exec_sql(sql)
         
+    def upsert_stats_df(self, stats: pd.DataFrame) -> Dict[str, float]:
+        """
+        Bulk upsert of a stats frame with the columns in fields
+        via binary COPY and one merge statement.
+        Returns the number of rows written and the elapsed seconds.
+        """
+        start = time.time()
+        if len(stats) == 0:
+            return {'rows': 0, 'secs': 0.0}
+        if 'm2' not in stats.columns:
+            stats = stats.assign(m2=np.square(stats['std']) * (stats['cnt'] - 1).clip(lower=0))
+        df = stats[self.fields].astype({'itemid': 'int64', 'sum': 'float64', 'sqr_sum': 'float64', 
+                                        'cnt': 'int64', 'mean': 'float64', 'std': 'float64', 'm2': 'float64'})
+        rows = self.db.copy_upsert(self.table_name, df, self.fields, self.pg_types, ['itemid'])
+        return {'rows': rows, 'secs': time.time() - start}
+        
     def read_stats(self, itemids: List[int] = []) -> pd.DataFrame:
         sql = f"SELECT * FROM {self.table_name}"
         where = []
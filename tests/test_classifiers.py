@@ -0,0 +1,104 @@
+import __init__
+import unittest
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from classifiers import jaccard_distance, correlation_distance, compute_anomaly_indicators, \
+    compute_jaccard_distance_matrix, compute_correlation_distance_matrix
+import classifiers.dbscan as dbscan
+
+class TestClassifiers(unittest.TestCase):
+    def test_jaccard_distance_matrix(self):
+        rng = np.random.default_rng(0)
+        charts = {}
+        charts_stats = {}
+        # NaN values are points of the series that are not anomalous
+        values = rng.normal(0, 1, 60)
+        values[rng.random(60) < 0.2] += 5
+        values[rng.random(60) < 0.3] = np.nan
+        charts[99] = pd.Series(values)
+        charts_stats[99] = {'mean': 0.0, 'std': 1.0}
+        for itemid in range(100, 140):
+            # series of different lengths with sparse spikes, some with zero std or no anomaly
+            values = rng.normal(0, 1, rng.integers(20, 60))
+            values[rng.random(len(values)) < 0.1] += 5
+            charts[itemid] = pd.Series(values)
+            charts_stats[itemid] = {'mean': 0.0, 'std': 0.0 if itemid % 13 == 0 else 1.0}
+        charts[140] = pd.Series(np.zeros(30))
+        charts_stats[140] = {'mean': 0.0, 'std': 1.0}
+
+        dist = compute_jaccard_distance_matrix(charts, charts_stats, sigma=2.0)
+
+        itemids = list(charts.keys())
+        indicators = compute_anomaly_indicators(charts, charts_stats, z_thresh=2.0)
+        expected = np.zeros((len(itemids), len(itemids)))
+        for i, j in combinations(range(len(itemids)), 2):
+            expected[i, j] = expected[j, i] = jaccard_distance(indicators[itemids[i]], indicators[itemids[j]])
+        self.assertEqual(list(dist.index), itemids)
+        np.testing.assert_array_equal(dist.to_numpy(), expected)
+
+    def _pairwise_correlation_distance(self, charts, diff_contribute_rate):
+        itemids = list(charts.keys())
+        expected = np.zeros((len(itemids), len(itemids)))
+        for i, j in combinations(range(len(itemids)), 2):
+            s_i, s_j = charts[itemids[i]], charts[itemids[j]]
+            d_shape = correlation_distance(s_i, s_j)
+            d_shape_diff = correlation_distance(s_i.diff().dropna(), s_j.diff().dropna())
+            expected[i, j] = expected[j, i] = d_shape_diff * diff_contribute_rate + d_shape * (1 - diff_contribute_rate)
+        return expected
+
+    def test_correlation_distance_matrix(self):
+        rng = np.random.default_rng(0)
+        base = rng.normal(0, 1, 60).cumsum()
+        for same_length in [True, False]:
+            charts = {}
+            for itemid in range(100, 130):
+                length = 60 if same_length else int(rng.integers(1, 60))
+                charts[itemid] = pd.Series(base[:length] * rng.uniform(-3, 3) + rng.normal(0, 0.5, length) + 100)
+            # constant, constant steps, and a series with gaps
+            charts[130] = pd.Series(np.full(60, 3.0))
+            charts[131] = pd.Series(np.arange(60, dtype=float))
+            gaps = rng.normal(0, 1, 60)
+            gaps[::7] = np.nan
+            charts[132] = pd.Series(gaps)
+
+            dist = compute_correlation_distance_matrix(charts, diff_contribute_rate=0.5)
+            expected = self._pairwise_correlation_distance(charts, 0.5)
+            self.assertEqual(list(dist.index), list(charts.keys()))
+            np.testing.assert_allclose(dist.to_numpy(), expected, rtol=1e-9, atol=1e-9)
+
+    def test_sparse_dbscan(self):
+        # groups of charts sharing a pattern, plus noise charts
+        rng = np.random.default_rng(1)
+        charts = {}
+        chart_stats = {}
+        patterns = [rng.normal(0, 1, 120).cumsum() for _ in range(5)]
+        spikes = [rng.choice(120, 6, replace=False) for _ in range(5)]
+        for itemid in range(300):
+            group = itemid % 6
+            length = 120 if itemid % 4 else int(rng.integers(100, 120))
+            if group < 5:
+                values = patterns[group][:length] * rng.uniform(0.5, 2) + rng.normal(0, 0.05, length)
+                values[spikes[group][spikes[group] < length]] += 50
+            else:
+                values = rng.normal(0, 1, length).cumsum()
+            charts[itemid] = pd.Series(values)
+            chart_stats[itemid] = {'mean': float(np.mean(values)), 'std': float(np.std(values))}
+
+        for sigma, eps in [(2.0, 0.1), (1.0, 0.3)]:
+            dense = dbscan._run_jaccard_dbscan(sigma, eps, 2, charts, chart_stats)
+            blocked = dbscan._run_jaccard_dbscan(sigma, eps, 2, charts, chart_stats,
+                                                 sparse_min_charts=1, sparse_block_size=37)
+            np.testing.assert_array_equal(dense.labels_, blocked.labels_)
+        for eps in [0.05, 0.2]:
+            dense = dbscan._run_correlation_dbscan(eps, 2, charts)
+            blocked = dbscan._run_correlation_dbscan(eps, 2, charts, 
+                                                     sparse_min_charts=1, sparse_block_size=37)
+            np.testing.assert_array_equal(dense.labels_, blocked.labels_)
+            self.assertGreater(len(set(dense.labels_)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import __init__
+import unittest
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data_getter.concurrent_fetch import merge_sorted, read_concurrently, read_merged, FetchWorkers
+
+class TestConcurrentFetch(unittest.TestCase):
+    def _sorted_frame(self, rng, itemIds, n):
+        df = pd.DataFrame({
+            'itemid': rng.choice(itemIds, n),
+            'clock': rng.integers(1739000000, 1739500000, n),
+            'value': rng.random(n),
+        })
+        return df.sort_values(['itemid', 'clock'], ignore_index=True)
+
+    def test_merge_sorted(self):
+        rng = np.random.default_rng(0)
+        frames = [
+            self._sorted_frame(rng, [10**12 + 1, 5, 7], 200),
+            self._sorted_frame(rng, [3, 5, 99], 150),
+            self._sorted_frame(rng, [7], 50),
+            pd.DataFrame(columns=['itemid', 'clock', 'value']),
+        ]
+        merged = merge_sorted(frames)
+        expected = pd.concat(frames[:3], ignore_index=True).sort_values(['itemid', 'clock'], 
+                                                                        kind='stable', ignore_index=True)
+        pd.testing.assert_frame_equal(merged, expected)
+
+        self.assertIsNone(merge_sorted([]))
+        pd.testing.assert_frame_equal(merge_sorted(frames[1:2]), frames[1])
+
+    def test_read_merged(self):
+        tables = {
+            'history': pd.DataFrame([(1, 100, 1.0), (2, 50, 2.0)]),
+            'history_uint': pd.DataFrame([(1, 90, 3), (3, 10, 4)]),
+            'empty': pd.DataFrame(),
+        }
+        def read(sql):
+            return tables[sql].copy()
+
+        # both queries must be running at the same time to pass the barrier
+        barrier = threading.Barrier(2, timeout=10)
+        def read_together(sql):
+            barrier.wait()
+            return read(sql)
+        self.assertEqual([len(df) for df in read_concurrently(read_together, ['history', 'history_uint'])], [2, 2])
+
+        self.assertEqual([len(df) for df in read_concurrently(read, ['history', 'empty'])], [2, 0])
+
+        df = read_merged(read, ['history', 'history_uint', 'empty'], ['itemid', 'clock', 'value'], 
+                         {'itemid': 'int64', 'clock': 'int64', 'value': 'float64'})
+        self.assertEqual(df['itemid'].tolist(), [1, 1, 2, 3])
+        self.assertEqual(df['clock'].tolist(), [90, 100, 50, 10])
+        self.assertEqual(df['value'].dtype, np.float64)
+
+        df = read_merged(read, ['empty'], ['itemid', 'clock', 'value'], {})
+        self.assertEqual(list(df.columns), ['itemid', 'clock', 'value'])
+        self.assertEqual(len(df), 0)
+
+    def test_fetch_workers(self):
+        tables = {
+            'history': pd.DataFrame([(1, 100, 1.0), (2, 50, 2.0)]),
+            'history_uint': pd.DataFrame([(1, 90, 3), (3, 10, 4)]),
+        }
+        opened, closed = [], []
+        def open_conn():
+            opened.append(len(opened))
+            return opened[-1]
+        workers = FetchWorkers("test-fetch", 2, open_conn=open_conn, close_conn=closed.append)
+
+        in_use = set()
+        lock = threading.Lock()
+        def read(sql, conn):
+            # a connection is never shared by two reads at once
+            with lock:
+                self.assertNotIn(conn, in_use)
+                in_use.add(conn)
+            df = tables[sql].copy()
+            with lock:
+                in_use.remove(conn)
+            return df
+
+        # the connections are opened once and reused across batches
+        for _ in range(20):
+            df = read_merged(read, ['history', 'history_uint'], ['itemid', 'clock', 'value'],
+                             {'itemid': 'int64', 'clock': 'int64', 'value': 'float64'}, workers=workers)
+            self.assertEqual(df['itemid'].tolist(), [1, 1, 2, 3])
+        self.assertLessEqual(len(opened), 2)
+
+        workers.close()
+        self.assertEqual(sorted(closed), sorted(opened))
+        self.assertIsNone(workers._executor)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,12 @@
 """
 unit tests for sample_getter.py
 """
-import unittest, os
+import unittest, os, shutil
+import multiprocessing
 import tests.testlib as testlib
 
 import __init__
+import pandas as pd
 
 from data_getter.csv_getter import CsvGetter
 
@@ -56,6 +58,14 @@ class TestCsvGetter(unittest.TestCase):
         self.assertLessEqual(item_59888['clock'].max(), endep)
         self.assertGreater(len(item_59888), 0)
 
+        # aggregated sums match the raw data
+        sums = csv_getter.get_history_sums(history_startep, endep, itemIds)
+        self.assertEqual(len(sums), 18)
+        row = sums[sums['itemid'] == 59888].iloc[0]
+        self.assertAlmostEqual(row['sum'], item_59888['value'].sum())
+        self.assertAlmostEqual(row['sqr_sum'], (item_59888['value'] ** 2).sum())
+        self.assertEqual(row['cnt'], len(item_59888))
+
         # classify itemIds by groups
         group_names = ['app/iim', 'app/sim', 'app/cal', 'app/bcs', 'hw/nw', 'hw/pc']
         groups = csv_getter.classify_by_groups(itemIds, group_names)
@@ -67,6 +77,66 @@ class TestCsvGetter(unittest.TestCase):
         self.assertEqual(len(groups['hw/nw']), 3)
         self.assertEqual(len(groups['hw/pc']), 5)
 
-        
+
+    def test_csv_iter_data(self):
+        # the DataGetter fallback returns the whole result as one chunk
+        testlib.load_test_conf()
+        csv_getter = CsvGetter({'type': 'csv', 'data_dir': 'testdata/csv/20250214_1100'})
+        endep = 1739505557
+        itemIds = [59888, 93281]
+        chunks = list(csv_getter.iter_history_data(endep - 3600, endep, itemIds, itersize=10))
+        self.assertEqual(len(chunks), 1)
+        pd.testing.assert_frame_equal(chunks[0], csv_getter.get_history_data(endep - 3600, endep, itemIds))
+        chunks = list(csv_getter.iter_trends_full_data(endep - 86400, endep, itemIds, itersize=10))
+        self.assertEqual(len(chunks), 1)
+        pd.testing.assert_frame_equal(chunks[0], csv_getter.get_trends_full_data(endep - 86400, endep, itemIds))
+        self.assertEqual(list(csv_getter.iter_history_data(0, 1, itemIds)), [])
+
+    def test_csv_cache(self):
+        testlib.load_test_conf()
+        testdir = testlib.setup_testdir("csv_cache")
+        data_dir = os.path.join(testdir, "data")
+        shutil.copytree('testdata/csv/20250214_1100', data_dir)
+        cached = CsvGetter({'type': 'csv', 'data_dir': data_dir, 
+                            'csv_cache_dir': os.path.join(testdir, "cache")})
+        direct = CsvGetter({'type': 'csv', 'data_dir': data_dir, 'csv_cache': False})
+
+        endep = 1739505557
+        for startep, itemIds in [(endep - 3600 * 3, [59888, 93281, 1]), 
+                                 (endep - 3600 * 12, []), 
+                                 (endep - 600, [270797])]:
+            expected = direct.get_history_data(startep, endep, itemIds).reset_index(drop=True)
+            pd.testing.assert_frame_equal(expected, cached.get_history_data(startep, endep, itemIds))
+            expected = direct.get_trends_full_data(startep - 86400 * 7, endep, itemIds).reset_index(drop=True)
+            pd.testing.assert_frame_equal(expected, cached.get_trends_full_data(startep - 86400 * 7, endep, itemIds))
+        self.assertTrue(cached.get_history_data(endep, endep - 1, []).empty)
+        self.assertTrue(cached.get_history_data(0, endep, [1]).empty)
+
+        # the cache is rebuilt when the file changes
+        history_path = os.path.join(data_dir, CsvGetter.history_filename)
+        df = pd.read_csv(history_path)
+        df[df['itemid'] == 59888].to_csv(history_path, index=False, compression='gzip')
+        self.assertEqual(cached.get_history_data(0, endep * 2)['itemid'].unique().tolist(), [59888])
+        pd.testing.assert_frame_equal(direct.get_history_data(0, endep * 2).reset_index(drop=True), 
+                                      cached.get_history_data(0, endep * 2))
+
+    def test_csv_cache_concurrent_build(self):
+        # forked pool workers build the same cache at once
+        testlib.load_test_conf()
+        testdir = testlib.setup_testdir("csv_cache_concurrent")
+        config = {'type': 'csv', 'data_dir': 'testdata/csv/20250214_1100', 
+                  'csv_cache_dir': os.path.join(testdir, "cache")}
+        endep = 1739505557
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(4) as pool:
+            counts = pool.starmap(_read_history_count, [(config, endep)] * 8)
+        expected = len(CsvGetter(dict(config, csv_cache=False)).get_history_data(endep - 3600, endep, []))
+        self.assertEqual(counts, [expected] * 8)
+
+
+def _read_history_count(config, endep):
+    return len(CsvGetter(config).get_history_data(endep - 3600, endep, []))
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
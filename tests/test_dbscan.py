@@ -1,9 +1,15 @@
 import unittest
 
 import __init__
+import numpy as np
+import pandas as pd
 import utils.config_loader as config_loader
 import tests.testlib as testlib
 import classifiers.dbscan as dbscan
+import data_getter
+import utils.normalizer as normalizer
+from models.models_set import ModelsSet
+from models.history_mmap import MmapHistoryModel
 
 class TestDbscan(unittest.TestCase):
     
@@ -42,7 +48,49 @@ class TestDbscan(unittest.TestCase):
         count = sum(1 for cluster in clusters.values() if cluster == 2)
         self.assertEqual(count, 2)
 
-    
+    def test_load_charts_mmap(self):
+        testlib.load_test_conf()
+        endep = 1739505598 
+        conf = config_loader.conf
+        conf["data_sources"] = {
+            "csv_datasource": {
+                "type": "csv",
+                "data_dir": "testdata/csv/20250214_1100"
+            },
+            "csv_datasource_mmap": {
+                "type": "csv",
+                "data_dir": "testdata/csv/20250214_1100",
+                "history_store": "mmap",
+                "history_store_dir": testlib.setup_testdir("dbscan_mmap"),
+            },
+        }
+        config_loader.cascade_config("data_sources")
+        itemIds = [59888, 93281, 94003, 110309, 141917, 217822, 236160, 217825, 270793, 270797, 217823]
+        testlib.import_test_data(conf, itemIds, endep)
+        self.assertIsInstance(ModelsSet("csv_datasource_mmap").history, MmapHistoryModel)
+
+        # the charts of the long frames of the history and the trends
+        data_source = conf["data_sources"]["csv_datasource"]
+        startep = endep - data_source["anomaly_keep_secs"]
+        trends_startep = endep - data_source["trends_interval"] * data_source["trends_retention"]
+        hist_df = ModelsSet("csv_datasource").history.get_charts_df(itemIds, startep, endep)
+        trends_df = data_getter.get_data_getter(data_source).get_trends_data(trends_startep, startep - 1, itemIds)
+        df = pd.concat([trends_df, hist_df], ignore_index=True).sort_values(by=['itemid', 'clock'])
+        expected = normalizer.long2charts(df)
+
+        for name in ["csv_datasource", "csv_datasource_mmap"]:
+            _, hist_charts, charts = dbscan.load_charts(conf, name, itemIds, endep)
+            self.assertGreater(len(hist_charts), 0)
+            self.assertEqual(list(charts.keys()), list(expected.keys()))
+            for itemId, series in expected.items():
+                np.testing.assert_allclose(charts[itemId].to_numpy(), series.to_numpy())
+            self.assertEqual(sorted(hist_charts.keys()), sorted(hist_df['itemid'].unique().tolist()))
+
+        clusters, _, _ = dbscan.classify_charts(conf, "csv_datasource", itemIds=itemIds, endep=endep)
+        mmap_clusters, _, _ = dbscan.classify_charts(conf, "csv_datasource_mmap", itemIds=itemIds, endep=endep)
+        self.assertEqual(mmap_clusters, clusters)
+
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,4 +1,5 @@
 import unittest
+import pandas as pd
 
 import __init__
 from models.models_set import ModelsSet
@@ -62,6 +63,38 @@ class TestDetector(unittest.TestCase):
         self.assertIsNotNone(anomaly_itemIds)
         self.assertGreater(len(anomaly_itemIds), 0)
 
+        # the same batches on a process pool give the same result
+        data_source['workers'] = 2
+        data_source['batch_size'] = 3
+        d = Detector(name, data_source, itemIds)
+        parallel_itemIds = d.detect1()
+        data_source['workers'] = 1
+        d = Detector(name, data_source, itemIds)
+        self.assertEqual(parallel_itemIds, d.detect1())
+
+        # frames served from the frame cache are the same as direct reads
+        d.update_history(endep)
+        t_start = endep - d.trends_interval * d.trends_retention
+        h_start = endep - d.history_interval * d.history_retention
+        trends_df, history_df = d._get_df(itemIds, t_start=t_start, h_start=h_start, h_end=endep)
+        d.open_frame_cache(endep)
+        d._get_df(itemIds[:4], t_start=t_start, h_start=h_start, h_end=endep)
+        cached_trends_df, cached_history_df = d._get_df(itemIds, t_start=t_start, h_start=h_start, h_end=endep)
+        self.assertEqual(d.trends_cache.stats()['fetches'], 2)
+        d.close_frame_cache()
+        pd.testing.assert_frame_equal(trends_df.reset_index(drop=True), cached_trends_df)
+        pd.testing.assert_frame_equal(history_df.reset_index(drop=True), cached_history_df)
+
+        # prefetching the next batch gives the same result as fetching in turn
+        results = []
+        for prefetch_depth in [0, 2]:
+            data_source['prefetch_depth'] = prefetch_depth
+            d = Detector(name, data_source, itemIds)
+            d.open_frame_cache(endep)
+            results.append((d.detect2(itemIds, endep), d.detect3(itemIds, endep)))
+            d.close_frame_cache()
+        self.assertEqual(results[0], results[1])
+
 
 
 if __name__ == '__main__':
@@ -0,0 +1,251 @@
+"""
+The vectorized Detector helpers give the same results as the per item loops they replaced.
+"""
+import unittest
+
+import __init__
+import numpy as np
+import pandas as pd
+from data_getter.data_getter import DataGetter
+import tests.testlib as testlib
+
+
+def calc_local_peak_loop(itemIds, df, window, is_up=True):
+    # the per item loop _calc_local_peak replaced
+    new_df = []
+    for itemId in itemIds:
+        df_item = df[df['itemid'] == itemId]
+        if df_item.empty:
+            continue
+        epoch = df_item.iloc[-1]['clock']
+        startep = df_item.iloc[0]['clock']
+        window_half = window // 2
+        peak_val = -float('inf') if is_up else float('inf')
+        peak_epoch = 0
+        while epoch >= startep:
+            val = df_item[(df_item['clock'] <= epoch) & (df_item['clock'] > epoch - window)]['value'].mean()
+            if is_up:
+                peak_val = max(peak_val, val)
+            else:
+                peak_val = min(peak_val, val)
+            peak_epoch = epoch
+            epoch -= window_half
+        new_df.append({'itemid': itemId, 'local_peak': peak_val, 'peak_clock': peak_epoch})
+    return pd.DataFrame(new_df)
+
+
+def filter_anomalies_loop(df, stats_df, lambda_threshold, is_up=True):
+    # the per item loop _filter_anomalies replaced
+    frames = []
+    for row in stats_df.itertuples():
+        if is_up:
+            df_part = df[(df['itemid'] == row.itemid) & (df['value'] > row.mean + lambda_threshold * row.std)]
+        else:
+            df_part = df[(df['itemid'] == row.itemid) & (df['value'] < row.mean - lambda_threshold * row.std)]
+        if not df_part.empty:
+            frames.append(df_part)
+    if len(frames) == 0:
+        return pd.DataFrame(columns=['itemid', 'clock', 'value'])
+    return pd.concat(frames)
+
+
+def trends_diff_stats_loop(itemIds, trends_df, column):
+    # the per item loop _get_trends_diff_stats replaced
+    frames = []
+    for itemId in itemIds:
+        df = trends_df[trends_df['itemid'] == itemId][['itemid', 'clock', column]].copy()
+        df['diff'] = df[column].diff().fillna(0)
+        df = df[df['diff'] != 0]
+        if not df.empty:
+            frames.append(df)
+    if len(frames) == 0:
+        return pd.DataFrame(columns=['itemid', 'mean', 'std'])
+    return pd.concat(frames).groupby('itemid')['diff'].agg(['mean', 'std']).reset_index()
+
+
+def filter_by_conds_loop(d, itemIds, h_stats_df):
+    # the per item loop _filter_by_conds replaced
+    itemIds = list(itemIds)
+    h_stats_df = h_stats_df.copy()
+    h_stats_df['diff'] = abs(h_stats_df['mean_h'] - h_stats_df['mean_t'])
+    for conds, column in [(d.item_conds, 'mean_h'), (d.item_diff_conds, 'diff')]:
+        for cond in conds:
+            for itemId in d.dg.check_itemId_cond(itemIds, cond['filter']):
+                value = h_stats_df[h_stats_df['itemid'] == itemId].iloc[0][column]
+                if d._evaluate_cond(value, cond) == False:
+                    itemIds.remove(itemId)
+    return itemIds
+
+
+class ItemsGetter(DataGetter):
+    # evaluates filters against an items frame, like the logan getter
+    def init_data_source(self, data_source_config):
+        self.items = data_source_config['items']
+        self.calls = 0
+
+    def check_itemId_cond(self, itemIds, item_cond):
+        self.calls += 1
+        items = self.items[self.items['itemid'].isin(itemIds)]
+        if item_cond == "":
+            return list(itemIds)
+        return items.query(item_cond)['itemid'].tolist()
+
+
+class TestDetectorVectorized(unittest.TestCase):
+    def assert_same_peaks(self, expected, actual):
+        expected = expected.sort_values('itemid').reset_index(drop=True)
+        actual = actual.sort_values('itemid').reset_index(drop=True)
+        self.assertEqual(expected['itemid'].tolist(), actual['itemid'].tolist())
+        np.testing.assert_allclose(expected['local_peak'].to_numpy(dtype=float), 
+                                   actual['local_peak'].to_numpy(dtype=float), rtol=1e-12)
+        np.testing.assert_array_equal(expected['peak_clock'].to_numpy(dtype=float), 
+                                      actual['peak_clock'].to_numpy(dtype=float))
+
+    def test_calc_local_peak(self):
+        d = testlib.get_csv_detector('test_local_peak')
+        df = pd.DataFrame({
+            'itemid': [1, 1, 1, 1, 2, 2, 3],
+            'clock': [100, 200, 300, 400, 100, 500, 300],
+            'value': [1.0, 5.0, 2.0, 3.0, 4.0, 8.0, 7.0],
+        })
+        itemIds = [1, 2, 3, 4]
+        for is_up in [True, False]:
+            for window in [2, 100, 150, 300, 1000]:
+                self.assert_same_peaks(calc_local_peak_loop(itemIds, df, window, is_up=is_up), 
+                                       d._calc_local_peak(itemIds, df, window, is_up=is_up))
+
+        peaks = d._calc_local_peak(itemIds, df, 200, is_up=True)
+        self.assertEqual(peaks['itemid'].tolist(), [1, 2, 3])
+        self.assertEqual(peaks['local_peak'].tolist(), [3.5, 8.0, 7.0])
+
+        peaks = d._calc_local_peak([4], df, 200)
+        self.assertTrue(peaks.empty)
+        self.assertEqual(list(peaks.columns), ['itemid', 'local_peak', 'peak_clock'])
+
+    def test_calc_local_peak_random(self):
+        d = testlib.get_csv_detector('test_local_peak')
+        rng = np.random.default_rng(1)
+        rows = []
+        for itemId in range(1, 21):
+            n = rng.integers(1, 40)
+            clocks = np.sort(rng.choice(np.arange(0, 86400 * 10, 3600), size=n, replace=False)) + 1700000000
+            values = rng.normal(100, 30, size=n)
+            values[rng.random(n) < 0.1] = np.nan
+            rows.append(pd.DataFrame({'itemid': itemId, 'clock': clocks, 'value': values}))
+        df = pd.concat(rows, ignore_index=True)
+        itemIds = list(range(1, 23))
+        for is_up in [True, False]:
+            for window in [3600, 10800, 86400]:
+                self.assert_same_peaks(calc_local_peak_loop(itemIds, df, window, is_up=is_up), 
+                                       d._calc_local_peak(itemIds, df, window, is_up=is_up))
+
+    def get_anomalies_data(self):
+        rng = np.random.default_rng(2)
+        n_items = 30
+        df = pd.DataFrame({
+            'itemid': np.repeat(np.arange(1, n_items + 1), 50),
+            'clock': np.tile(np.arange(50) * 600 + 1700000000, n_items),
+            'value': rng.normal(100, 20, size=n_items * 50),
+        })
+        # item 1 has no stats, item 2 has a single trend value (std is NaN)
+        stats_df = pd.DataFrame({
+            'itemid': np.arange(2, n_items + 1),
+            'mean': rng.normal(100, 10, size=n_items - 1),
+            'std': rng.uniform(1, 20, size=n_items - 1),
+        })
+        stats_df.loc[0, 'std'] = np.nan
+        return df, stats_df
+
+    def test_filter_anomalies(self):
+        d = testlib.get_csv_detector('test_filter_anomalies')
+        df, stats_df = self.get_anomalies_data()
+        for is_up in [True, False]:
+            for lambda_threshold in [0.5, 1.0, 3.0]:
+                expected = filter_anomalies_loop(df, stats_df, lambda_threshold, is_up=is_up).sort_index()
+                actual = d._filter_anomalies(df, stats_df, lambda_threshold, is_up=is_up)
+                pd.testing.assert_frame_equal(expected, actual)
+
+        self.assertTrue(d._filter_anomalies(df, stats_df.iloc[0:0], 1.0).empty)
+
+    def test_filter_by_anomaly_cnt(self):
+        d = testlib.get_csv_detector('test_filter_anomalies')
+        df, stats_df = self.get_anomalies_data()
+        hist_count = 20
+        for is_up in [True, False]:
+            for lambda_threshold in [0.5, 1.0]:
+                anomalies = filter_anomalies_loop(df, stats_df, lambda_threshold, is_up=is_up)
+                cnts = anomalies.groupby('itemid')['value'].count()
+                expected = cnts[cnts / hist_count > d.anomaly_valid_count_rate].index.tolist()
+                actual = d._filter_by_anomaly_cnt(stats_df, hist_count, df, lambda_threshold, is_up=is_up)
+                self.assertGreater(len(actual), 0)
+                self.assertEqual(sorted(expected), sorted(actual))
+
+    def test_trends_diff_stats(self):
+        d = testlib.get_csv_detector('test_trends_diff')
+        rng = np.random.default_rng(3)
+        n_items, n_trends = 20, 14
+        trends_df = pd.DataFrame({
+            'itemid': np.repeat(np.arange(1, n_items + 1), n_trends),
+            'clock': np.tile(np.arange(n_trends) * 86400 + 1700000000, n_items),
+            'value_min': rng.integers(0, 5, size=n_items * n_trends).astype(float),
+            'value_avg': rng.normal(100, 20, size=n_items * n_trends),
+            'value_max': rng.normal(100, 20, size=n_items * n_trends).round(),
+        })
+        # flat item, item with a NaN and item with a single change
+        trends_df.loc[trends_df['itemid'] == 1, ['value_min', 'value_max']] = 5.0
+        trends_df.loc[3, 'value_max'] = np.nan
+        trends_df.loc[trends_df['itemid'] == 3, 'value_max'] = [1.0] * 13 + [2.0]
+        itemIds = list(range(1, n_items))
+
+        stats_df = d._get_trends_diff_stats(itemIds, trends_df)
+        for suffix in ['max', 'min']:
+            expected = trends_diff_stats_loop(itemIds, trends_df, f'value_{suffix}')
+            actual = stats_df[['itemid', f'mean_{suffix}', f'std_{suffix}']].dropna(subset=[f'mean_{suffix}'])
+            actual.columns = ['itemid', 'mean', 'std']
+            pd.testing.assert_frame_equal(expected, actual.reset_index(drop=True))
+        self.assertNotIn(n_items, stats_df['itemid'].tolist())
+
+    def test_filter_by_conds(self):
+        d = testlib.get_csv_detector('test_conds', 
+            item_conds=[
+                {'name': 'ignore low traffic', 'filter': "item_name.str.startswith('net.if')", 
+                 'condition': {'operator': '>', 'value': 80}},
+                {'name': 'ignore uptime', 'filter': "item_name == 'system.uptime'"},
+            ],
+            item_diff_conds=[
+                {'name': 'ignore small cpu changes', 'filter': "item_name.str.startswith('system.cpu')", 
+                 'condition': {'operator': '>=', 'value': 8}},
+            ])
+
+        rng = np.random.default_rng(4)
+        n = 60
+        itemIds = list(range(1, n + 1))
+        names = ['net.if.in', 'system.uptime', 'system.cpu.util', 'vm.memory']
+        d.dg = ItemsGetter({'items': pd.DataFrame({
+            'itemid': itemIds, 
+            'item_name': [names[i % len(names)] for i in range(n)],
+        })})
+        h_stats_df = pd.DataFrame({
+            'itemid': itemIds,
+            'mean_h': rng.uniform(0, 160, size=n),
+            'mean_t': rng.uniform(0, 160, size=n),
+        })
+
+        expected = filter_by_conds_loop(d, itemIds, h_stats_df)
+        d.dg.calls = 0
+        actual = d._filter_by_conds(itemIds, h_stats_df)
+        self.assertEqual(expected, actual)
+        self.assertNotIn(2, actual)
+        self.assertIn(4, actual)
+        self.assertEqual(d.dg.calls, 3)
+        # the stats frame is not modified
+        self.assertNotIn('diff', h_stats_df.columns)
+
+        # no conditions keeps everything
+        d.item_conds = []
+        d.item_diff_conds = []
+        self.assertEqual(d._filter_by_conds(itemIds, h_stats_df), itemIds)
+
+
+if __name__ == '__main__':
+    unittest.main()
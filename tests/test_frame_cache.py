@@ -0,0 +1,76 @@
+import unittest
+
+import __init__
+import pandas as pd
+from data_processing.frame_cache import FrameCache
+
+
+def make_df(itemIds, clocks=[100, 200, 300]):
+    rows = [(itemId, clock, float(itemId + clock)) for itemId in itemIds for clock in clocks]
+    return pd.DataFrame(rows, columns=['itemid', 'clock', 'value'])
+
+
+class TestFrameCache(unittest.TestCase):
+    def test_get(self):
+        fetched = []
+        def fetch(itemIds):
+            fetched.append(list(itemIds))
+            return make_df(itemIds)
+
+        cache = FrameCache("test", 1024 * 1024)
+        df = cache.get([1, 2, 3], fetch)
+        self.assertEqual(len(df), 9)
+        self.assertEqual(fetched, [[1, 2, 3]])
+
+        # subset is served from memory
+        df = cache.get([3, 1], fetch)
+        self.assertEqual(fetched, [[1, 2, 3]])
+        pd.testing.assert_frame_equal(df, make_df([1, 3]))
+
+        # only the missing item is fetched
+        df = cache.get([2, 4], fetch)
+        self.assertEqual(fetched, [[1, 2, 3], [4]])
+        pd.testing.assert_frame_equal(df, make_df([2, 4]))
+
+        # items without data are remembered as well
+        df = cache.get([5], lambda itemIds: make_df([]))
+        self.assertTrue(df.empty)
+        df = cache.get([5], fetch)
+        self.assertTrue(df.empty)
+        self.assertEqual(fetched, [[1, 2, 3], [4]])
+
+        stats = cache.stats()
+        self.assertEqual(stats['fetches'], 3)
+        self.assertEqual(stats['items'], 5)
+        self.assertEqual(stats['evictions'], 0)
+
+    def test_eviction(self):
+        nbytes = int(make_df([1]).memory_usage(index=True, deep=True).sum())
+        fetched = []
+        def fetch(itemIds):
+            fetched.append(list(itemIds))
+            return make_df(itemIds)
+
+        cache = FrameCache("test", nbytes * 2)
+        cache.get([1], fetch)
+        cache.get([2], fetch)
+        # touch 1 so that 2 is the least recently used
+        cache.get([1], fetch)
+        cache.get([3], fetch)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertLessEqual(cache.bytes, nbytes * 2)
+
+        cache.get([1, 3], fetch)
+        self.assertEqual(fetched, [[1], [2], [3]])
+        cache.get([2], fetch)
+        self.assertEqual(fetched, [[1], [2], [3], [2]])
+
+        # frames larger than the limit are returned but not kept
+        df = cache.get(list(range(10, 20)), fetch)
+        self.assertEqual(len(df), 30)
+        cache.get([10], fetch)
+        self.assertEqual(fetched[-1], [10])
+
+
+if __name__ == '__main__':
+    unittest.main()
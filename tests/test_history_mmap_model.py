@@ -0,0 +1,140 @@
+import __init__
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from models.history import HistoryModel
+from models.history_mmap import MmapHistoryModel
+from models.models_set import ModelsSet
+import utils.config_loader as config_loader
+import tests.testlib as testlib
+
+class TestMmapHistoryModel(unittest.TestCase):
+    def _load_model(self, name: str) -> MmapHistoryModel:
+        testlib.load_test_conf()
+        store_dir = testlib.setup_testdir(name)
+        config_loader.conf.setdefault("data_sources", {})[name] = {
+            "type": "csv",
+            "history_store": "mmap",
+            "history_store_dir": store_dir,
+            "history_store_slots": 4,
+            "history_interval": 600,
+            "history_retention": 18,
+            "anomaly_keep_secs": 86400,
+            "batch_size": 100,
+        }
+        return ModelsSet(name).history
+
+    def test_history_mmap_model(self):
+        history = self._load_model("test_history_mmap")
+        self.assertIsInstance(history, MmapHistoryModel)
+        self.assertTrue(history.check_conn())
+
+        history.truncate()
+        self.assertEqual(history.count(), 0)
+        self.assertEqual(len(history.get_data()), 0)
+
+        itemids = [1, 2, 3]
+        clocks = [600, 1200, 1800]
+        values = [0.1, 0.2, 0.3]
+        history.insert(itemids, clocks, values)
+        self.assertEqual(history.count(), len(itemids))
+        self.assertEqual(len(history.get_data()), len(itemids))
+
+        # existing keys are updated, new keys are inserted
+        history.upsert([1, 2, 4], [600, 1200, 2400], [1.1, 1.2, 1.4])
+        self.assertEqual(history.count(), 4)
+        data = history.get_data([1, 2, 3, 4])
+        self.assertEqual(data['itemid'].tolist(), [1, 2, 3, 4])
+        self.assertEqual(data['value'].tolist(), [1.1, 1.2, 0.3, 1.4])
+
+        # duplicated keys in one batch must not break the merge
+        history.upsert([5, 5], [600, 600], [0.5, 0.5])
+        self.assertEqual(history.count(), 5)
+
+        self.assertEqual(history.separate_existing_itemIds([1, 5, 9]), ([1, 5], [9]))
+        self.assertEqual(len(history.get_charts_df([1, 2], 600, 1200)), 2)
+        self.assertEqual(history.get_charts_df([9], 600, 1200), {})
+
+        # unaligned clocks are rejected
+        with self.assertRaises(ValueError):
+            history.upsert([1], [601], [1.0])
+
+        # the data is read back from the files
+        reopened = MmapHistoryModel("test_history_mmap")
+        self.assertEqual(reopened.count(), 5)
+        pd.testing.assert_frame_equal(reopened.get_data(), history.get_data())
+
+        history.remove_old_data(1800)
+        self.assertEqual(history.get_data()['clock'].tolist(), [1800, 2400])
+        self.assertEqual(history.separate_existing_itemIds([1, 3, 4]), ([3, 4], [1]))
+
+        history.remove_itemIds_not_in([4])
+        self.assertEqual(history.get_data()['itemid'].tolist(), [4])
+
+        history.drop()
+        self.assertFalse(history.check_conn())
+
+    def test_ring_buffer(self):
+        history = self._load_model("test_history_mmap_ring")
+        history.truncate()
+
+        # 4 slots: clock 3000 takes over the slot of 600
+        history.upsert([1, 1, 1, 1], [600, 1200, 1800, 2400], [1.0, 2.0, 3.0, 4.0])
+        history.upsert([1, 2], [3000, 3000], [5.0, 6.0])
+        data = history.get_data()
+        self.assertEqual(data['clock'].tolist(), [1200, 1800, 2400, 3000, 3000])
+        self.assertEqual(data['value'].tolist(), [2.0, 3.0, 4.0, 5.0, 6.0])
+
+        # a clock older than the one in its slot is dropped
+        history.upsert([1], [600], [9.0])
+        self.assertEqual(history.count(), 5)
+
+        itemIds, clocks, values = history.get_matrix([2, 1], 1800, 3000)
+        self.assertEqual(itemIds.tolist(), [1, 2])
+        self.assertEqual(clocks.tolist(), [1800, 2400, 3000])
+        np.testing.assert_array_equal(values, [[3.0, 4.0, 5.0], [np.nan, np.nan, 6.0]])
+
+        # one frame wrapping the ring: item 2 only has the older clock of slot 0
+        history.truncate()
+        history.upsert([1, 1, 1, 1, 1, 2], [600, 1200, 1800, 2400, 3000, 600], [1.0, 2.0, 3.0, 4.0, 5.0, 99.0])
+        data = history.get_data()
+        self.assertEqual(data['itemid'].tolist(), [1, 1, 1, 1])
+        self.assertEqual(data['clock'].tolist(), [1200, 1800, 2400, 3000])
+        self.assertEqual(data['value'].tolist(), [2.0, 3.0, 4.0, 5.0])
+
+    def test_grow(self):
+        history = self._load_model("test_history_mmap_grow")
+        history.truncate()
+        n = MmapHistoryModel.initial_rows + 10
+        history.upsert(list(range(1, n + 1)), [600] * n, [float(i) for i in range(1, n + 1)])
+        self.assertEqual(history.count(), n)
+        data = history.get_data([1, n])
+        self.assertEqual(data['value'].tolist(), [1.0, float(n)])
+
+    def test_same_as_history_model(self):
+        history = self._load_model("test_history_mmap_cmp")
+        history.truncate()
+        pg_history = HistoryModel("test_history_mmap_cmp")
+        pg_history.truncate()
+
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({
+            'itemid': np.repeat([11, 12, 13], 3),
+            'clock': np.tile([600, 1200, 1800], 3),
+            'value': rng.random(9),
+        })
+        history.upsert_df(df)
+        pg_history.upsert_df(df)
+
+        expected = pg_history.get_data([11, 13], 1200, 1800)
+        actual = history.get_data([11, 13], 1200, 1800)
+        for col in ['itemid', 'clock']:
+            self.assertEqual(actual[col].tolist(), expected[col].astype(int).tolist())
+        np.testing.assert_allclose(actual['value'].to_numpy(), expected['value'].to_numpy(dtype=float))
+        pg_history.drop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -32,6 +32,16 @@ class TestHistoryModel(unittest.TestCase):
 
         self.assertEqual(history.count(), len(itemids))
 
+        # Test upsert: existing keys are updated, new keys are inserted
+        history.upsert([1, 2, 4], [1, 2, 4], [1.1, 1.2, 1.4])
+        self.assertEqual(history.count(), 4)
+        data = history.get_data([1, 2, 3, 4])
+        self.assertEqual(data['value'].tolist(), [1.1, 1.2, 0.3, 1.4])
+
+        # duplicated keys in one batch must not break the merge
+        history.upsert([5, 5], [1, 1], [0.5, 0.5])
+        self.assertEqual(history.count(), 5)
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,65 @@
+import __init__
+import unittest
+
+import numpy as np
+
+from models.models_set import ModelsSet
+from data_processing.history_stats import HistoryStats
+import utils.config_loader as config_loader
+import data_getter
+import tests.testlib as testlib
+
+class TestHistoryStatsBuckets(unittest.TestCase):
+    def _expected(self, dg, itemIds, startep, endep):
+        df = dg.get_history_data(startep=startep, endep=endep, itemIds=itemIds)
+        df = df[df['itemid'].isin(itemIds)]
+        return df.groupby('itemid')['value'].agg(['mean', 'std', 'count'])
+
+    def test_sliding_window(self):
+        testlib.load_test_conf()
+        name = 'test_history_stats_buckets'
+        config = config_loader.conf
+        config['data_sources'] = {}
+        config['data_sources'][name] = {
+                'data_dir': "testdata/csv/20250214_1100",
+                'type': 'csv'
+            }
+        config_loader.cascade_config("data_sources")
+        data_source = config['data_sources'][name]
+        ms = ModelsSet(name)
+        ms.initialize()
+        interval = config['history_interval']
+        window = interval * config['history_retention']
+
+        itemIds = [59888, 93281, 94003, 110309, 141917, 217822]
+        dg = data_getter.get_data_getter(data_source)
+        hs = HistoryStats(name, data_source, itemIds=itemIds)
+
+        # first run, then two runs that slide the window by 1.5 and 1 hours
+        endep = 1739505598 - 3600 * 3
+        startep = endep - window
+        hs.update_stats(startep, startep, endep, 0)
+        for step in [5400, 3600]:
+            oldendep = endep
+            endep += step
+            startep = endep - window
+            hs.update_stats(startep, oldendep + 1, endep, 0)
+
+        # the window consists of the buckets starting from the one holding startep
+        expected = self._expected(dg, itemIds, ms.history_stats_buckets.align(startep), endep)
+        stats = ms.history_stats.read_stats(itemIds).set_index('itemid').sort_index()
+        expected = expected.loc[stats.index]
+        self.assertEqual(len(stats), len(itemIds))
+        np.testing.assert_array_equal(stats['cnt'].astype(int).to_numpy(), expected['count'].to_numpy())
+        np.testing.assert_allclose(stats['mean'].astype(float).to_numpy(), expected['mean'].to_numpy())
+        np.testing.assert_allclose(stats['std'].astype(float).to_numpy(), expected['std'].fillna(0).to_numpy(),
+                                   rtol=1e-9, atol=1e-9)
+
+        # the ring never holds more than n_slots buckets per item
+        sql = f"SELECT MAX(c) FROM (SELECT COUNT(*) AS c FROM {ms.history_stats_buckets.table_name} GROUP BY itemid) t"
+        (max_buckets,) = ms.history_stats_buckets.db.select1rec(sql)
+        self.assertLessEqual(max_buckets, ms.history_stats_buckets.n_slots)
+
+
+if __name__ == "__main__":
+    unittest.main()
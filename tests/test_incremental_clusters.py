@@ -0,0 +1,82 @@
+import unittest
+
+import __init__
+import pandas as pd
+import utils.config_loader as config_loader
+import tests.testlib as testlib
+import classifiers.dbscan as dbscan
+import classifiers.incremental as incremental
+from models.models_set import ModelsSet
+
+class TestIncrementalClusters(unittest.TestCase):
+    
+    def test_incremental_clusters(self):
+        testlib.load_test_conf()
+        endep = 1739505598 
+        conf = config_loader.conf
+        conf["data_sources"] = {
+            "csv_incremental": {
+                "type": "csv",
+                "data_dir": "testdata/csv/20250214_1100"
+            },
+        }
+        config_loader.cascade_config("data_sources")
+        itemIds = [59888, 93281, 94003, 110309, 141917, 217822, 236160, 217825, 270793, 270797, 217823]
+        testlib.import_test_data(conf, itemIds, endep)
+        ms = ModelsSet("csv_incremental")
+        ms.clusters.truncate()
+        expected, _, _ = dbscan.classify_charts(conf, "csv_incremental", itemIds, endep=endep)
+        expected = {int(itemId): int(clusterId) for itemId, clusterId in expected.items()}
+
+        # the first run classifies fully
+        clusters = incremental.classify_charts_incremental(conf, "csv_incremental", itemIds, endep=endep)
+        self.assertEqual(clusters, expected)
+        members = ms.clusters.read_members().set_index('itemid')
+        self.assertEqual(members['clusterid'].to_dict(), expected)
+        self.assertTrue((members.loc[members['clusterid'] < 0, 'representative'] == 0).all())
+
+        # a clustered item that comes back joins its cluster again without a full run
+        clustered = [itemId for itemId, clusterId in expected.items() if clusterId >= 0]
+        sizes = pd.Series(expected).value_counts()
+        back = [itemId for itemId in clustered if sizes[expected[itemId]] > 2][0]
+        rest = [itemId for itemId in itemIds if itemId != back]
+        incremental.classify_charts_incremental(conf, "csv_incremental", rest, endep=endep)
+        self.assertNotIn(back, ms.clusters.read_members()['itemid'].tolist())
+        conf['dbscan']['reclassify_drift'] = 0.5
+        clusters = incremental.classify_charts_incremental(conf, "csv_incremental", itemIds, endep=endep + 3600)
+        self.assertEqual(clusters[back], expected[back])
+        self.assertEqual(ms.clusters.read_members()['created'].min(), endep)
+
+        # clusters older than reclassify_secs are classified again
+        conf['dbscan']['reclassify_secs'] = 1800
+        incremental.classify_charts_incremental(conf, "csv_incremental", itemIds, endep=endep + 3600)
+        self.assertEqual(ms.clusters.read_members()['created'].min(), endep + 3600)
+
+    def test_update_clusterid(self):
+        testlib.load_test_conf()
+        conf = config_loader.conf
+        conf["data_sources"] = {
+            "csv_update_clusterid": {
+                "type": "csv",
+                "data_dir": "testdata/csv/20250214_1100"
+            },
+        }
+        config_loader.cascade_config("data_sources")
+        anomalies = ModelsSet("csv_update_clusterid").anomalies
+        anomalies.truncate()
+        rows = []
+        for itemId, created in [(1, 100), (1, 200), (2, 100), (3, 100), (4, 100)]:
+            rows.append({"itemid": itemId, "created": created, "group_name": "g", "hostid": 1, 
+                         "clusterid": 7, "host_name": "h", "item_name": "i", "trend_mean": 0.0, "trend_std": 0.0})
+        anomalies.insert_data(pd.DataFrame(rows))
+
+        anomalies.update_clusterid({1: 0, 2: 0, 3: 1, 5: 2})
+        df = anomalies.get_data()
+        self.assertEqual(df.groupby('itemid')['clusterid'].unique().apply(list).to_dict(), 
+                         {1: [0], 2: [0], 3: [1], 4: [-1]})
+        anomalies.update_clusterid({})
+        self.assertEqual(anomalies.get_data()['clusterid'].unique().tolist(), [-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
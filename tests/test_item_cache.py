@@ -0,0 +1,149 @@
+import unittest
+import os
+import time
+
+import __init__
+import pandas as pd
+from data_getter.item_cache import ItemCache
+import tests.testlib as testlib
+
+
+ITEMS = [
+    # itemid, hostid, host, host_name, key_, item_name, group_name
+    (1, 10, 'web01', 'Web 01', 'system.cpu.util', 'CPU utilization', 'app/web'),
+    (1, 10, 'web01', 'Web 01', 'system.cpu.util', 'CPU utilization', 'linux'),
+    (2, 10, 'web01', 'Web 01', 'vm.memory.size', 'Memory size', 'app/web'),
+    (2, 10, 'web01', 'Web 01', 'vm.memory.size', 'Memory size', 'linux'),
+    (3, 20, 'db01', 'DB 01', 'system.cpu.util', 'CPU utilization', 'app/db'),
+    (4, 30, 'lb01', 'LB 01', 'net.if.in', 'Incoming traffic', 'app'),
+    (5, 40, 'tmp01', 'Tmp 01', 'system.cpu.util', 'CPU utilization', None),
+]
+
+
+class Loader:
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    def __call__(self, min_itemid):
+        self.calls.append(min_itemid)
+        return pd.DataFrame([row for row in self.rows if row[0] > min_itemid])
+
+
+class TestItemCache(unittest.TestCase):
+    def test_queries(self):
+        loader = Loader(ITEMS)
+        cache = ItemCache("test", loader)
+
+        self.assertEqual(sorted(cache.get_itemIds()), [1, 2, 3, 4])
+        self.assertEqual(cache.get_itemIds(group_names=['app']), [1, 2, 3, 4])
+        self.assertEqual(cache.get_itemIds(group_names=['app/web']), [1, 2])
+        self.assertEqual(cache.get_itemIds(group_names=['app/*']), [1, 2, 3])
+        self.assertEqual(cache.get_itemIds(host_names=['Web 01'], item_names=['Memory*']), [2])
+        self.assertEqual(cache.get_itemIds(itemIds=[3, 4, 5]), [3, 4])
+        self.assertEqual(len(cache.get_itemIds(max_itemIds=2)), 2)
+
+        details = cache.get_items_details([1, 3])
+        self.assertEqual(list(details.columns), ['group_name', 'hostid', 'host_name', 'itemid', 'item_name'])
+        self.assertEqual(details['itemid'].tolist(), [1, 1, 3])
+        self.assertEqual(details['host_name'].tolist(), ['web01', 'web01', 'db01'])
+        self.assertEqual(details['item_name'].tolist(), ['system.cpu.util'] * 3)
+
+        item_details = cache.get_item_details([2, 5, 99])
+        self.assertEqual(item_details, {
+            2: {'hostid': 10, 'host_name': 'Web 01', 'item_name': 'Memory size'},
+            5: {'hostid': 40, 'host_name': 'Tmp 01', 'item_name': 'CPU utilization'},
+        })
+        self.assertEqual(cache.get_item_host_dict([1, 5]), {1: 10, 5: 40})
+
+        self.assertEqual(cache.classify_by_groups([1, 2, 3, 4], ['app/web', 'app/db', 'none']), 
+                         {'app/web': [1, 2], 'app/db': [3]})
+        self.assertEqual(cache.classify_by_groups([1], []), {'all': [1]})
+        self.assertEqual(cache.get_group_map([1, 3, 4], ['app', 'linux']), {1: 'linux', 3: 'app', 4: 'app'})
+
+        relations = cache.get_item_relations([1, 3], ['app/*'])
+        self.assertEqual(relations['itemid'].tolist(), [1, 3])
+        self.assertEqual(relations['group_name'].tolist(), ['app/*', 'app/*'])
+
+        # everything above was served by a single load
+        self.assertEqual(loader.calls, [0])
+
+    def test_refresh(self):
+        loader = Loader(ITEMS[:4])
+        cache = ItemCache("test", loader, ttl=3600, full_ttl=7200)
+        self.assertEqual(sorted(cache.get_itemIds()), [1, 2])
+
+        # new items are fetched above the watermark once the ttl expired
+        loader.rows = ITEMS
+        self.assertEqual(sorted(cache.get_itemIds()), [1, 2])
+        cache.refreshed_at = time.time() - 3601
+        self.assertEqual(sorted(cache.get_itemIds()), [1, 2, 3, 4])
+        self.assertEqual(loader.calls, [0, 2])
+
+        # full reload after full_ttl drops removed items
+        loader.rows = ITEMS[4:]
+        cache.full_refreshed_at = time.time() - 7201
+        self.assertEqual(sorted(cache.get_itemIds()), [3, 4])
+        self.assertEqual(loader.calls, [0, 2, 0])
+
+        # empty source
+        cache = ItemCache("test", Loader([]))
+        self.assertEqual(cache.get_itemIds(), [])
+        self.assertEqual(cache.get_item_details([1]), {})
+
+    def test_signature(self):
+        loader = Loader(ITEMS[:4])
+        tables = {'items': [1, 2], 'hosts_groups': [(10, 'app/web'), (10, 'linux')]}
+        def signature():
+            return [len(tables['items']), max(tables['items']), 
+                    len(tables['hosts_groups']), len(set(group for _, group in tables['hosts_groups']))]
+        cache = ItemCache("test", loader, ttl=600, full_ttl=7200, signature=signature)
+        self.assertEqual(sorted(cache.get_itemIds()), [1, 2])
+
+        # new items only are fetched above the watermark
+        loader.rows = ITEMS[:5]
+        tables['items'] = [1, 2, 3]
+        cache.refreshed_at = time.time() - 601
+        self.assertEqual(sorted(cache.get_itemIds()), [1, 2, 3])
+        self.assertEqual(loader.calls, [0, 2])
+
+        # an unchanged signature fetches nothing more
+        cache.refreshed_at = time.time() - 601
+        self.assertEqual(sorted(cache.get_itemIds()), [1, 2, 3])
+        self.assertEqual(loader.calls, [0, 2, 3])
+
+        # a deleted item reloads within the ttl, not after full_ttl
+        loader.rows = [row for row in ITEMS if row[0] != 2]
+        tables['items'] = [1, 3, 4]
+        cache.refreshed_at = time.time() - 601
+        self.assertEqual(sorted(cache.get_itemIds()), [1, 3, 4])
+        self.assertEqual(loader.calls, [0, 2, 3, 3, 0])
+
+        # a host moved to another group reloads as well
+        loader.rows = [row[:6] + ('app/db',) if row[1] == 10 else row for row in loader.rows]
+        tables['hosts_groups'] = [(10, 'app/db')]
+        cache.refreshed_at = time.time() - 601
+        self.assertEqual(cache.get_group_map([1, 3], ['app/db', 'app/web']), {1: 'app/db', 3: 'app/db'})
+        self.assertEqual(loader.calls, [0, 2, 3, 3, 0, 0])
+
+    def test_disk(self):
+        testdir = testlib.setup_testdir("item_cache")
+        loader = Loader(ITEMS)
+        cache = ItemCache("test", loader, cache_dir=testdir)
+        self.assertEqual(sorted(cache.get_itemIds()), [1, 2, 3, 4])
+        self.assertTrue(os.path.exists(os.path.join(testdir, "item_cache_test.pkl")))
+
+        # another process reuses the file while it is fresh
+        loader2 = Loader(ITEMS)
+        cache2 = ItemCache("test", loader2, cache_dir=testdir)
+        self.assertEqual(sorted(cache2.get_itemIds()), [1, 2, 3, 4])
+        self.assertEqual(loader2.calls, [])
+
+    def test_case_insensitive(self):
+        cache = ItemCache("test", Loader(ITEMS), case_sensitive=False)
+        self.assertEqual(cache.get_itemIds(group_names=['APP/WEB']), [1, 2])
+        self.assertEqual(cache.get_group_map([3], ['App']), {3: 'App'})
+
+
+if __name__ == '__main__':
+    unittest.main()
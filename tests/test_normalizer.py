@@ -2,6 +2,7 @@
 unit tests for utils/formatter.py
 """
 import unittest
+import numpy as np
 import pandas as pd
 
 import __init__
@@ -26,9 +27,94 @@ class TestFormatter(unittest.TestCase):
         new_values = fit_to_base_clocks(base_clocks, clocks, values)
         self.assertEqual(new_values, expected_values)
 
-        
-        
-        
+    def assert_matrix_equals_scalar(self, df, base_clocks):
+        itemIds, matrix = fit_to_base_clocks_matrix(df, base_clocks)
+        self.assertEqual(sorted(itemIds.tolist()), sorted(df['itemid'].unique().tolist()))
+        self.assertEqual(matrix.shape, (len(itemIds), len(base_clocks)))
+        for k, itemId in enumerate(itemIds):
+            item_df = df[df['itemid'] == itemId].sort_values('clock', kind='mergesort')
+            expected = fit_to_base_clocks(base_clocks, item_df['clock'].tolist(), item_df['value'].tolist())
+            np.testing.assert_allclose(matrix[k], expected, err_msg=f"itemid={itemId}")
+
+    # test fit_to_base_clocks_matrix against fit_to_base_clocks
+    def test_fit_to_base_clocks_matrix(self):
+        # the two cases above as two items of one frame
+        df = pd.DataFrame({
+            'itemid': [1]*5 + [2]*10,
+            'clock': [2, 4, 5, 7, 9] + list(range(1, 11)),
+            'value': [1, 2, 3, 4, 5] + list(range(1, 11)),
+        })
+        itemIds, matrix = fit_to_base_clocks_matrix(df[df['itemid'] == 1], list(range(1, 11)))
+        self.assertEqual(matrix[0].tolist(), [1, 1, 2, 2, 3, 4, 4, 5, 5, 5])
+        itemIds, matrix = fit_to_base_clocks_matrix(df[df['itemid'] == 2], [2, 4, 5, 7, 9])
+        self.assertEqual(matrix[0].tolist(), [1.5, 3.5, 5, 6.5, 9.25])
+        self.assert_matrix_equals_scalar(df, [1, 3, 5, 7, 9])
+
+        # unsorted input, same length as base_clocks, single value
+        df = pd.DataFrame({
+            'itemid': [3, 1, 3, 2, 1, 3],
+            'clock': [30, 20, 10, 15, 5, 20],
+            'value': [3.0, 2.0, 1.0, 7.0, 1.0, 2.0],
+        })
+        self.assert_matrix_equals_scalar(df, [10, 20, 30])
+
+        # empty frame
+        itemIds, matrix = fit_to_base_clocks_matrix(pd.DataFrame(columns=['itemid', 'clock', 'value']), [1, 2])
+        self.assertEqual(len(itemIds), 0)
+        self.assertEqual(matrix.shape, (0, 2))
+
+    def test_fit_to_base_clocks_matrix_random(self):
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            base_clocks = get_base_clocks(6000, 6000 + 600 * int(rng.integers(1, 30)), 600)
+            rows = []
+            for itemId in rng.choice(100000, size=int(rng.integers(1, 8)), replace=False):
+                mode = rng.integers(0, 3)
+                n = len(base_clocks) if mode == 0 else int(rng.integers(1, 80))
+                if mode == 1:
+                    # exact hits with duplicated clocks
+                    clocks = rng.choice(base_clocks, size=n)
+                else:
+                    clocks = rng.integers(base_clocks[0] - 3000, base_clocks[-1] + 3000, size=n)
+                values = rng.normal(size=n) * 100
+                rows += [(itemId, clock, value) for clock, value in zip(np.sort(clocks), values)]
+            df = pd.DataFrame(rows, columns=['itemid', 'clock', 'value'])
+            self.assert_matrix_equals_scalar(df, base_clocks)
+
+    def test_matrix2df(self):
+        df = matrix2df(np.array([1, 2]), [10, 20], np.array([[0.1, 0.2], [0.3, 0.4]]))
+        self.assertEqual(df['itemid'].tolist(), [1, 1, 2, 2])
+        self.assertEqual(df['clock'].tolist(), [10, 20, 10, 20])
+        self.assertEqual(df['value'].tolist(), [0.1, 0.2, 0.3, 0.4])
+
+    def test_long2charts(self):
+        # items interleaved: each item keeps its first row order and its row order
+        df = pd.DataFrame({
+            'itemid': [5, 3, 5, 3, 3, 7],
+            'clock': [10, 10, 20, 20, 30, 10],
+            'value': [0.1, 0.2, 0.3, 0.4, 0.5, 0.6],
+        })
+        charts = long2charts(df)
+        self.assertEqual(list(charts.keys()), [5, 3, 7])
+        self.assertEqual(charts[5].tolist(), [0.1, 0.3])
+        self.assertEqual(charts[3].tolist(), [0.2, 0.4, 0.5])
+        self.assertEqual(charts[7].index.tolist(), [0])
+
+        itemIds, matrix = long2chart_matrix(df)
+        self.assertEqual(itemIds.tolist(), [5, 3, 7])
+        expected = pd.DataFrame(charts).T.to_numpy()
+        np.testing.assert_array_equal(matrix, expected)
+        itemIds, matrix = charts2matrix(charts)
+        self.assertEqual(itemIds.tolist(), [5, 3, 7])
+        np.testing.assert_array_equal(matrix, expected)
+
+        # a grouped frame is sliced as is
+        sorted_df = df.sort_values(['itemid', 'clock'])
+        itemIds, bounds, grouped = group_long_df(sorted_df)
+        self.assertIs(grouped, sorted_df)
+        self.assertEqual(bounds.tolist(), [0, 3, 5, 6])
+        self.assertEqual(long2charts(df.iloc[:0]), {})
+
 
 
 
@@ -0,0 +1,51 @@
+import __init__
+import unittest
+import threading
+import time
+
+from data_processing.pipeline import run_pipelined
+
+class TestPipeline(unittest.TestCase):
+    def test_results_in_order(self):
+        batches = [[i, i + 1] for i in range(0, 20, 2)]
+        for depth in [0, 1, 3]:
+            results = run_pipelined("test", lambda batch: sum(batch), 
+                                    lambda batch, data: (batch[0], data), batches, depth)
+            self.assertEqual(results, [(batch[0], sum(batch)) for batch in batches])
+
+    def test_overlap_and_bound(self):
+        lock = threading.Lock()
+        state = {"queued": 0, "max_queued": 0}
+
+        def fetch(batch):
+            time.sleep(0.05)
+            with lock:
+                state["queued"] += 1
+                state["max_queued"] = max(state["max_queued"], state["queued"])
+            return batch
+
+        def compute(batch, data):
+            with lock:
+                state["queued"] -= 1
+            time.sleep(0.05)
+            return data
+
+        batches = [[i] for i in range(8)]
+        start = time.time()
+        run_pipelined("test", fetch, compute, batches, 1)
+        # sequential would take 0.8 secs
+        self.assertLess(time.time() - start, 0.7)
+        # one batch in the queue, one being computed and one just fetched
+        self.assertLessEqual(state["max_queued"], 3)
+
+    def test_fetch_error(self):
+        def fetch(batch):
+            if batch[0] == 2:
+                raise KeyError("no data")
+            return batch
+        with self.assertRaises(KeyError):
+            run_pipelined("test", fetch, lambda batch, data: data, [[0], [1], [2], [3]], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 import __init__
 import unittest
 import os
+import pandas as pd
 
 import utils.config_loader as config_loader
 import db.postgresql as pg
@@ -28,6 +29,67 @@ class TestPgSQL(unittest.TestCase):
         sql = "drop table if exists test_table1;"
         db.exec_sql(sql)
 
+    def test_pgsql_pool(self):
+        testlib.load_test_conf()
+        db1 = pg.PostgreSqlDB(config_loader.conf["admdb"])
+        db2 = pg.PostgreSqlDB(config_loader.conf["admdb"])
+        self.assertIs(db1.pool, db2.pool)
+
+        before = db1.pool_stats()
+        for _ in range(10):
+            db1.select1rec("select 1;")
+            db2.select1rec("select 1;")
+        after = db1.pool_stats()
+        self.assertEqual(after["checkouts"] - before["checkouts"], 20)
+        # statements reuse pooled connections instead of opening new ones
+        self.assertEqual(after["created"], before["created"])
+        self.assertEqual(after["in_use"], 0)
+
+        # a broken connection is replaced on the next checkout
+        conn = db1.connect()
+        conn.close()
+        db1.release(conn)
+        (val,) = db1.select1rec("select 1;")
+        self.assertEqual(val, 1)
+        self.assertEqual(db1.pool_stats()["discarded"], after["discarded"] + 1)
+
+    def test_pgsql_read_sql_chunks(self):
+        testlib.load_test_conf()
+        db = pg.PostgreSqlDB(config_loader.conf["admdb"])
+        sql = "select i as itemid, i * 0.5 as value from generate_series(1, 25) as i order by i"
+
+        chunks = list(db.read_sql_chunks(sql, columns=["itemid", "value"], 
+                                         dtypes={"itemid": "int64", "value": "float64"}, itersize=10))
+        self.assertEqual([len(c) for c in chunks], [10, 10, 5])
+        self.assertEqual(str(chunks[0]["itemid"].dtype), "int64")
+        self.assertEqual(chunks[2]["value"].tolist(), [10.5, 11.0, 11.5, 12.0, 12.5])
+        self.assertEqual(db.pool_stats()["in_use"], 0)
+
+        # stopping early gives the connection back to the pool
+        for chunk in db.read_sql_chunks(sql, itersize=10):
+            break
+        del chunk
+        self.assertEqual(db.pool_stats()["in_use"], 0)
+        (val,) = db.select1rec("select 1;")
+        self.assertEqual(val, 1)
+
+    def test_pgsql_copy_upsert(self):
+        testlib.load_test_conf()
+        db = pg.PostgreSqlDB(config_loader.conf["admdb"])
+        db.exec_sql("drop table if exists test_copy_upsert;")
+        db.exec_sql("create table test_copy_upsert (itemid bigint primary key, value float);")
+        pg_types = {"itemid": "bigint", "value": "float"}
+
+        db.copy_upsert("test_copy_upsert", pd.DataFrame({"itemid": [1, 2], "value": [1.0, 2.0]}), 
+                       ["itemid", "value"], pg_types, ["itemid"])
+        # the last row of a repeated key wins
+        df = pd.DataFrame({"itemid": [2, 3, 2, 3, 2], "value": [20.0, 30.0, 21.0, 31.0, 22.0]})
+        cnt = db.copy_upsert("test_copy_upsert", df, ["itemid", "value"], pg_types, ["itemid"])
+        self.assertEqual(cnt, 2)
+        rows = db.read_sql("select itemid, value from test_copy_upsert order by itemid").values.tolist()
+        self.assertEqual(rows, [[1, 1.0], [2, 22.0], [3, 31.0]])
+        db.exec_sql("drop table if exists test_copy_upsert;")
+
 
 
 if __name__ == "__main__":
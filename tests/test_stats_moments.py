@@ -0,0 +1,47 @@
+import __init__
+import unittest
+
+import numpy as np
+
+from data_processing.stats import merge_moments, subtract_moments, moments_std
+
+def moments(values):
+    values = np.asarray(values, dtype=float)
+    return len(values), values.mean(), np.square(values - values.mean()).sum()
+
+class TestStatsMoments(unittest.TestCase):
+    def test_merge_and_subtract(self):
+        # large counters with a small spread, where sqr_sum - sum^2/cnt cancels
+        rng = np.random.default_rng(0)
+        a = 1e9 + rng.random(500)
+        b = 1e9 + rng.random(300)
+        all_values = np.concatenate([a, b])
+
+        cnt, mean, m2 = merge_moments(*moments(a), *moments(b))
+        self.assertEqual(cnt, len(all_values))
+        self.assertAlmostEqual(float(mean), all_values.mean(), delta=1e-6)
+        np.testing.assert_allclose(moments_std(cnt, m2), all_values.std(ddof=1), rtol=1e-6)
+        naive_var = (np.square(all_values).sum() - np.square(all_values.sum()) / cnt) / (cnt - 1)
+        self.assertGreater(abs(naive_var - all_values.var(ddof=1)), 1e-2)
+
+        cnt, mean, m2 = subtract_moments(cnt, mean, m2, *moments(b))
+        self.assertEqual(cnt, len(a))
+        np.testing.assert_allclose(moments_std(cnt, m2), a.std(ddof=1), rtol=1e-6)
+
+    def test_empty_partitions(self):
+        cnt, mean, m2 = merge_moments(np.array([0, 2]), np.array([0.0, 1.0]), np.array([0.0, 2.0]),
+                                      np.array([0, 0]), np.array([0.0, 0.0]), np.array([0.0, 0.0]))
+        self.assertEqual(cnt.tolist(), [0, 2])
+        self.assertEqual(mean.tolist(), [0.0, 1.0])
+        self.assertEqual(m2.tolist(), [0.0, 2.0])
+
+        # everything subtracted
+        cnt, mean, m2 = subtract_moments(np.array([2]), np.array([1.0]), np.array([2.0]),
+                                         np.array([2]), np.array([1.0]), np.array([2.0]))
+        self.assertEqual(cnt.tolist(), [0])
+        self.assertEqual(m2.tolist(), [0.0])
+        self.assertEqual(moments_std(np.array([1, 0]), np.array([0.0, 0.0])).tolist(), [0.0, 0.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,5 @@
 import unittest
+import pandas as pd
 
 import __init__
 from models.models_set import ModelsSet
@@ -33,6 +34,16 @@ class TestTrendsStatsModel(unittest.TestCase):
         
         self.assertEqual(len(df), 1)
         self.assertEqual(df['itemid'].tolist(), [93281])
+
+        # bulk upsert updates existing rows and inserts new ones
+        stats = pd.DataFrame({'itemid': [93281, 94003], 'sum': [3.0, 4.0], 'sqr_sum': [5.0, 8.0], 
+                              'cnt': [2, 2], 'mean': [1.5, 2.0], 'std': [0.7, 0.0]})
+        res = tsm.upsert_stats_df(stats)
+        self.assertEqual(res['rows'], 2)
+        self.assertEqual(tsm.count(), 3)
+        df = tsm.read_stats(itemids=[93281])
+        self.assertEqual(df['cnt'].tolist(), [2])
+        self.assertEqual(df['mean'].tolist(), [1.5])
         
 
 if __name__ == '__main__':
@@ -0,0 +1,137 @@
+import __init__
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import utils.config_loader as config_loader
+from db.postgresql import PostgreSqlDB
+from data_getter.zabbix_psql_getter import ZabbixPSqlGetter
+import tests.testlib as testlib
+
+SCHEMA = "zabbix_getter_test"
+
+GROUPS = [(1, 'app'), (2, 'app/web'), (3, 'app/web/front'), (4, 'linux'), (5, 'apple'), (6, "ops's")]
+HOSTS = [(10, 'web01'), (20, 'front01'), (30, 'db01'), (40, 'apple01'), (50, 'ops01')]
+HOSTS_GROUPS = [(1, 10, 2), (2, 10, 4), (3, 20, 3), (4, 30, 1), (5, 30, 4), (6, 40, 5), (7, 50, 6)]
+# itemid, hostid
+ITEMS = [(101, 10), (102, 10), (201, 20), (301, 30), (401, 40), (501, 50)]
+
+
+class TestZabbixPSqlGetter(unittest.TestCase):
+    def setUp(self):
+        testlib.load_test_conf()
+        db = PostgreSqlDB(config_loader.conf["admdb"])
+        db.exec_sql(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+        db.create_schema(SCHEMA)
+        self.db = PostgreSqlDB(dict(config_loader.conf["admdb"], schema=SCHEMA))
+        self.db.exec_sql("CREATE TABLE dbversion (mandatory integer);")
+        self.db.exec_sql("INSERT INTO dbversion VALUES (6000000);")
+        self.db.exec_sql("CREATE TABLE hstgrp (groupid bigint, name varchar(255));")
+        self.db.exec_sql("CREATE TABLE hosts (hostid bigint, host varchar(128), name varchar(128));")
+        self.db.exec_sql("CREATE TABLE hosts_groups (hostgroupid bigint, hostid bigint, groupid bigint);")
+        self.db.exec_sql("CREATE TABLE items (itemid bigint, hostid bigint, key_ varchar(2048), name varchar(255));")
+        for groupid, name in GROUPS:
+            name = name.replace("'", "''")
+            self.db.exec_sql(f"INSERT INTO hstgrp VALUES ({groupid}, '{name}');")
+        for hostid, host in HOSTS:
+            self.db.exec_sql(f"INSERT INTO hosts VALUES ({hostid}, '{host}', '{host}');")
+        for row in HOSTS_GROUPS:
+            self.db.exec_sql(f"INSERT INTO hosts_groups VALUES {row};")
+        for itemid, hostid in ITEMS:
+            self.db.exec_sql(f"INSERT INTO items VALUES ({itemid}, {hostid}, 'key{itemid}', 'item{itemid}');")
+        for table in ['history', 'history_uint']:
+            self.db.exec_sql(f"CREATE TABLE {table} (itemid bigint, clock integer, value float);")
+        for table in ['trends', 'trends_uint']:
+            self.db.exec_sql(f"CREATE TABLE {table} (itemid bigint, clock integer, "
+                             "value_min float, value_avg float, value_max float);")
+
+    def tearDown(self):
+        self.db.exec_sql(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+
+    def _group_itemIds(self, itemIds, group_name):
+        # the per group query that classify_by_groups and get_group_map ran before _match_groups
+        group_name = group_name.replace("'", "''")
+        sql = f"""
+            SELECT distinct items.itemid
+            FROM items
+            inner join hosts on hosts.hostid = items.hostid
+            inner join hosts_groups on hosts_groups.hostid = hosts.hostid
+            inner join hstgrp on hstgrp.groupid = hosts_groups.groupid
+            WHERE (hstgrp.name = '{group_name}' OR hstgrp.name LIKE '{group_name}/%')
+            AND itemid IN ({",".join(map(str, itemIds))})
+        """
+        cur = self.db.exec_sql(sql)
+        rows = cur.fetchall()
+        cur.close()
+        return sorted([row[0] for row in rows])
+
+    def test_match_groups(self):
+        data_source = dict(config_loader.conf["admdb"], schema=SCHEMA, api_url="", item_cache_ttl=0)
+        getter = ZabbixPSqlGetter(data_source)
+        self.assertIsNone(getter.item_cache)
+        itemIds = [itemid for itemid, _ in ITEMS] + [999]
+
+        for group_names in [['app', 'linux'], ['linux', 'app'], ['app/web', 'app'],
+                            ['app/web/front', 'app/web', 'apple', "ops's", 'none']]:
+            expected_groups = {}
+            expected_map = {}
+            for group_name in group_names:
+                group_itemIds = self._group_itemIds(itemIds, group_name)
+                if len(group_itemIds) > 0:
+                    expected_groups[group_name] = group_itemIds
+                for itemId in group_itemIds:
+                    expected_map[itemId] = group_name
+            self.assertEqual(getter.classify_by_groups(itemIds, group_names), expected_groups)
+            self.assertEqual(getter.get_group_map(itemIds, group_names), expected_map)
+
+        # nested groups are under their parent, 'apple' is not under 'app'
+        self.assertEqual(getter.classify_by_groups(itemIds, ['app']), {'app': [101, 102, 201, 301]})
+        # a later group wins
+        self.assertEqual(getter.get_group_map([101, 301], ['app', 'linux']), {101: 'linux', 301: 'linux'})
+        self.assertEqual(getter.get_group_map([101, 301], ['linux', 'app']), {101: 'app', 301: 'app'})
+
+        # the item cache serves the same groups
+        cached = ZabbixPSqlGetter(dict(data_source, item_cache_ttl=600))
+        self.assertEqual(cached.get_group_map(itemIds, ['app/web', 'app']),
+                         getter.get_group_map(itemIds, ['app/web', 'app']))
+        self.assertEqual(cached._item_metadata_signature(), [6, 501, 7, 7, 6, 6])
+
+    def test_iter_data(self):
+        data_source = dict(config_loader.conf["admdb"], schema=SCHEMA, api_url="")
+        getter = ZabbixPSqlGetter(data_source)
+
+        # items interleaved over both tables and inserted out of clock order
+        rng = np.random.default_rng(5)
+        for table, itemIds in [('history', [101, 301]), ('history_uint', [102, 201])]:
+            clocks = rng.permutation(np.arange(1000, 1000 + 600 * 10, 600))
+            values = ", ".join([f"({itemid}, {clock}, {rng.random()})" for clock in clocks for itemid in itemIds])
+            self.db.exec_sql(f"INSERT INTO {table} VALUES {values};")
+        for table, itemIds in [('trends', [101]), ('trends_uint', [102, 201])]:
+            values = ", ".join([f"({itemid}, {clock}, 1.0, 2.0, 3.0)" 
+                                for clock in [7200, 3600] for itemid in itemIds])
+            self.db.exec_sql(f"INSERT INTO {table} VALUES {values};")
+
+        chunks = list(getter.iter_history_data(1000, 1000 + 600 * 9, [101, 102, 201], itersize=7))
+        self.assertEqual([len(chunk) for chunk in chunks], [7, 7, 7, 7, 2])
+        df = pd.concat(chunks, ignore_index=True)
+        self.assertEqual(list(df.columns), ['itemid', 'clock', 'value'])
+        self.assertEqual(str(df['itemid'].dtype), 'int64')
+        expected = getter.get_history_data(1000, 1000 + 600 * 9, [101, 102, 201])
+        expected = expected.sort_values(['itemid', 'clock'], ignore_index=True)
+        self.assertEqual(df['itemid'].tolist(), expected['itemid'].astype(int).tolist())
+        self.assertEqual(df['clock'].tolist(), expected['clock'].astype(int).tolist())
+        self.assertEqual(df['itemid'].tolist(), [101] * 10 + [102] * 10 + [201] * 10)
+        self.assertTrue((df.groupby('itemid')['clock'].diff().dropna() > 0).all())
+        self.assertEqual(list(getter.iter_history_data(0, 999, itersize=7)), [])
+
+        chunks = list(getter.iter_trends_full_data(0, 7200, itersize=4))
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 2])
+        df = pd.concat(chunks, ignore_index=True)
+        self.assertEqual(list(df.columns), ['itemid', 'clock', 'value_min', 'value_avg', 'value_max'])
+        self.assertEqual(list(zip(df['itemid'], df['clock'])), 
+                         [(101, 3600), (101, 7200), (102, 3600), (102, 7200), (201, 3600), (201, 7200)])
+
+
+if __name__ == '__main__':
+    unittest.main()
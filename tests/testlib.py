@@ -44,4 +44,21 @@ def load_test_conf():
     sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
     os.environ['ANOMDEC_SECRET_PATH'] = os.path.join('tests', 'test_secret.yml')
     config_loader.load_config(os.path.join('tests', 'test_config.yml'))
-    
\ No newline at end of file
+    
+def get_csv_detector(name: str, **params) -> Detector:
+    """
+    Detector on a csv data source of the test data, for tests of its methods.
+    params are set on the data source after the config is cascaded.
+    """
+    import utils.config_loader as config_loader
+    load_test_conf()
+    config = config_loader.conf
+    config['data_sources'] = {}
+    config['data_sources'][name] = {
+            'data_dir': "testdata/csv/20250214_1100",
+            'type': 'csv'
+        }
+    config_loader.cascade_config("data_sources")
+    data_source = config['data_sources'][name]
+    data_source.update(params)
+    return Detector(name, data_source, [1])
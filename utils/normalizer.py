@@ -71,6 +71,178 @@ def fit_to_base_clocks(base_clocks: List[int], clocks: List[int], values: List[f
 
         return new_values.tolist()
 
+""" fit_to_base_clocks_matrix:
+Batched version of fit_to_base_clocks for a long-format (itemid, clock, value) frame.
+
+All items are resampled onto base_clocks in one pass with searchsorted/reduceat
+instead of running the scalar while-loop per item. The result per item is the
+same as fit_to_base_clocks on that item's clock-sorted rows.
+
+Args:
+    df (pd.DataFrame): Frame with itemid, clock and value columns.
+    base_clocks (list[int]): Sorted base clock grid.
+
+Returns:
+    Tuple[np.ndarray, np.ndarray]: itemids (sorted) and an items x base_clocks float matrix.
+"""
+def fit_to_base_clocks_matrix(df: pd.DataFrame, base_clocks: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+    B = np.asarray(base_clocks, dtype=np.int64)
+    n_base = len(B)
+    if len(df) == 0 or n_base == 0:
+        return np.array([], dtype=np.int64), np.empty((0, n_base))
+
+    df = df.sort_values(['itemid', 'clock'], kind='mergesort')
+    item_arr = df['itemid'].to_numpy()
+    c = df['clock'].to_numpy().astype(np.int64)
+    v = df['value'].to_numpy().astype(np.float64)
+    itemIds, starts, counts = np.unique(item_arr, return_index=True, return_counts=True)
+    n_items = len(itemIds)
+    codes = np.repeat(np.arange(n_items, dtype=np.int64), counts)
+
+    # L[k, i]: number of item k's clocks earlier than base_clocks[i]
+    offset = min(c.min(), B[0])
+    span = max(c.max(), B[-1]) - offset + 1
+    keys = codes * span + (c - offset)
+    queries = np.arange(n_items, dtype=np.int64)[:, None] * span + (B - offset)[None, :]
+    gpos = np.searchsorted(keys, queries, side='left')
+    L = gpos - starts[:, None]
+    n = counts[:, None]
+
+    # loop stops at the first base clock after all of the item's clocks are consumed
+    exhausted = L >= n
+    gpos_safe = np.minimum(gpos, len(c) - 1)
+    exact = ~exhausted & (c[gpos_safe] == B[None, :])
+
+    # values since the previous exact match are averaged into an exact match
+    next_start = np.where(exact, L + 1, 0)
+    start = np.maximum.accumulate(next_start, axis=1)
+    start = np.concatenate([np.zeros((n_items, 1), dtype=start.dtype), start[:, :-1]], axis=1)
+
+    new_values = v[gpos_safe]
+    if exact.any():
+        s_idx = (starts[:, None] + start)[exact]
+        e_idx = (gpos + 1)[exact]
+        v_ext = np.append(v, 0.0)
+        bounds = np.empty(len(s_idx) * 2, dtype=np.int64)
+        bounds[0::2] = s_idx
+        bounds[1::2] = e_idx
+        sums = np.add.reduceat(v_ext, bounds)[0::2]
+        new_values[exact] = sums / (e_idx - s_idx)
+
+    last_idx = starts + counts - 1
+    new_values = np.where(exhausted, v[last_idx][:, None], new_values)
+
+    # remaining clocks after the last base clock are blended into the last value
+    j_end = L[:, -1] + exact[:, -1]
+    tail = ~exhausted[:, -1] & (j_end < counts)
+    if tail.any():
+        t_start = (starts + j_end)[tail]
+        t_end = (starts + counts)[tail]
+        v_ext = np.append(v, 0.0)
+        bounds = np.empty(len(t_start) * 2, dtype=np.int64)
+        bounds[0::2] = t_start
+        bounds[1::2] = t_end
+        tail_mean = np.add.reduceat(v_ext, bounds)[0::2] / (t_end - t_start)
+        new_values[tail, -1] = (new_values[tail, -1] + tail_mean) / 2.0
+
+    # same length as base_clocks: values are taken as they are
+    same_len = counts == n_base
+    if same_len.any():
+        rows = np.flatnonzero(same_len)
+        new_values[rows] = v[starts[rows][:, None] + np.arange(n_base)[None, :]]
+
+    return itemIds, new_values
+
+
+def matrix2df(itemIds: np.ndarray, base_clocks: List[int], matrix: np.ndarray) -> pd.DataFrame:
+    """
+    Convert an items x base_clocks matrix back to a long (itemid, clock, value) frame.
+    """
+    n_base = len(base_clocks)
+    return pd.DataFrame({
+        'itemid': np.repeat(itemIds, n_base),
+        'clock': np.tile(np.asarray(base_clocks, dtype=np.int64), len(itemIds)),
+        'value': matrix.reshape(-1),
+    })
+
+
+""" group_long_df:
+Makes the rows of each item contiguous in a long-format frame, using group
+boundaries instead of per-row Python loops.
+
+Items keep the order of their first row and rows keep their order within an
+item. A frame already grouped by itemid (e.g. ORDER BY itemid, clock) is not
+copied.
+
+Args:
+    df (pd.DataFrame): Frame with an itemid column.
+
+Returns:
+    Tuple[np.ndarray, np.ndarray, pd.DataFrame]: itemids, bounds and the grouped
+    frame, rows bounds[k]:bounds[k+1] belonging to itemids[k].
+"""
+def group_long_df(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, pd.DataFrame]:
+    if len(df) == 0:
+        return np.array([], dtype=np.int64), np.zeros(1, dtype=np.int64), df
+    codes, itemIds = pd.factorize(df['itemid'].to_numpy(dtype=np.int64))
+    if np.any(codes[1:] < codes[:-1]):
+        order = np.argsort(codes, kind='stable')
+        df = df.iloc[order]
+        codes = codes[order]
+    bounds = np.zeros(len(itemIds) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=len(itemIds)), out=bounds[1:])
+    return itemIds, bounds, df
+
+
+""" long2charts:
+Per item value Series of a long-format (itemid, clock, value) frame.
+Each Series is a zero-copy view of one value array, indexed from 0.
+"""
+def long2charts(df: pd.DataFrame, column: str = 'value') -> Dict[int, pd.Series]:
+    if len(df) == 0:
+        return {}
+    itemIds, bounds, df = group_long_df(df)
+    values = df[column].to_numpy(dtype=np.float64)
+    return {int(itemId): pd.Series(values[bounds[k]:bounds[k+1]], copy=False)
+            for k, itemId in enumerate(itemIds)}
+
+
+""" long2chart_matrix:
+Items x points matrix of a long-format (itemid, clock, value) frame, the k-th
+value of each item in column k and NaN after the item's last value.
+
+Returns:
+    Tuple[np.ndarray, np.ndarray]: itemids in the order of their first row and the matrix.
+"""
+def long2chart_matrix(df: pd.DataFrame, column: str = 'value') -> Tuple[np.ndarray, np.ndarray]:
+    if len(df) == 0:
+        return np.array([], dtype=np.int64), np.empty((0, 0))
+    itemIds, bounds, df = group_long_df(df)
+    counts = np.diff(bounds)
+    matrix = np.full((len(itemIds), counts.max()), np.nan)
+    rows = np.repeat(np.arange(len(itemIds)), counts)
+    cols = np.arange(bounds[-1]) - np.repeat(bounds[:-1], counts)
+    matrix[rows, cols] = df[column].to_numpy(dtype=np.float64)
+    return itemIds, matrix
+
+
+""" charts2matrix:
+Items x points matrix of charts like long2chart_matrix, for charts that were
+not built from a long-format frame.
+
+Returns:
+    Tuple[np.ndarray, np.ndarray]: itemids in the order of charts and the matrix.
+"""
+def charts2matrix(charts: Dict[int, pd.Series]) -> Tuple[np.ndarray, np.ndarray]:
+    if len(charts) == 0:
+        return np.array([], dtype=np.int64), np.empty((0, 0))
+    counts = np.array([len(series) for series in charts.values()], dtype=np.int64)
+    matrix = np.full((len(charts), counts.max()), np.nan)
+    for k, series in enumerate(charts.values()):
+        matrix[k, :counts[k]] = series.to_numpy(dtype=np.float64)
+    return np.array(list(charts.keys()), dtype=np.int64), matrix
+
+
 def normalize_metric_df(data: pd.DataFrame) -> pd.DataFrame:
     """
     Normalize the metric data frame by scaling the values to a range of 0 to 1.
@@ -98,13 +270,11 @@ def df2charts(df: pd.DataFrame,
     # sort the base clocks
     base_clocks.sort()
     charts = {}
+    fitted_itemIds, matrix = fit_to_base_clocks_matrix(df[df['itemid'].isin(itemIds)], base_clocks)
+    rows = {itemId: k for k, itemId in enumerate(fitted_itemIds.tolist())}
     for itemId in itemIds:
-        #charts[itemId] = history_df[history_df['itemid'] == itemId]['value'].reset_index(drop=True)
-        clocks = df[df['itemid'] == itemId]['clock'].tolist()
-        values = df[df['itemid'] == itemId]['value'].tolist()
-        if len(values) > 0:
-            values = fit_to_base_clocks(base_clocks, clocks, values)
-            charts[itemId] = pd.Series(values)
+        if itemId in rows:
+            charts[itemId] = pd.Series(matrix[rows[itemId]])
     return charts, base_clocks
 
 def get_chart_stats(df: pd.DataFrame, itemIds: List[int]) -> Dict[int, Dict[str, float]]:
@@ -11,6 +11,7 @@ import __init__
 from views.view import View
 from models.models_set import ModelsSet
 import data_getter
+import utils.normalizer as normalizer
 
 
 CAT_BY_GROUP = "bygroup"
@@ -57,7 +58,7 @@ class FlaskView(View):
     # generate chart from metric data
     # df: DataFrame with columns ['itemid', 'clock', 'value']
     def _generate_charts_in_group(self, df: pd.DataFrame, properties: Dict) -> str: 
-        itemIds = df['itemid'].unique()
+        itemIds, bounds, df = normalizer.group_long_df(df)
         fig = make_subplots(
             rows=self.max_vertical_charts, 
             cols=self.max_horizontal_charts, 
@@ -83,15 +84,15 @@ class FlaskView(View):
             
 
         for i, itemId in enumerate(itemIds):
-            item_df = df[df['itemid'] == itemId]
-            item_df['clock'] = pd.to_datetime(item_df['clock'], unit='s').dt.strftime("%m-%d %H")
+            item_df = df.iloc[bounds[i]:bounds[i+1]]
+            clocks = pd.to_datetime(item_df['clock'], unit='s').dt.strftime("%m-%d %H")
             row = (i // self.max_horizontal_charts) + 1
             col = (i % self.max_horizontal_charts) + 1
 
 
             fig.add_trace(
             go.Scatter(
-                x=item_df['clock'], 
+                x=clocks, 
                 y=item_df['value'].apply(lambda x: f"{x:.4g}"), 
                 mode="lines", 
                 name=f"{properties[itemId]['item_name']}"